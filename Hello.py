@@ -1,6 +1,8 @@
 import streamlit as st
 from streamlit.logger import get_logger
 
+import utils
+
 LOGGER = get_logger(__name__)   
 
 
@@ -22,6 +24,9 @@ def run():
     """
     )
 
+    # The page is on screen; load the heavy modules the other pages need meanwhile
+    utils.warm_up()
+
 
 if __name__ == "__main__":
     run()
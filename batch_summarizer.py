@@ -0,0 +1,278 @@
+"""
+Summarize many documents at once, from the Doc Summarizer page or headless:
+
+    python batch_summarizer.py transcripts/ --out summaries/ --prompt earnings --model gpt-3.5-turbo-16k
+
+Files are loaded and tokenized in a process pool, the LLM calls of all documents share
+one concurrency limit, and each summary is written to the output directory as soon as
+it is ready. A manifest in the output directory records finished documents, so a rerun
+after a crash only pays for the documents that are still missing.
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import compression
+import ingest
+import llm_pool
+import prompts
+import scheduler
+from summarize import MapReduceSummarizer
+import token_counter
+from utils import save_file
+
+MANIFEST_FILE = "manifest.json"
+SUPPORTED_EXTENSIONS = ('.pdf', '.txt')
+
+
+class Source:
+    """A document to summarize, either a path on disk or the bytes of an upload."""
+
+    def __init__(self, name, data=None, path=None):
+        self.name = name
+        self.path = path
+        self.data = data
+        if data is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+        self.digest = hashlib.sha256(data).hexdigest()
+
+
+def sources_from_paths(paths):
+    """
+    Expand files and directories into Sources, in a stable order.
+
+    :param paths: File or directory paths. Directories are searched recursively for pdf and txt files.
+
+    :return: A list of Sources.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in names if name.lower().endswith(SUPPORTED_EXTENSIONS))
+        else:
+            files.append(path)
+    return [Source(os.path.basename(path), path=path) for path in sorted(files)]
+
+
+def sources_from_uploads(uploaded_files):
+    """
+    :param uploaded_files: Streamlit UploadedFiles.
+
+    :return: A list of Sources.
+    """
+    return [Source(file.name, data=file.getvalue()) for file in uploaded_files]
+
+
+def output_dir(folder, root):
+    """
+    Resolve an output folder chosen on the page, which may only name a directory under root.
+
+    :param folder: The folder name entered by the user, e.g. 'q3-earnings'.
+
+    :param root: The directory all page batches write under.
+
+    :return: The absolute path of the folder.
+    """
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, folder.strip()))
+    if not folder.strip() or os.path.commonpath([root, path]) != root or path == root:
+        raise ValueError(f"Choose a folder name such as 'q3-earnings', not {folder!r}.")
+    return path
+
+
+def load_source(name, path=None, data=None, compress=False):
+    """
+    Load and tokenize one document. Runs in a worker process.
+
+    :param compress: Drop headers, footers, page numbers and boilerplate (see compression).
+
+    :return: A (documents, token_count, tokens_before_compression) tuple.
+    """
+    if data is None:
+        with open(path, 'rb') as f:
+            data = f.read()
+    documents = ingest.parse_bytes(name, data)
+    tokens_before = token_counter.count_documents(documents)
+    if compress:
+        documents, _ = compression.compress_documents(documents)
+    token_count = token_counter.count_documents(documents)
+    return documents, token_count, tokens_before
+
+
+class BatchSummarizer:
+
+    def __init__(self, out_dir, model, prompt_name, concurrency=4, load_workers=None, api_key=None, compress=False):
+        """
+        :param out_dir: Where summaries and the manifest are written.
+
+        :param model: The OpenAI chat model name.
+
+        :param prompt_name: A key of prompts.get_prompts().
+
+        :param concurrency: The most LLM calls in flight across all documents.
+
+        :param load_workers: Processes used to load and tokenize files, defaults to the CPU count.
+
+        :param api_key: The OpenAI API key, defaults to the session's (see llm_pool.current_api_key).
+
+        :param compress: Compress documents before summarizing them (see compression).
+        """
+        self.out_dir = out_dir
+        self.model = model
+        self.prompt_name = prompt_name
+        self.prompt = prompts.get_prompts()[prompt_name]
+        self.concurrency = concurrency
+        self.load_workers = load_workers
+        self.compress = compress
+        # Resolved here: the LLM calls run on worker threads, outside the Streamlit session
+        self.api_key = api_key or llm_pool.current_api_key()
+        self.limiter = threading.BoundedSemaphore(concurrency)
+        self.manifest_path = os.path.join(out_dir, MANIFEST_FILE)
+        os.makedirs(out_dir, exist_ok=True)
+        self.manifest = self._read_manifest()
+
+    def _read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_manifest(self):
+        # Replace atomically so a crash never leaves a truncated manifest behind
+        temp_path = self.manifest_path + '.tmp'
+        save_file(json.dumps(self.manifest, indent=2), temp_path)
+        os.replace(temp_path, self.manifest_path)
+
+    def key(self, source):
+        return f"{source.digest}:{self.prompt_name}:{self.model}{':compressed' if self.compress else ''}"
+
+    def is_done(self, source):
+        entry = self.manifest.get(self.key(source))
+        return bool(entry) and os.path.exists(os.path.join(self.out_dir, entry['output']))
+
+    def output_name(self, source):
+        # The same fields as key(), so another model or compression setting gets its own file
+        stem = os.path.splitext(source.name)[0]
+        return f"{stem}-{source.digest[:8]}.{self.prompt_name}.{self.model}{'.compressed' if self.compress else ''}.md"
+
+    def summarize(self, documents):
+        # Bulk work: the scheduler serves chat turns on the same key first
+        llm = llm_pool.get_chat_model(self.model, api_key=self.api_key, max_retries=0, priority=scheduler.BULK)
+        summarizer = MapReduceSummarizer(
+            llm,
+            self.prompt,
+            token_counter.max_prompt_tokens(self.model),
+            max_workers=self.concurrency,
+            limiter=self.limiter
+        )
+        return summarizer.summarize(documents)
+
+    def run(self, sources, on_result=None):
+        """
+        Summarize every source that the manifest does not list as done.
+
+        :param sources: The Sources to summarize.
+
+        :param on_result: Optional callback(result, done, total), called from the calling
+            thread as each document finishes. result is a dict with name, output,
+            tokens, seconds and either summary or error.
+
+        :return: The list of results for the documents processed in this run.
+        """
+        pending = [source for source in sources if not self.is_done(source)]
+        results = []
+        if not pending:
+            return results
+
+        # spawn, so workers never inherit the Streamlit server's threads and locks (as in ingest)
+        loaders = ProcessPoolExecutor(max_workers=self.load_workers, mp_context=multiprocessing.get_context("spawn"))
+        with loaders, ThreadPoolExecutor(max_workers=self.concurrency) as workers:
+            loading = {loaders.submit(load_source, source.name, source.path, source.data, self.compress): source for source in pending}
+            summarizing = {}
+            while loading or summarizing:
+                done, _ = wait(list(loading) + list(summarizing), return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in loading:
+                        source = loading.pop(future)
+                        try:
+                            documents, tokens, tokens_before = future.result()
+                        except Exception as e:
+                            result = self._finish(source, None, 0, 0, error=e)
+                        else:
+                            # Loaded; summarize it while the other files keep loading
+                            summarizing[workers.submit(self._timed_summarize, documents)] = (source, tokens, tokens_before)
+                            continue
+                    else:
+                        source, tokens, tokens_before = summarizing.pop(future)
+                        try:
+                            summary, seconds = future.result()
+                        except Exception as e:
+                            result = self._finish(source, None, tokens, 0, error=e)
+                        else:
+                            result = self._finish(source, summary, tokens, seconds, tokens_before)
+                    results.append(result)
+                    if on_result:
+                        on_result(result, len(results), len(pending))
+        return results
+
+    def _timed_summarize(self, documents):
+        start = time.time()
+        return self.summarize(documents), time.time() - start
+
+    def _finish(self, source, summary, tokens, seconds, tokens_before=None, error=None):
+        """Write a finished summary and record it in the manifest straight away."""
+        result = {'name': source.name, 'output': self.output_name(source), 'tokens': tokens, 'seconds': round(seconds, 2)}
+        if self.compress and tokens_before is not None:
+            result['tokens_before'] = tokens_before
+        if error is not None:
+            result['error'] = str(error)
+            return result
+        save_file(summary, os.path.join(self.out_dir, result['output']))
+        self.manifest[self.key(source)] = dict(result, finished=time.time())
+        self._write_manifest()
+        result['summary'] = summary
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize many pdf or txt documents concurrently.")
+    parser.add_argument('inputs', nargs='+', help="Files or directories to summarize.")
+    parser.add_argument('--out', required=True, help="Output directory for the summaries and the manifest.")
+    parser.add_argument('--prompt', default='short_default', choices=list(prompts.get_prompts()))
+    parser.add_argument('--model', default='gpt-3.5-turbo-16k', choices=list(token_counter.MODEL_LIMITS))
+    parser.add_argument('--concurrency', type=int, default=4, help="Most LLM calls in flight at once.")
+    parser.add_argument('--load-workers', type=int, default=None, help="Processes used to load files.")
+    parser.add_argument('--compress', action='store_true', help="Drop headers, footers, page numbers and boilerplate first.")
+    args = parser.parse_args()
+
+    if not os.environ.get('OPENAI_API_KEY'):
+        parser.error("Set OPENAI_API_KEY to run the batch.")
+
+    batch = BatchSummarizer(args.out, args.model, args.prompt, args.concurrency, args.load_workers, api_key=os.environ['OPENAI_API_KEY'], compress=args.compress)
+    sources = sources_from_paths(args.inputs)
+    skipped = sum(batch.is_done(source) for source in sources)
+    if skipped:
+        print(f"Skipping {skipped} document(s) already summarized in {args.out}")
+
+    def report(result, done, total):
+        status = f"FAILED: {result['error']}" if 'error' in result else f"{result['tokens']} tokens, {result['seconds']}s"
+        if 'tokens_before' in result:
+            status += f", compressed from {result['tokens_before']} tokens"
+        print(f"[{done}/{total}] {result['name']} -> {result['output']} ({status})")
+
+    results = batch.run(sources, on_result=report)
+    failed = sum('error' in result for result in results)
+    print(f"Done: {len(results) - failed} summarized, {failed} failed, {skipped} skipped.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,5 @@
+"""
+Offline benchmarks for FundBridge-GPT. Run them from the repository root, e.g.
+
+    python -m benchmarks.chunk_sizes
+"""
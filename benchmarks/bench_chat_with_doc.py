@@ -0,0 +1,49 @@
+"""
+The two Chat with Doc pages answering a question about an upload, through
+CustomDataChatbot.setup_qa_chain and the query pipeline:
+
+    cold       a file nobody has indexed: parse, chunk, embed, index, then answer
+    warm       a new session on a file indexed before: load the index from the disk cache
+    follow_up  a second question in the same session: retrieval and generation only
+"""
+
+import itertools
+
+import pytest
+
+from benchmarks.corpus import CORPUS_SIZES, make_upload
+from benchmarks.page_driver import page_app
+
+PAGES = {"chat_with_doc": "pages/1_Chat_with_Doc.py", "chat_with_large_doc": "pages/2_Chat_with_Large_Doc.py"}
+
+# Every cold round gets a filing with a new seed, so no cache has seen it
+_seeds = itertools.count(1000)
+
+
+def ask(at, question):
+    return at.chat_input[0].set_value(question).run()
+
+
+@pytest.mark.parametrize("kind", ["txt", "pdf"])
+@pytest.mark.parametrize("scenario", ["cold", "warm", "follow_up"])
+@pytest.mark.parametrize("page", sorted(PAGES))
+def bench_chat_with_doc(benchmark, page, scenario, size, kind):
+    pages = CORPUS_SIZES[size]
+    upload, facts = make_upload(kind, pages, seed=next(_seeds))
+    if scenario == "warm":
+        # Index the file once, in another session
+        assert not ask(page_app(PAGES[page], [upload]).run(), facts[0][0]).exception
+
+    def setup():
+        if scenario == "cold":
+            cold_upload, cold_facts = make_upload(kind, pages, seed=next(_seeds))
+            at = page_app(PAGES[page], [cold_upload]).run()
+            return (at, cold_facts[1][0]), {}
+        at = page_app(PAGES[page], [upload]).run()
+        if scenario == "follow_up":
+            ask(at, facts[0][0])
+        return (at, facts[1][0]), {}
+
+    at = benchmark.pedantic(ask, setup=setup)
+    assert not at.exception, at.exception[0].value
+    benchmark.extra_info.update(pages=pages, bytes=upload.size)
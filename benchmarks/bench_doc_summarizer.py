@@ -0,0 +1,37 @@
+"""
+Doc Summarizer end to end: parse, tokenize and summarize an upload, by clicking the
+page's Summarize button. With the 128K-context model the medium corpus still fits in one
+'stuff' call; the 4K model sends everything bigger than a few pages through the
+map-reduce summarizer.
+"""
+
+import pytest
+
+from benchmarks.corpus import CORPUS_SIZES, make_upload
+from benchmarks.page_driver import page_app
+
+PAGE = "pages/0_Doc_Summarizer.py"
+
+
+@pytest.mark.parametrize("kind", ["txt", "pdf"])
+@pytest.mark.parametrize("model", ["gpt-4-turbo-preview", "gpt-3.5-turbo"])
+def bench_doc_summarizer(benchmark, size, kind, model):
+    upload, _ = make_upload(kind, CORPUS_SIZES[size])
+
+    def setup():
+        at = page_app(PAGE, [upload])
+        at.run()
+        at.sidebar.selectbox[0].set_value(model).run()
+        return (at,), {}
+
+    def summarize(at):
+        return at.button[0].click().run()
+
+    at = benchmark.pedantic(summarize, setup=setup)
+    assert not at.exception, at.exception[0].value
+    assert any(area.label == "SUMMARY" for area in at.text_area)
+    benchmark.extra_info.update(
+        pages=CORPUS_SIZES[size],
+        bytes=upload.size,
+        map_reduce=any("in parts" in str(markdown.value) for markdown in at.markdown)
+    )
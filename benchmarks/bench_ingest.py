@@ -0,0 +1,51 @@
+"""
+The ingest stages on their own, without Streamlit: parsing uploads, token-aware
+splitting, embedding into a FAISS index (with an instant fake model, so this is the
+local overhead) and hybrid retrieval.
+"""
+
+import pytest
+
+import chunking
+import index_cache
+import ingest
+from fake_llm import FakeEmbeddings
+from retrieval import HybridRetriever, LexicalIndex
+
+from benchmarks.corpus import CORPUS_SIZES, make_upload
+
+
+@pytest.mark.parametrize("kind", ["txt", "pdf"])
+def bench_parse(benchmark, size, kind):
+    upload, _ = make_upload(kind, CORPUS_SIZES[size])
+    docs = benchmark(lambda: list(ingest.iter_documents([upload])))
+    benchmark.extra_info.update(pages=len(docs), bytes=upload.size)
+
+
+def bench_split(benchmark, size):
+    upload, _ = make_upload("txt", CORPUS_SIZES[size])
+    docs = list(ingest.iter_documents([upload]))
+    splitter = chunking.make_splitter(400, 50)
+    chunks = benchmark(lambda: list(chunking.iter_chunks(docs, splitter)))
+    benchmark.extra_info.update(chunks=len(chunks))
+
+
+def bench_embed_and_index(benchmark, size):
+    upload, _ = make_upload("txt", CORPUS_SIZES[size])
+    chunks = list(chunking.iter_chunks(ingest.iter_documents([upload]), chunking.make_splitter(400, 50)))
+    db = benchmark(lambda: index_cache.add_documents(iter(chunks), FakeEmbeddings()))
+    benchmark.extra_info.update(vectors=db.index.ntotal)
+
+
+def bench_retrieve(benchmark, size):
+    upload, facts = make_upload("txt", CORPUS_SIZES[size])
+    chunks = list(chunking.iter_chunks(ingest.iter_documents([upload]), chunking.make_splitter(400, 50)))
+    db = index_cache.add_documents(iter(chunks), FakeEmbeddings())
+    retriever = HybridRetriever(vectorstore=db, lexical=LexicalIndex.from_faiss(db), k=2, fetch_k=20)
+    questions = [question for question, _ in facts]
+
+    def ask_all():
+        return [retriever.rank(question) for question in questions]
+
+    benchmark(ask_all)
+    benchmark.extra_info.update(queries=len(questions), per_query_ms=benchmark.stats["median"] / len(questions) * 1000)
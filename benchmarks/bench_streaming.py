@@ -0,0 +1,41 @@
+"""
+StreamHandler rendering a streamed answer: the cost per token of buffering, flushing
+and re-rendering the unfinished paragraph, for a short and a long answer.
+"""
+
+import pytest
+import streamlit as st
+
+from streaming import StreamHandler
+
+SENTENCE = "Revenue grew 12% to $4,210 million, driven by services and a stronger mix. "
+
+
+def make_tokens(count):
+    """Word tokens with a paragraph break every 60 tokens and one code block."""
+    words = SENTENCE.split(" ")
+    tokens = []
+    for i in range(count):
+        token = words[i % len(words)] + " "
+        if i % 60 == 59:
+            token += "\n\n"
+        tokens.append(token)
+    tokens[count // 2] += "\n```\nsegment  revenue\nservices 1,234\n```\n"
+    return tokens
+
+
+@pytest.mark.parametrize("flush_tokens", [1, 20])
+@pytest.mark.parametrize("tokens", [300, 3000])
+def bench_stream_handler(benchmark, tokens, flush_tokens):
+    stream = make_tokens(tokens)
+
+    def render():
+        handler = StreamHandler(st.empty(), flush_tokens=flush_tokens)
+        for token in stream:
+            handler.on_llm_new_token(token)
+        handler.on_llm_end(None)
+        return handler
+
+    handler = benchmark(render)
+    assert handler.token_count == tokens
+    benchmark.extra_info.update(tokens=tokens, per_token_us=benchmark.stats["median"] / tokens * 1e6)
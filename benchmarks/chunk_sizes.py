@@ -0,0 +1,86 @@
+"""
+Compare retrieval quality and indexing time across chunk sizes, offline:
+
+    python -m benchmarks.chunk_sizes --sizes 100 200 400 800 --pages 100
+
+Every page of a synthetic filing holds one fact; for each fact the benchmark asks its
+question and checks whether the answer is in the top-k retrieved chunks. It also
+reports how many prompt tokens those k chunks cost.
+"""
+
+import argparse
+import json
+import tempfile
+import time
+
+from langchain.docstore.document import Document
+
+import chunking
+import index_cache
+import token_counter
+from embedding_store import CachedEmbeddings, EmbeddingStore
+from fake_llm import FakeEmbeddings
+
+from benchmarks.corpus import make_filing
+
+
+def run(chunk_sizes, pages=100, k=2, overlap_ratio=0.125, request_latency=0.05):
+    """
+    :return: A list of result dicts, one per chunk size.
+    """
+    page_texts, facts = make_filing(pages)
+    results = []
+    for size in chunk_sizes:
+        docs = [Document(page_content=text, metadata={"source": "synthetic.pdf", "page": i}) for i, text in enumerate(page_texts)]
+        fake = FakeEmbeddings(request_latency=request_latency)
+        with tempfile.TemporaryDirectory() as store_dir:
+            # A private store, so no chunk size benefits from another's cached vectors
+            embeddings = CachedEmbeddings(fake, store=EmbeddingStore(fake.model, directory=store_dir))
+            splitter = chunking.make_splitter(size, int(size * overlap_ratio))
+
+            start = time.perf_counter()
+            db = index_cache.add_documents(chunking.iter_chunks(docs, splitter), embeddings)
+            index_seconds = time.perf_counter() - start
+            index_requests = fake.requests
+
+            hits, context_tokens = 0, 0
+            start = time.perf_counter()
+            for question, answer in facts:
+                retrieved = db.similarity_search(question, k=k)
+                hits += any(answer in doc.page_content for doc in retrieved)
+                context_tokens += sum(token_counter.document_tokens(doc) for doc in retrieved)
+            query_seconds = time.perf_counter() - start
+
+        results.append({
+            "chunk_size": size,
+            "chunks": db.index.ntotal,
+            "embedding_requests": index_requests,
+            "index_seconds": round(index_seconds, 3),
+            f"hit_rate@{k}": round(hits / len(facts), 3),
+            "avg_context_tokens": round(context_tokens / len(facts), 1),
+            "query_ms": round(1000 * query_seconds / len(facts), 2),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 200, 400, 800, 1600])
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("-k", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per fake embedding request.")
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.pages, args.k, request_latency=args.latency)
+    columns = list(results[0])
+    print("  ".join(f"{column:>18}" for column in columns))
+    for result in results:
+        print("  ".join(f"{result[column]:>18}" for column in columns))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+pytest setup for the benchmark suites (bench_*.py), run from the repository root:
+
+    python -m pytest benchmarks
+    python -m pytest benchmarks -k streaming --bench-rounds 10 --bench-sizes small medium large
+    python -m pytest benchmarks --bench-save                       # keep this run as a baseline
+    python -m pytest benchmarks --bench-baseline benchmarks/results/RUN.json
+
+Everything runs offline on the fake backend (fake_llm.py) with a fresh cache
+directory. The `benchmark` fixture follows pytest-benchmark's interface:
+benchmark(fn, *args) times fn over several rounds, benchmark.pedantic(fn, setup=...)
+runs an untimed setup before every round, and benchmark.extra_info is stored with the
+result. With --bench-save the run is stored in benchmarks/results/ (not tracked: timings
+only compare on the machine that made them), and with --bench-baseline it is compared with
+a stored run.
+"""
+
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+# Before any app module is imported: they read these at import time
+os.environ["FUNDBRIDGE_LLM_BACKEND"] = "fake"
+os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+os.environ.setdefault("FUNDBRIDGE_TRACE_FILE", "off")
+# Measure the app, not the org's rate limits (the scheduler still queues and coalesces)
+os.environ.setdefault("FUNDBRIDGE_RATE_LIMITS", "off")
+_SCRATCH = tempfile.mkdtemp(prefix="fundbridge-bench-")
+os.environ.setdefault("FUNDBRIDGE_CACHE_DIR", os.path.join(_SCRATCH, "cache"))
+os.environ.setdefault("FUNDBRIDGE_KB_DIR", os.path.join(_SCRATCH, "knowledge_base"))
+
+import pytest
+
+from benchmarks import results
+from benchmarks.corpus import CORPUS_SIZES
+
+_collected = []
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmarks")
+    group.addoption("--bench-rounds", type=int, default=3, help="Timed rounds per benchmark.")
+    group.addoption("--bench-sizes", nargs="+", default=["small", "medium"], choices=sorted(CORPUS_SIZES), help="Corpus sizes to run.")
+    group.addoption("--bench-save", action="store_true", help="Store this run in benchmarks/results.")
+    group.addoption("--bench-baseline", help="A stored run to compare this one with.")
+    group.addoption("--bench-fail-on-regression", action="store_true", help="Fail if a median regressed against the baseline.")
+
+
+def pytest_generate_tests(metafunc):
+    if "size" in metafunc.fixturenames:
+        metafunc.parametrize("size", metafunc.config.getoption("bench_sizes"))
+
+
+class Benchmark:
+
+    def __init__(self, name, rounds):
+        self.name = name
+        self.rounds = rounds
+        self.extra_info = {}
+        self.stats = None
+
+    def __call__(self, target, *args, **kwargs):
+        return self.pedantic(target, args, kwargs)
+
+    def pedantic(self, target, args=(), kwargs=None, setup=None, rounds=None, iterations=1, warmup_rounds=0):
+        """
+        Time target(*args, **kwargs).
+
+        :param setup: Optional function run untimed before every round; if it returns
+            something, that is the (args, kwargs) of the round.
+
+        :param rounds: Timed rounds, defaults to --bench-rounds.
+
+        :param iterations: Calls per round; the round's time is divided by it.
+
+        :param warmup_rounds: Untimed rounds before the timed ones.
+
+        :return: The result of the last call.
+        """
+        rounds = rounds or self.rounds
+        kwargs = kwargs or {}
+        times = []
+        result = None
+        for round_number in range(warmup_rounds + rounds):
+            call_args, call_kwargs = args, kwargs
+            if setup is not None:
+                prepared = setup()
+                if prepared is not None:
+                    call_args, call_kwargs = prepared
+            start = time.perf_counter()
+            for _ in range(iterations):
+                result = target(*call_args, **call_kwargs)
+            if round_number >= warmup_rounds:
+                times.append((time.perf_counter() - start) / iterations)
+        self.stats = {
+            "min": min(times),
+            "max": max(times),
+            "mean": statistics.fmean(times),
+            "median": statistics.median(times),
+            "stddev": statistics.stdev(times) if len(times) > 1 else 0.0,
+            "rounds": len(times),
+            "iterations": iterations,
+        }
+        return result
+
+
+@pytest.fixture
+def benchmark(request):
+    bench = Benchmark(request.node.name, request.config.getoption("bench_rounds"))
+    yield bench
+    if bench.stats is not None:
+        _collected.append({"name": bench.name, "stats": bench.stats, "extra_info": bench.extra_info})
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_SCRATCH, ignore_errors=True)
+    config = session.config
+    config._bench_report = []
+    if not _collected:
+        return
+    baseline = config.getoption("bench_baseline")
+    if baseline:
+        old = results.load(baseline)
+        current = {"commit": "this run", "created": "now", "machine": results.machine_info(), "benchmarks": _collected}
+        rows, regressions = results.compare(old, current)
+        if rows:
+            config._bench_report.append(results.format_comparison(old, current, rows))
+        if regressions and config.getoption("bench_fail_on_regression"):
+            config._bench_report.append(f"{len(regressions)} benchmark(s) regressed.")
+            session.exitstatus = 1
+    if config.getoption("bench_save"):
+        config._bench_report.append(f"Saved to {results.save(_collected)}")
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    if not _collected:
+        return
+    width = max(len(bench["name"]) for bench in _collected)
+    terminalreporter.section("benchmarks")
+    terminalreporter.write_line(f"{'name':<{width}}  {'median':>10}  {'min':>10}  {'max':>10}  rounds")
+    for bench in _collected:
+        stats = bench["stats"]
+        terminalreporter.write_line(
+            f"{bench['name']:<{width}}  {stats['median'] * 1000:8.1f}ms  {stats['min'] * 1000:8.1f}ms  "
+            f"{stats['max'] * 1000:8.1f}ms  {stats['rounds']}"
+        )
+    for line in getattr(config, "_bench_report", []):
+        terminalreporter.write_line(line)
@@ -0,0 +1,138 @@
+"""
+Synthetic filings for the benchmarks: pages of filler text with one known fact per page,
+plus questions whose answer is that fact. Filings can be rendered as plain text or as
+minimal PDFs, in the sizes of CORPUS_SIZES, and wrapped like Streamlit uploads.
+"""
+
+import os
+import random
+
+COMPANIES = ["Acme Corp", "Globex", "Initech", "Umbrella", "Stark Industries", "Wayne Enterprises", "Hooli", "Soylent"]
+METRICS = ["free cash flow", "operating income", "revenue", "gross margin", "capital expenditure", "net debt", "EBITDA", "share buybacks"]
+PERIODS = ["Q1 2023", "Q2 2023", "Q3 2023", "Q4 2023", "fiscal 2022", "fiscal 2023"]
+# Pages per corpus size
+CORPUS_SIZES = {"small": 5, "medium": 50, "large": 200}
+FILLER = (
+    "management discussed the operating environment and the outlook for the business "
+    "the company continues to invest in its platform and its people across every region "
+    "customers responded well to the new products and demand remained healthy overall "
+    "the board reviewed strategic priorities and the capital allocation framework "
+    "costs were managed carefully while the team executed on the roadmap for the year"
+).split()
+
+
+def filler_sentence(rng, words=18):
+    return " ".join(rng.choice(FILLER) for _ in range(words)).capitalize() + "."
+
+
+def make_filing(pages=50, sentences_per_page=30, seed=0):
+    """
+    Build a synthetic filing.
+
+    :param pages: The number of pages.
+
+    :param sentences_per_page: Filler sentences per page; one of them is replaced by a fact.
+
+    :param seed: The random seed, the same seed always gives the same filing.
+
+    :return: A (page_texts, facts) tuple, where facts is a list of (question, answer)
+        tuples and answer is a string that appears verbatim on exactly one page.
+    """
+    rng = random.Random(seed)
+    page_texts, facts = [], []
+    for page in range(pages):
+        company, metric, period = rng.choice(COMPANIES), rng.choice(METRICS), rng.choice(PERIODS)
+        answer = f"${rng.randint(100, 99999):,}.{page % 10} million"
+        sentences = [filler_sentence(rng) for _ in range(sentences_per_page)]
+        sentences[rng.randrange(sentences_per_page)] = f"{company} reported {metric} of {answer} for {period}."
+        page_texts.append("\n".join(" ".join(sentences[i:i + 3]) for i in range(0, sentences_per_page, 3)))
+        facts.append((f"What was the {metric} of {company} in {period}?", answer))
+    return page_texts, facts
+
+
+def make_pdf(page_texts):
+    """
+    Render pages of text as a minimal PDF, one text line per line of the page.
+
+    :return: The PDF bytes, readable by pypdf like a real filing.
+    """
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{4 + 2 * i} 0 R" for i in range(len(page_texts)))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(page_texts)} >>".encode())
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for i, text in enumerate(page_texts):
+        lines = "".join(
+            "(" + line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ") Tj T* "
+            for line in text.split("\n")
+        )
+        stream = f"BT /F1 10 Tf 12 TL 50 750 Td {lines}ET".encode("latin-1", "replace")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>".encode()
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+class UploadedFile:
+    """An in-memory file with the name and getvalue() of a Streamlit UploadedFile."""
+
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+        self.size = len(data)
+
+    def getvalue(self):
+        return self.data
+
+    @classmethod
+    def from_path(cls, path):
+        with open(path, "rb") as f:
+            return cls(os.path.basename(path), f.read())
+
+
+def make_upload(kind="txt", pages=CORPUS_SIZES["small"], seed=0):
+    """
+    Build a synthetic filing as an upload.
+
+    :param kind: 'txt' or 'pdf'.
+
+    :param pages: The number of pages.
+
+    :param seed: The filing's seed; different seeds give different files (and cache keys).
+
+    :return: A (UploadedFile, facts) tuple, see make_filing().
+    """
+    page_texts, facts = make_filing(pages, seed=seed)
+    name = f"filing-{pages}p-{seed}.{kind}"
+    if kind == "pdf":
+        return UploadedFile(name, make_pdf(page_texts)), facts
+    return UploadedFile(name, "\n\n".join(page_texts).encode("utf-8")), facts
+
+
+def write_corpus(directory, sizes=CORPUS_SIZES, kinds=("txt", "pdf")):
+    """
+    Write one synthetic filing per size and kind to a directory.
+
+    :return: The paths written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for seed, (size, pages) in enumerate(sorted(sizes.items(), key=lambda item: item[1])):
+        for kind in kinds:
+            upload, _ = make_upload(kind, pages, seed)
+            path = os.path.join(directory, f"{size}.{kind}")
+            with open(path, "wb") as f:
+                f.write(upload.getvalue())
+            paths.append(path)
+    return paths
@@ -0,0 +1,126 @@
+"""
+Compare the vector_index types on synthetic embeddings, offline:
+
+    python -m benchmarks.index_types --vectors 100000 --dimension 384 -k 4
+
+Vectors are drawn around random cluster centers, like embeddings of chunks about a
+limited number of topics, and the queries are perturbed copies of stored vectors. Recall@k
+is measured against exact flat search. Each index is written to disk and searched
+memory-mapped, as the pages do, and the report shows its file size and how much the
+process RSS grew while loading and searching it. Mapped file pages count towards RSS
+once touched, but they are shared by every session and process reading the same file.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+import vector_index
+
+
+def make_embeddings(count, dimension, clusters=256, seed=0):
+    """
+    :return: A float32 array of count unit vectors grouped around clusters centers.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, count)] + 0.6 * rng.standard_normal((count, dimension)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def make_queries(vectors, count, noise=0.05, seed=1):
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.integers(0, len(vectors), count)] + noise * rng.standard_normal((count, vectors.shape[1])).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def rss_bytes():
+    """Resident set size of this process, or 0 where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def recall(found, truth):
+    k = truth.shape[1]
+    return float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)]))
+
+
+def run(count=50000, dimension=384, queries=500, k=4, index_types=("flat", "ivf", "ivfpq", "hnsw")):
+    """
+    :return: A list of result dicts, one per index type.
+    """
+    vectors = make_embeddings(count, dimension)
+    query_vectors = make_queries(vectors, queries)
+    _, truth = vector_index.build(vectors, "flat").search(query_vectors, k)
+
+    # Train whatever is asked for, however small the benchmark corpus
+    threshold, vector_index.TRAIN_THRESHOLD = vector_index.TRAIN_THRESHOLD, 0
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            for index_type in index_types:
+                start = time.perf_counter()
+                index = vector_index.build(vectors, index_type)
+                build_seconds = time.perf_counter() - start
+                path = os.path.join(directory, f"{index_type}.faiss")
+                faiss.write_index(index, path)
+                del index
+
+                before = rss_bytes()
+                index = vector_index.read_mmap(path)
+                latencies = []
+                found = []
+                for query in query_vectors:
+                    start = time.perf_counter()
+                    _, positions = index.search(query[None, :], k)
+                    latencies.append(time.perf_counter() - start)
+                    found.append(positions[0])
+                rss_growth = rss_bytes() - before
+
+                results.append({
+                    "index_type": index_type,
+                    "index": vector_index.describe(index),
+                    "build_seconds": round(build_seconds, 2),
+                    f"recall@{k}": round(recall(found, truth), 3),
+                    "p50_ms": round(1000 * float(np.percentile(latencies, 50)), 3),
+                    "p99_ms": round(1000 * float(np.percentile(latencies, 99)), 3),
+                    "file_mb": round(os.path.getsize(path) / 2 ** 20, 1),
+                    "rss_growth_mb": round(rss_growth / 2 ** 20, 1),
+                })
+                del index
+    finally:
+        vector_index.TRAIN_THRESHOLD = threshold
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=50000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("-k", type=int, default=4)
+    parser.add_argument("--types", nargs="+", default=["flat", "ivf", "ivfpq", "hnsw"], choices=vector_index.INDEX_TYPES[1:])
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    results = run(args.vectors, args.dimension, args.queries, args.k, args.types)
+    columns = list(results[0])
+    print("  ".join(f"{column:>30}" if column == "index" else f"{column:>13}" for column in columns))
+    for result in results:
+        print("  ".join(f"{result[column]:>30}" if column == "index" else f"{result[column]:>13}" for column in columns))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
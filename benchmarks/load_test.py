@@ -0,0 +1,346 @@
+"""
+Load test: how many simultaneous analysts one app process serves before latency falls apart.
+
+    python -m benchmarks.load_test --concurrency 1 2 4 8 16
+    python -m benchmarks.load_test --latency 0.5 --tokens-per-second 40 --json load.json
+    python -m benchmarks.load_test --baseline load.json --tolerance 0.25
+
+Every simulated analyst is a headless session of the real pages (benchmarks/page_driver.py
+under streamlit.testing.v1.AppTest), all served by this process the way a Streamlit
+server serves its sessions, one script thread each. The sessions run on the fake backend
+(fake_llm.py), with the latency set by --latency, --tokens-per-second and
+--embed-latency, and take turns through the SCRIPTS:
+
+    summarize  upload a filing and summarize it on the Doc Summarizer
+    doc_chat   upload a filing and ask several questions about it on Chat with Doc
+    chat       several turns on the Basic ChatBot
+
+For each concurrency level, all analysts start together and each runs --scripts-per-user
+scripts in turn. A level reports:
+- time to first token (TTFT), from the start of a request's trace to its first streamed
+  token, or to the end of a request that does not stream (a stuff summary);
+- request latency, from sending the input to the page finishing its rerun;
+- throughput in requests per second;
+- the peak and final RSS of the process.
+
+With --baseline, the run fails if any level's p95 TTFT grew, or its throughput fell, by
+more than the tolerance.
+"""
+
+import os
+import tempfile
+
+# Before any app module is imported: they read these at import time
+os.environ["FUNDBRIDGE_LLM_BACKEND"] = "fake"
+os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+os.environ.setdefault("FUNDBRIDGE_RATE_LIMITS", "off")
+os.environ.setdefault("FUNDBRIDGE_MEMORY_PANEL", "0")
+_SCRATCH = tempfile.mkdtemp(prefix="fundbridge-load-")
+os.environ.setdefault("FUNDBRIDGE_CACHE_DIR", os.path.join(_SCRATCH, "cache"))
+os.environ.setdefault("FUNDBRIDGE_KB_DIR", os.path.join(_SCRATCH, "knowledge_base"))
+os.environ["FUNDBRIDGE_TRACE_FILE"] = os.path.join(_SCRATCH, "spans.jsonl")
+
+import argparse
+import contextlib
+import itertools
+import json
+import shutil
+import sys
+import threading
+import time
+
+from benchmarks.corpus import make_upload
+from benchmarks.page_driver import concurrent_sessions, page_app
+
+SCRIPTS = ["summarize", "doc_chat", "chat"]
+PAGES = {
+    "summarize": "pages/0_Doc_Summarizer.py",
+    "doc_chat": "pages/1_Chat_with_Doc.py",
+    "chat": "pages/3_Basic_ChatBot.py",
+}
+CHAT_QUESTIONS = [
+    "How did the quarter go?",
+    "What drove the change in margin?",
+    "What is the outlook for next year?",
+    "Which risks should an analyst watch?",
+]
+PERCENTILES = [50, 95, 99]
+RSS_INTERVAL = 0.1
+
+# Every upload gets a new seed, so no index or response cache has seen it
+_seeds = itertools.count(1)
+_seeds_lock = threading.Lock()
+
+
+def _upload(pages):
+    with _seeds_lock:
+        seed = next(_seeds)
+    return make_upload("txt", pages, seed=seed)
+
+
+def percentile(values, p):
+    """Return the p-th percentile of values (nearest rank), or None if there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, round(p / 100 * len(ordered) + 0.5) - 1))]
+
+
+def _check(at, script):
+    if at.exception:
+        error = at.exception[0]
+        # The innermost frame of the page's traceback says where it failed
+        where = next((line.strip() for line in reversed(error.stack_trace) if line.strip().startswith("File ")), "")
+        raise RuntimeError(f"{error.value} ({where})" if where else error.value)
+    return at
+
+
+def run_script(script, user, turns, pages):
+    """
+    Run one script as one analyst, in a new session.
+
+    :param script: One of SCRIPTS.
+
+    :param user: The analyst's number, to keep questions distinct between sessions.
+
+    :param turns: Questions asked by the chat scripts.
+
+    :param pages: Pages of the uploaded filing.
+
+    :return: The latency of each request, in seconds.
+    """
+    latencies = []
+
+    def timed(action):
+        start = time.perf_counter()
+        at = _check(action(), script)
+        latencies.append(time.perf_counter() - start)
+        return at
+
+    if script == "summarize":
+        upload, _ = _upload(pages)
+        at = _check(page_app(PAGES[script], [upload]).run(), script)
+        timed(lambda: at.button[0].click().run())
+    elif script == "doc_chat":
+        upload, facts = _upload(pages)
+        at = _check(page_app(PAGES[script], [upload]).run(), script)
+        for question, _ in facts[:turns]:
+            timed(lambda: at.chat_input[0].set_value(question).run())
+    else:
+        at = _check(page_app(PAGES[script]).run(), script)
+        for turn in range(turns):
+            question = f"{CHAT_QUESTIONS[turn % len(CHAT_QUESTIONS)]} (analyst {user}, turn {turn + 1})"
+            timed(lambda: at.chat_input[0].set_value(question).run())
+    return latencies
+
+
+def read_ttfts(path, offset):
+    """
+    Return the TTFT of every trace exported to path after offset, and the new offset.
+
+    A trace's TTFT runs from its start to the end of its first 'first_token' span, or to
+    its end if nothing streamed.
+    """
+    traces = {}
+    try:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+    except OSError:
+        return [], offset
+    for line in data.splitlines():
+        record = json.loads(line)
+        trace = traces.setdefault(record["traceId"], {"start": None, "end": None, "first_token": None})
+        if record["parentSpanId"] is None:
+            trace["start"], trace["end"] = record["startTimeUnixNano"], record["endTimeUnixNano"]
+        elif record["name"] == "first_token":
+            trace["first_token"] = record["endTimeUnixNano"]
+    ttfts = [
+        ((trace["first_token"] or trace["end"]) - trace["start"]) / 1e9
+        for trace in traces.values() if trace["start"] is not None
+    ]
+    return ttfts, offset + len(data)
+
+
+class RssSampler:
+    """Samples the process RSS in the background, keeping the peak."""
+
+    def __init__(self, interval=RSS_INTERVAL):
+        import session_resources
+        self._rss = session_resources.process_rss
+        self.interval = interval
+        self.peak = self._rss() or 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self._rss() or 0)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._rss() or 0)
+
+
+def run_level(concurrency, scripts_per_user, turns, pages):
+    """
+    Run concurrency analysts at once, each through scripts_per_user scripts.
+
+    :return: A result dict for the level.
+    """
+    import session_resources
+    import tracing
+    trace_path = tracing.trace_file()
+    _, offset = read_ttfts(trace_path, 0)
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def analyst(user):
+        for i in range(scripts_per_user):
+            script = SCRIPTS[(user + i) % len(SCRIPTS)]
+            try:
+                result = run_script(script, user, turns, pages)
+            except Exception as e:
+                with lock:
+                    errors.append(f"{script}: {type(e).__name__}: {e}")
+                continue
+            with lock:
+                latencies.extend(result)
+
+    threads = [threading.Thread(target=analyst, args=(user,), name=f"analyst-{user}") for user in range(concurrency)]
+    with concurrent_sessions(), RssSampler() as rss:
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - start
+    ttfts, _ = read_ttfts(trace_path, offset)
+    final_rss = session_resources.process_rss() or 0
+
+    def ms(values, p):
+        value = percentile(values, p)
+        return None if value is None else round(value * 1000, 1)
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "error_samples": errors[:3],
+        "seconds": round(seconds, 3),
+        "throughput": round(len(latencies) / seconds, 3) if seconds else 0.0,
+        "ttft_ms": {f"p{p}": ms(ttfts, p) for p in PERCENTILES},
+        "latency_ms": {f"p{p}": ms(latencies, p) for p in PERCENTILES},
+        "peak_rss_mb": round(rss.peak / 2 ** 20, 1),
+        "rss_mb": round(final_rss / 2 ** 20, 1),
+    }
+
+
+def warm_up(turns, pages):
+    """Run every script once, so imports and first-use setup don't count against level 1."""
+    for user, script in enumerate(SCRIPTS):
+        run_script(script, user, min(turns, 1), pages)
+
+
+def format_row(result):
+    ttft, latency = result["ttft_ms"], result["latency_ms"]
+
+    def cell(value):
+        return f"{value:>8.0f}" if value is not None else f"{'-':>8}"
+
+    return (
+        f"{result['concurrency']:>5} {result['requests']:>8} {result['errors']:>6} {result['throughput']:>9.2f}  "
+        + " ".join(cell(ttft[f"p{p}"]) for p in PERCENTILES) + "  "
+        + " ".join(cell(latency[f"p{p}"]) for p in PERCENTILES)
+        + f"  {result['peak_rss_mb']:>8.0f} {result['rss_mb']:>8.0f}"
+    )
+
+
+HEADER = (
+    f"{'users':>5} {'requests':>8} {'errors':>6} {'req/s':>9}  "
+    + " ".join(f"{f'ttft p{p}':>8}" for p in PERCENTILES) + "  "
+    + " ".join(f"{f'lat p{p}':>8}" for p in PERCENTILES)
+    + f"  {'peak MB':>8} {'rss MB':>8}"
+)
+
+
+def regressions(results, baseline, tolerance):
+    """
+    :return: A list of messages for the levels whose p95 TTFT grew, or whose throughput
+        fell, by more than the tolerance (a fraction, e.g. 0.25) against the baseline.
+    """
+    before = {result["concurrency"]: result for result in baseline}
+    found = []
+    for result in results:
+        previous = before.get(result["concurrency"])
+        if previous is None:
+            continue
+        ttft, old_ttft = result["ttft_ms"]["p95"], previous["ttft_ms"]["p95"]
+        if ttft is not None and old_ttft and ttft > old_ttft * (1 + tolerance):
+            found.append(f"{result['concurrency']} users: p95 TTFT {ttft:.0f}ms, was {old_ttft:.0f}ms")
+        if previous["throughput"] and result["throughput"] < previous["throughput"] * (1 - tolerance):
+            found.append(f"{result['concurrency']} users: {result['throughput']:.2f} req/s, was {previous['throughput']:.2f}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8], help="Simultaneous analysts, one level each.")
+    parser.add_argument("--scripts-per-user", type=int, default=3, help="Scripts each analyst runs in turn.")
+    parser.add_argument("--turns", type=int, default=3, help="Questions per chat script.")
+    parser.add_argument("--pages", type=int, default=5, help="Pages of each uploaded filing.")
+    parser.add_argument("--latency", type=float, help="Fake model: seconds before the first token.")
+    parser.add_argument("--tokens-per-second", type=float, help="Fake model: streaming rate.")
+    parser.add_argument("--embed-latency", type=float, help="Fake embeddings: seconds per request.")
+    parser.add_argument("--json", help="Also write the results to this file.")
+    parser.add_argument("--baseline", help="Results from an earlier run to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed change against the baseline.")
+    args = parser.parse_args()
+
+    for name, value in [
+        ("FUNDBRIDGE_FAKE_LATENCY", args.latency),
+        ("FUNDBRIDGE_FAKE_TOKENS_PER_SECOND", args.tokens_per_second),
+        ("FUNDBRIDGE_FAKE_EMBED_LATENCY", args.embed_latency),
+    ]:
+        if value is not None:
+            os.environ[name] = str(value)
+
+    # The pages' verbose chains print their prompts; keep them out of the table
+    quiet = open(os.devnull, "w")
+    try:
+        with contextlib.redirect_stdout(quiet):
+            warm_up(args.turns, args.pages)
+        print(HEADER)
+        results = []
+        for concurrency in args.concurrency:
+            with contextlib.redirect_stdout(quiet):
+                result = run_level(concurrency, args.scripts_per_user, args.turns, args.pages)
+            results.append(result)
+            print(format_row(result), flush=True)
+            for error in result["error_samples"]:
+                print(f"      error: {error}")
+    finally:
+        quiet.close()
+        shutil.rmtree(_SCRATCH, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    failed = any(result["errors"] for result in results)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for message in found:
+            print(f"REGRESSION {message}")
+        failed = failed or bool(found)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Runs one of the app's pages under streamlit.testing.v1.AppTest with synthetic uploads.
+
+AppTest cannot upload files, so this script replaces st.file_uploader with a function
+returning the files listed in the session state, then runs the page as Streamlit would:
+
+    at = page_app("pages/1_Chat_with_Doc.py", [UploadedFile(...)])
+    at.run()
+
+Run it with FUNDBRIDGE_LLM_BACKEND=fake (see llm_pool) to stay offline. To run several
+sessions at once from different threads, as the load test does, wrap them in
+concurrent_sessions().
+"""
+
+import os
+import runpy
+import sys
+from contextlib import contextmanager
+
+import streamlit as st
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGE_KEY = "_bench_page"
+FILES_KEY = "_bench_files"
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def page_app(page, files=(), api_key="sk-fake", timeout=300):
+    """
+    :param page: The page script, relative to the repository root.
+
+    :param files: What st.file_uploader returns, e.g. benchmarks.corpus.UploadedFile objects.
+
+    :return: An AppTest for the page that has not run yet.
+    """
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(os.path.abspath(__file__), default_timeout=timeout)
+    at.session_state[PAGE_KEY] = page
+    at.session_state[FILES_KEY] = list(files)
+    at.session_state["OPENAI_API_KEY"] = api_key
+    return at
+
+
+@contextmanager
+def concurrent_sessions():
+    """
+    Let AppTests run at the same time on different threads.
+
+    Every AppTest run installs a mock Runtime and patches config.get_option for its
+    duration, then removes both. When runs overlap, the first to finish pulls the
+    runtime out from under the others ("Runtime hasn't been created!"), and the patches
+    unwind out of order. Inside this block a runtime is always installed, and the real
+    config.get_option is put back at the end.
+    """
+    from unittest.mock import MagicMock
+
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.media_file_manager import MediaFileManager
+
+    fallback = MagicMock(spec=Runtime)
+    fallback.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    instance = Runtime.__dict__["instance"]
+    get_option = config.get_option
+    Runtime.instance = classmethod(lambda cls: cls._instance or fallback)
+    try:
+        yield
+    finally:
+        Runtime.instance = instance
+        config.get_option = get_option
+
+
+def file_uploader(label, type=None, accept_multiple_files=False, **kwargs):
+    files = st.session_state.get(FILES_KEY) or []
+    if accept_multiple_files:
+        return list(files)
+    return files[0] if files else None
+
+
+if __name__ == "__main__":
+    st.file_uploader = file_uploader
+    runpy.run_path(os.path.join(ROOT, st.session_state[PAGE_KEY]), run_name="__main__")
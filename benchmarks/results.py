@@ -0,0 +1,128 @@
+"""
+Stored benchmark results, one JSON file per run of the bench_*.py suites saved with
+--bench-save, so a regression between commits shows up as a slower median for the same
+benchmark:
+
+    python -m benchmarks.results                  # the last two stored runs
+    python -m benchmarks.results OLD.json NEW.json
+
+Runs are only comparable when they were made on the same machine with the same fake
+backend settings; both are stored with the run.
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import time
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+# A median this much slower than the previous run's is reported as a regression
+REGRESSION_RATIO = 1.2
+FAKE_SETTINGS = ["FUNDBRIDGE_FAKE_LATENCY", "FUNDBRIDGE_FAKE_TOKENS_PER_SECOND", "FUNDBRIDGE_FAKE_EMBED_LATENCY"]
+
+
+def _git(*args):
+    try:
+        return subprocess.run(["git", *args], capture_output=True, text=True, timeout=10, cwd=RESULTS_DIR).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def machine_info():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "fake_backend": {name: os.environ.get(name) for name in FAKE_SETTINGS},
+    }
+
+
+def save(benchmarks, directory=RESULTS_DIR):
+    """
+    Store the results of a run.
+
+    :param benchmarks: A list of {'name', 'stats', 'extra_info'} dicts.
+
+    :return: The path of the results file.
+    """
+    os.makedirs(directory, exist_ok=True)
+    commit = _git("rev-parse", "--short", "HEAD") or "unknown"
+    dirty = bool(_git("status", "--porcelain", "--untracked-files=no"))
+    run = {
+        "commit": commit,
+        "dirty": dirty,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": machine_info(),
+        "benchmarks": benchmarks,
+    }
+    path = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}_{commit}{'-dirty' if dirty else ''}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(run, f, indent=1)
+    return path
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def saved_runs(directory=RESULTS_DIR):
+    """Return the stored result files, oldest first."""
+    return sorted(glob.glob(os.path.join(directory, "*.json")))
+
+
+def compare(old, new, ratio=REGRESSION_RATIO):
+    """
+    Compare two runs benchmark by benchmark.
+
+    :param old: The earlier run, as returned by load().
+
+    :param new: The later run.
+
+    :return: A list of (name, old_median, new_median, change) tuples for the benchmarks
+        in both runs, and the list of names whose median grew by more than ratio.
+    """
+    before = {bench["name"]: bench["stats"]["median"] for bench in old["benchmarks"]}
+    rows = []
+    regressions = []
+    for bench in new["benchmarks"]:
+        name, median = bench["name"], bench["stats"]["median"]
+        if name not in before:
+            continue
+        change = median / before[name] if before[name] else float("inf")
+        rows.append((name, before[name], median, change))
+        if change > ratio:
+            regressions.append(name)
+    return rows, regressions
+
+
+def format_comparison(old, new, rows):
+    lines = [f"Compared with {old['commit']} ({old['created']}):"]
+    if old.get("machine") != new.get("machine"):
+        lines.append("  (different machine or fake backend settings, timings may not be comparable)")
+    width = max((len(name) for name, *_ in rows), default=10)
+    for name, before, after, change in rows:
+        flag = "  REGRESSION" if change > REGRESSION_RATIO else ""
+        lines.append(f"  {name:<{width}}  {before * 1000:10.1f}ms -> {after * 1000:10.1f}ms  {change - 1:+7.1%}{flag}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("runs", nargs="*", help="Two result files; defaults to the last two stored runs.")
+    args = parser.parse_args()
+    paths = args.runs or saved_runs()[-2:]
+    if len(paths) != 2:
+        parser.error("Need two result files to compare.")
+    old, new = load(paths[0]), load(paths[1])
+    rows, regressions = compare(old, new)
+    print(format_comparison(old, new, rows))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
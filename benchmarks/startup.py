@@ -0,0 +1,131 @@
+"""
+Measure the import cost of Hello.py and every page with `python -X importtime`:
+
+    python -m benchmarks.startup --repeat 3 --json startup.json
+    python -m benchmarks.startup --baseline startup.json --tolerance 0.25
+
+Each script runs in a fresh interpreter under a run name other than '__main__', so its
+top-level imports (and Streamlit calls, in bare mode) execute but the page's main() does
+not. The cost of starting the interpreter is measured once and subtracted. With
+--baseline, the run fails if any script got slower than the baseline by more than the
+tolerance, so import regressions get caught.
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+RUNNER = "import runpy, sys; sys.path.insert(0, {root!r}); runpy.run_path({path!r}, run_name='__startup__')"
+
+
+def scripts():
+    return [os.path.join(ROOT, "Hello.py")] + sorted(glob.glob(os.path.join(ROOT, "pages", "*.py")))
+
+
+def import_times(code):
+    """
+    Run code in a fresh interpreter with -X importtime.
+
+    :return: A dict mapping every imported module to its cumulative import time in seconds,
+        and the total of the top-level imports.
+    """
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    modules, total = {}, 0.0
+    for line in proc.stderr.splitlines():
+        match = LINE.match(line)
+        if not match:
+            continue
+        cumulative = int(match.group(2)) / 1e6
+        modules[match.group(4)] = cumulative
+        if not match.group(3):
+            total += cumulative
+    return modules, total
+
+
+def measure(path, baseline_modules, baseline_total, repeat=3, top=5):
+    """
+    :param baseline_modules: The modules imported by the bare interpreter, from import_times().
+
+    :param baseline_total: Their total import time, subtracted from the script's.
+
+    :return: A result dict for one script: its import seconds (best of repeat runs) and
+        its slowest top-level imports.
+    """
+    best = None
+    for _ in range(repeat):
+        modules, total = import_times(RUNNER.format(root=ROOT, path=path))
+        if best is None or total < best[1]:
+            best = (modules, total)
+    modules, total = best
+    own = {name: seconds for name, seconds in modules.items() if name not in baseline_modules}
+    slowest = sorted(own.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {
+        "script": os.path.relpath(path, ROOT),
+        "import_seconds": round(max(total - baseline_total, 0.0), 3),
+        "modules": len(own),
+        "slowest": [[name, round(seconds, 3)] for name, seconds in slowest],
+    }
+
+
+def run(repeat=3, top=5):
+    """
+    :return: A list of result dicts, one per script.
+    """
+    baseline_modules, baseline_total = import_times(RUNNER.format(root=ROOT, path=os.devnull))
+    results = []
+    for path in scripts():
+        results.append(measure(path, baseline_modules, baseline_total, repeat, top))
+    return results
+
+
+def regressions(results, baseline, tolerance):
+    """
+    :return: A list of (script, seconds, baseline_seconds) for scripts that got slower
+        than their baseline by more than the tolerance (a fraction, e.g. 0.25).
+    """
+    before = {result["script"]: result["import_seconds"] for result in baseline}
+    slower = []
+    for result in results:
+        previous = before.get(result["script"])
+        if previous is not None and result["import_seconds"] > previous * (1 + tolerance):
+            slower.append((result["script"], result["import_seconds"], previous))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per script; the fastest is kept.")
+    parser.add_argument("--top", type=int, default=5, help="Slowest imports listed per script.")
+    parser.add_argument("--json", help="Also write the results to this file.")
+    parser.add_argument("--baseline", help="Results from an earlier run to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown over the baseline.")
+    args = parser.parse_args()
+
+    results = run(args.repeat, args.top)
+    for result in results:
+        slowest = ", ".join(f"{name} {seconds}s" for name, seconds in result["slowest"])
+        print(f"{result['script']:<36} {result['import_seconds']:>7}s  {result['modules']:>5} modules  ({slowest})")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            slower = regressions(results, json.load(f), args.tolerance)
+        for script, seconds, previous in slower:
+            print(f"REGRESSION {script}: {seconds}s, was {previous}s")
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Per-session chat transcripts for the chat pages.
+
+Each session appends its messages to its own JSONL file in the local cache. Only the
+byte offset of every message and the last few messages are kept in memory, so a long
+session costs little RAM, and the pages render a recent window and read earlier pages
+from disk on demand.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import session_resources
+import utils
+
+SESSION_KEY = "chat_history"
+RECENT_MESSAGES = 50
+# Transcripts of sessions that have not written for this long are deleted
+MAX_AGE_SECONDS = int(os.environ.get("FUNDBRIDGE_CHAT_HISTORY_MAX_AGE", str(7 * 24 * 3600)))
+
+_purged = False
+_purge_lock = threading.Lock()
+
+
+class ChatHistory:
+
+    def __init__(self, path, recent=RECENT_MESSAGES):
+        """
+        :param path: The JSONL file holding this transcript; existing messages are kept.
+
+        :param recent: The number of latest messages kept in memory.
+        """
+        self.path = path
+        self.offsets = []
+        self.recent = deque(maxlen=recent)
+        if os.path.exists(path):
+            self._scan()
+
+    def _scan(self):
+        with open(self.path, "r+b") as f:
+            offset = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Torn by an interrupted append; drop it so the next message starts a line
+                    f.truncate(offset)
+                    break
+                self.offsets.append(offset)
+                self.recent.append(json.loads(line))
+                offset += len(line)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def append(self, role, content):
+        """
+        Append a message to the transcript.
+
+        :param role: 'user' or 'assistant'.
+
+        :param content: The message text.
+        """
+        message = {"role": role, "content": content}
+        line = (json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8")
+        with open(self.path, "ab") as f:
+            self.offsets.append(f.tell())
+            f.write(line)
+        self.recent.append(message)
+
+    def messages(self, start, stop=None):
+        """
+        Return the messages in [start, stop), reading from disk only what is not in memory.
+
+        :param start: The index of the first message.
+
+        :param stop: One past the last message, defaults to the end.
+
+        :return: A list of {'role', 'content'} dicts.
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        start = max(0, start)
+        if start >= stop:
+            return []
+        first_recent = len(self) - len(self.recent)
+        if start >= first_recent:
+            return list(self.recent)[start - first_recent:stop - first_recent]
+        with open(self.path, "rb") as f:
+            f.seek(self.offsets[start])
+            return [json.loads(f.readline()) for _ in range(stop - start)]
+
+    def clear(self):
+        """Delete the transcript."""
+        self.offsets = []
+        self.recent.clear()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def purge(directory, max_age=MAX_AGE_SECONDS):
+    """Delete transcripts that have not been written to for max_age seconds."""
+    now = time.time()
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if name.endswith(".jsonl") and now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def get_history():
+    """
+    Return this session's ChatHistory, creating its file on first use or reading it back
+    after the session was evicted.
+
+    Old transcripts left behind by finished sessions are purged once per process.
+    """
+    global _purged
+    history = session_resources.get(SESSION_KEY)
+    if history is None:
+        directory = utils.get_cache_dir("chat_history")
+        with _purge_lock:
+            if not _purged:
+                _purged = True
+                purge(directory)
+        # No spill: the transcript is on disk, and an evicted history is read back from it
+        path = os.path.join(directory, f"{session_resources.session_id()}.jsonl")
+        history = session_resources.put(SESSION_KEY, ChatHistory(path))
+    return history
@@ -0,0 +1,55 @@
+"""
+Token-aware chunking for the Chat with Doc pages.
+
+Chunks are sized in tiktoken tokens rather than characters, so the chunk size maps
+directly onto the embedding input limit and the prompt budget of the retrieved context.
+"""
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+import token_counter
+import tracing
+
+
+def make_splitter(chunk_size, chunk_overlap, separators=None, encoding_name=token_counter.DEFAULT_ENCODING):
+    """
+    Build a splitter that measures chunk_size and chunk_overlap in tokens.
+
+    :param chunk_size: The most tokens in one chunk.
+
+    :param chunk_overlap: The tokens shared by consecutive chunks.
+
+    :param separators: Optional separators, tried in order, for the recursive split.
+
+    :return: A RecursiveCharacterTextSplitter.
+    """
+    kwargs = {"separators": separators} if separators else {}
+    return RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        encoding_name=encoding_name,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        **kwargs
+    )
+
+
+def iter_chunks(documents, splitter):
+    """
+    Split documents into chunks as they arrive.
+
+    Each chunk keeps its document's metadata, plus its position in the document under
+    'chunk' and its token count under 'token_count'.
+
+    :param documents: An iterable of Documents, e.g. the generator from ingest.iter_documents.
+
+    :param splitter: The splitter from make_splitter().
+
+    :return: A generator of chunk Documents.
+    """
+    for doc in documents:
+        with tracing.span("split") as span:
+            chunks = splitter.split_documents([doc])
+            counts = token_counter.count_batch([chunk.page_content for chunk in chunks])
+            span.set(chunks=len(chunks), tokens=sum(counts))
+        for number, (chunk, count) in enumerate(zip(chunks, counts)):
+            chunk.metadata.update(chunk=number, token_count=count)
+            yield chunk
@@ -0,0 +1,318 @@
+"""
+Extractive pre-compression of documents before they are summarized, on the CPU only.
+
+Earnings call transcripts and research PDFs carry a lot of text no summary needs:
+running headers and footers, page numbers, safe-harbor and disclaimer paragraphs, and the
+operator's call instructions. compress_documents() removes those, and with a
+target_tokens budget also keeps only the sentences that score highest on financial
+figures and terms, in their original order. A compressed document fits the single
+'stuff' call on smaller models more often, which is faster and cheaper than map-reduce.
+
+    compressed, reports = compression.compress_documents(pages, target_tokens=12000)
+    st.caption(compression.format_report(reports[0]))
+"""
+
+import math
+import re
+from collections import Counter
+
+from langchain.docstore.document import Document
+
+import token_counter
+import tracing
+
+# Lines at the top and bottom of a page where headers and footers are looked for
+EDGE_LINES = 3
+# A line is page furniture if it sits at the edge of at least this share of the pages
+FURNITURE_SHARE = 0.5
+# Boilerplate sentences that make up at least this share of a paragraph drop the paragraph
+BOILERPLATE_SHARE = 0.5
+# Ranked selection stops this far below the target, for the separators it adds back
+BUDGET_MARGIN = 0.98
+
+PAGE_NUMBER_RE = re.compile(r"^\s*(?:-\s*)?(?:page\s*)?\d{1,4}(?:\s*(?:of|/)\s*\d{1,4})?(?:\s*-)?\s*$", re.IGNORECASE)
+# A line that is nothing but a filing's form name, e.g. "FORM 10-K" or "Form 10-Q Q3 2023"
+FORM_HEADER_RE = re.compile(
+    r"^\s*(?:(?:annual|quarterly) report on )?form 10-[kq](?:/a)?"
+    r"(?:\s*[-|,]?\s*(?:fiscal (?:year|quarter)\s*)?(?:\d{4}|q[1-4](?:\s*\d{4})?))?\s*$",
+    re.IGNORECASE
+)
+SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+# "Operator:", "John Smith, CFO:" and the like start a speaker's turn in a transcript
+SPEAKER_RE = re.compile(r"^[A-Z][^:.!?]{0,60}:\s")
+BOILERPLATE_RE = re.compile("|".join([
+    # Safe harbor and legal disclaimers
+    r"forward[- ]looking (?:statement|information)",
+    r"safe harbor",
+    r"private securities litigation reform act",
+    r"(?:actual )?results (?:could|may|might) differ materially",
+    r"undue reliance",
+    r"undertakes? no (?:obligation|duty)",
+    r"reconciliations? (?:of|to|between) (?:non-gaap|gaap)",
+    r"for informational purposes only",
+    r"not an offer to (?:buy|sell)",
+    r"past performance is not",
+    r"all rights reserved",
+    r"copyright (?:©|\(c\)|\d{4})",
+    # Operator instructions on earnings calls
+    r"\(operator instructions?\)",
+    r"press (?:star|\*)\s*(?:one|1|zero|0)",
+    r"thank you for standing by",
+    r"(?:call|conference) is being recorded",
+    r"listen-only mode",
+    r"you may (?:now )?disconnect",
+    r"(?:replay|archive) of (?:this|the|today's) (?:call|webcast)",
+    r"(?:would|will) now like to turn the (?:call|conference) over",
+]), re.IGNORECASE)
+# Amounts, percentages and other figures a financial summary is built from
+FIGURE_RE = re.compile(
+    r"[$€£¥]\s?\d|\d(?:[\d,]*\d)?(?:\.\d+)?\s?(?:%|percent\b|bps\b|basis points|x\b|(?:million|billion|thousand|mm|bn|m|b|k)\b)",
+    re.IGNORECASE
+)
+FINANCIAL_TERMS_RE = re.compile(r"\b(?:" + "|".join([
+    r"revenue", r"sales", r"earnings", r"eps", r"margin", r"ebitda?", r"operating income", r"net income",
+    r"free cash ?flow", r"cash flow", r"guidance", r"outlook", r"forecast", r"dividends?", r"buybacks?",
+    r"repurchases?", r"capex", r"capital expenditures?", r"debt", r"leverage", r"valuation", r"multiple",
+    r"yield", r"growth", r"year[- ]over[- ]year", r"quarter[- ]over[- ]quarter", r"acquisitions?", r"merger",
+]) + r")\b", re.IGNORECASE)
+
+
+def _line_key(line):
+    """Normalize a line so the same header with a different page or date matches."""
+    return re.sub(r"\s+", " ", re.sub(r"\d+", "#", line.strip().lower()))
+
+
+def _edge_keys(lines):
+    # Bare numbers are left to page_number_lines(), or every figure in a table would match "#"
+    content = [line for line in lines if line.strip() and not PAGE_NUMBER_RE.match(line)]
+    return {_line_key(line) for line in content[:EDGE_LINES] + content[-EDGE_LINES:]}
+
+
+def find_furniture(pages):
+    """
+    :param pages: The text of each page of one document.
+
+    :return: The normalized keys (see _line_key) of lines repeated at the top or bottom
+        of at least FURNITURE_SHARE of the pages, i.e. running headers and footers.
+    """
+    if len(pages) < 3:
+        return set()
+    counts = Counter(key for page in pages for key in _edge_keys(page.splitlines()))
+    needed = max(2, math.ceil(FURNITURE_SHARE * len(pages)))
+    return {key for key, count in counts.items() if count >= needed and key}
+
+
+def page_number_lines(pages):
+    """
+    Find page numbers: the first or last non-blank line of a page, when it is a number
+    that says "page" or that follows the page order on at least FURNITURE_SHARE of the
+    pages (e.g. 3, 4, 5 on the third, fourth and fifth page). A number anywhere else, or
+    one that does not count the pages, is content, e.g. the last row of a table.
+
+    :param pages: The text of each page of one document.
+
+    :return: One set per page with the indexes (in text.splitlines()) of its page number lines.
+    """
+    edges = []
+    for text in pages:
+        lines = text.splitlines()
+        content = [i for i, line in enumerate(lines) if line.strip()]
+        ends = {}
+        if content:
+            for edge, i in (("first", content[0]), ("last", content[-1])):
+                if PAGE_NUMBER_RE.match(lines[i]):
+                    ends[edge] = (i, int(re.search(r"\d+", lines[i]).group()), "page" in lines[i].lower())
+        edges.append(ends)
+
+    found = [set() for _ in pages]
+    needed = max(2, math.ceil(FURNITURE_SHARE * len(pages)))
+    for edge in ("first", "last"):
+        offsets = Counter(ends[edge][1] - index for index, ends in enumerate(edges) if edge in ends)
+        offset, count = offsets.most_common(1)[0] if offsets else (None, 0)
+        for index, ends in enumerate(edges):
+            if edge not in ends:
+                continue
+            i, number, labelled = ends[edge]
+            if labelled or (count >= needed and number - index == offset):
+                found[index].add(i)
+    return found
+
+
+def _unwrap(lines):
+    """
+    Join the lines of a page into paragraphs. A paragraph ends at a blank line, before a
+    speaker's turn, or at a line that ends a sentence well short of the page's usual line
+    width; words a PDF hyphenated across lines are rejoined.
+    """
+    widths = sorted(len(line.strip()) for line in lines if line.strip())
+    full_width = 0.8 * widths[len(widths) // 2] if widths else 0
+    paragraphs, current = [], []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            if current:
+                paragraphs.append(" ".join(current))
+                current = []
+            continue
+        if current:
+            previous = current[-1]
+            if previous.endswith("-") and line[0].islower():
+                current[-1] = previous[:-1] + line
+                continue
+            if SPEAKER_RE.match(line) or (previous[-1] in ".!?:" and len(previous) < full_width):
+                paragraphs.append(" ".join(current))
+                current = []
+        current.append(line)
+    if current:
+        paragraphs.append(" ".join(current))
+    return paragraphs
+
+
+def is_boilerplate(sentence):
+    """A sentence is boilerplate if it matches BOILERPLATE_RE and quotes no figures."""
+    return bool(BOILERPLATE_RE.search(sentence)) and not FIGURE_RE.search(sentence)
+
+
+def score_sentence(sentence):
+    """Rank sentences by the financial figures and terms they contain."""
+    return 3 * len(FIGURE_RE.findall(sentence)) + len(FINANCIAL_TERMS_RE.findall(sentence))
+
+
+def _clean_page(text, furniture, page_numbers, counts):
+    """
+    Return the page's paragraphs, each a list of sentences, without furniture or boilerplate.
+
+    :param page_numbers: The indexes of the page's page number lines, see page_number_lines().
+    """
+    lines = []
+    for i, line in enumerate(text.splitlines()):
+        if i in page_numbers:
+            counts["page_numbers"] += 1
+        elif (furniture and _line_key(line) in furniture) or FORM_HEADER_RE.match(line):
+            counts["furniture_lines"] += 1
+        else:
+            lines.append(line)
+    paragraphs = []
+    for paragraph in _unwrap(lines):
+        sentences = SENTENCE_END_RE.split(paragraph)
+        flagged = [is_boilerplate(sentence) for sentence in sentences]
+        if any(flagged) and sum(flagged) >= BOILERPLATE_SHARE * len(sentences):
+            # A safe-harbor paragraph: its other sentences are part of the disclaimer too
+            kept = [sentence for sentence in sentences if FIGURE_RE.search(sentence)]
+        else:
+            kept = [sentence for sentence, boilerplate in zip(sentences, flagged) if not boilerplate]
+        counts["boilerplate_sentences"] += len(sentences) - len(kept)
+        if kept:
+            paragraphs.append(kept)
+    return paragraphs
+
+
+def _select(pages, budget, counts):
+    """Keep the best-scoring sentences, in document order, within budget tokens."""
+    sentences = [
+        (page, paragraph, position, sentence)
+        for page, paragraphs in enumerate(pages)
+        for paragraph, sentences in enumerate(paragraphs)
+        for position, sentence in enumerate(sentences)
+    ]
+    tokens = token_counter.count_batch([sentence for *_, sentence in sentences])
+    if sum(tokens) <= budget:
+        return pages
+    order = sorted(range(len(sentences)), key=lambda i: (-score_sentence(sentences[i][3]), i))
+    chosen, used = set(), 0
+    for i in order:
+        if used + tokens[i] <= budget:
+            chosen.add(i)
+            used += tokens[i]
+    counts["ranked_out_sentences"] += len(sentences) - len(chosen)
+    selected = [[[] for _ in paragraphs] for paragraphs in pages]
+    for i in sorted(chosen):
+        page, paragraph, _, sentence = sentences[i]
+        selected[page][paragraph].append(sentence)
+    return [[paragraph for paragraph in paragraphs if paragraph] for paragraphs in selected]
+
+
+def compress_document(documents, target_tokens=None):
+    """
+    Compress the pages of one document.
+
+    :param documents: The Documents of one source, e.g. the pages of a PDF, in order.
+
+    :param target_tokens: Optional token budget for the whole document; if it is still
+        over budget after cleaning, only the highest-ranked sentences are kept.
+
+    :return: A (documents, report) tuple. The compressed Documents keep the metadata of
+        the pages they came from, minus token counts; empty pages are dropped. The report
+        is a dict with source, tokens_before, tokens_after and what was removed.
+    """
+    counts = Counter(furniture_lines=0, page_numbers=0, boilerplate_sentences=0, ranked_out_sentences=0)
+    texts = [doc.page_content for doc in documents]
+    if len(texts) == 1 and "\f" in texts[0]:
+        # A text file with form feeds still has pages to find headers, footers and page numbers on
+        page_texts = texts[0].split("\f")
+        owners = [0] * len(page_texts)
+    else:
+        page_texts = [text.replace("\f", "\n") for text in texts]
+        owners = list(range(len(texts)))
+    furniture = find_furniture(page_texts)
+    page_numbers = page_number_lines(page_texts)
+    pages = [[] for _ in documents]
+    for text, numbers, owner in zip(page_texts, page_numbers, owners):
+        pages[owner].extend(_clean_page(text, furniture, numbers, counts))
+    if target_tokens:
+        pages = _select(pages, int(target_tokens * BUDGET_MARGIN), counts)
+
+    compressed = []
+    for doc, paragraphs in zip(documents, pages):
+        if not paragraphs:
+            continue
+        metadata = {key: value for key, value in doc.metadata.items() if not key.startswith(token_counter.TOKEN_COUNT_KEY)}
+        compressed.append(Document(
+            page_content="\n\n".join(" ".join(sentences) for sentences in paragraphs),
+            metadata=metadata
+        ))
+    report = dict(
+        counts,
+        source=documents[0].metadata.get("source", "document") if documents else "document",
+        tokens_before=token_counter.count_documents(documents),
+        tokens_after=token_counter.count_documents(compressed),
+    )
+    return compressed, report
+
+
+def compress_documents(documents, target_tokens=None):
+    """
+    Compress Documents from one or more sources, each source on its own.
+
+    :param documents: Documents in source and page order, e.g. from ingest.iter_documents().
+
+    :param target_tokens: Optional token budget per source, see compress_document().
+
+    :return: A (documents, reports) tuple with one report per source, in order.
+    """
+    by_source = {}
+    for doc in documents:
+        by_source.setdefault(doc.metadata.get("source"), []).append(doc)
+    compressed, reports = [], []
+    with tracing.span("compress", documents=len(by_source)) as span:
+        for pages in by_source.values():
+            pages, report = compress_document(pages, target_tokens)
+            compressed.extend(pages)
+            reports.append(report)
+        span.set(tokens=sum(report["tokens_before"] for report in reports))
+    return compressed, reports
+
+
+def format_report(report):
+    """Return e.g. 'call.pdf: 24,310 -> 15,902 tokens (-35%): 48 header/footer lines, ...'."""
+    before, after = report["tokens_before"], report["tokens_after"]
+    removed = [
+        f"{report[key]} {label}" for key, label in [
+            ("furniture_lines", "header/footer lines"),
+            ("page_numbers", "page numbers"),
+            ("boilerplate_sentences", "boilerplate sentences"),
+            ("ranked_out_sentences", "low-ranked sentences"),
+        ] if report[key]
+    ]
+    change = f" ({after / before - 1:+.0%})" if before else ""
+    return f"{report['source']}: {before:,} -> {after:,} tokens{change}" + (f": removed {', '.join(removed)}" if removed else "")
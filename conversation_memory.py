@@ -0,0 +1,153 @@
+"""
+Conversation memory with a token budget for the chat pages.
+
+The most recent turns are kept verbatim as long as they fit in a budget taken from the
+model's context window. Older turns are folded into a running summary by a background
+LLM call, so the answer never waits for the summarization. Until that call finishes the
+folded turns are simply absent from the prompt; the summary catches up a turn later.
+A failed summary is retried with backoff, and the turns wait in the pending list until
+one succeeds, so they are never lost.
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List
+
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain_core.messages import BaseMessage, get_buffer_string
+from streamlit.logger import get_logger
+
+import token_counter
+
+LOGGER = get_logger(__name__)
+
+# Share of the model's context window the conversation history may use
+HISTORY_SHARE = 0.25
+MIN_HISTORY_TOKENS = 500
+# Seconds to wait before each retry of a failed summary; after the last one the turns
+# stay pending until the next turn tries again
+SUMMARY_RETRY_DELAYS = (1, 4, 15)
+# Turns whose stats are kept for the token readout
+MAX_TURN_STATS = 100
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="memory-summary")
+
+
+def history_budget(model_name, share=HISTORY_SHARE):
+    """
+    Return the number of tokens the verbatim history may use for a model.
+
+    :param model_name: The OpenAI model name.
+
+    :param share: The share of the model's context window.
+
+    :return: The token budget.
+    """
+    return max(MIN_HISTORY_TOKENS, int(token_counter.context_window(model_name) * share))
+
+
+class BudgetedMemory(ConversationSummaryBufferMemory):
+    """
+    ConversationSummaryBufferMemory that summarizes off the critical path.
+
+    The llm is only used for the summaries; give it a model without streaming callbacks.
+    turn_stats holds, for the last MAX_TURN_STATS turns, the tokens of history sent and
+    what the full transcript would have cost.
+    """
+
+    encoding_name: str = token_counter.DEFAULT_ENCODING
+    pending: List[BaseMessage] = []
+    turn_stats: Any = None
+    transcript_tokens: int = 0
+    summary_future: Any = None
+    lock: Any = None
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.lock = threading.Lock()
+        self.turn_stats = deque(maxlen=MAX_TURN_STATS)
+
+    def _tokens(self, messages):
+        if not messages:
+            return 0
+        return token_counter.count_tokens(
+            get_buffer_string(messages, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix),
+            self.encoding_name
+        )
+
+    def load_memory_variables(self, inputs):
+        variables = super().load_memory_variables(inputs)
+        history = variables[self.memory_key]
+        sent = self._tokens(history) if self.return_messages else token_counter.count_tokens(history, self.encoding_name)
+        self.turn_stats.append({"history_tokens": sent, "transcript_tokens": self.transcript_tokens})
+        return variables
+
+    def save_context(self, inputs, outputs):
+        before = len(self.chat_memory.messages)
+        BaseChatMemory.save_context(self, inputs, outputs)
+        self.transcript_tokens += self._tokens(self.chat_memory.messages[before:])
+        self.prune()
+
+    def prune(self):
+        """
+        Move the oldest turns over the budget to the pending list and summarize it in the
+        background, along with turns left pending by a failed summary.
+        """
+        buffer = self.chat_memory.messages
+        pruned = []
+        while buffer and self._tokens(buffer) > self.max_token_limit:
+            # Whole turns, so a question is never separated from its answer
+            pruned.extend(buffer[:2])
+            del buffer[:2]
+        with self.lock:
+            self.pending.extend(pruned)
+            if self.pending and self.summary_future is None:
+                self.summary_future = _executor.submit(self._summarize_pending)
+
+    def _summarize_pending(self):
+        failures = 0
+        while True:
+            with self.lock:
+                batch = list(self.pending)
+                if not batch:
+                    self.summary_future = None
+                    return
+            try:
+                summary = self.predict_new_summary(batch, self.moving_summary_buffer)
+            except Exception as e:
+                if failures >= len(SUMMARY_RETRY_DELAYS):
+                    LOGGER.warning("Conversation summary failed %d times, keeping %d messages for the next turn: %s", failures + 1, len(batch), e)
+                    with self.lock:
+                        self.summary_future = None
+                    return
+                LOGGER.warning("Conversation summary failed, retrying in %ss: %s", SUMMARY_RETRY_DELAYS[failures], e)
+                time.sleep(SUMMARY_RETRY_DELAYS[failures])
+                failures += 1
+                continue
+            failures = 0
+            with self.lock:
+                if self.pending[:len(batch)] != batch:
+                    # Cleared while summarizing; this summary is stale
+                    continue
+                self.moving_summary_buffer = summary
+                del self.pending[:len(batch)]
+
+    def wait(self, timeout=None):
+        """Wait for a running summarization, e.g. before reading moving_summary_buffer in tests."""
+        future = self.summary_future
+        if future is not None:
+            future.result(timeout=timeout)
+
+    def clear(self):
+        with self.lock:
+            self.pending.clear()
+        super().clear()
+        self.turn_stats.clear()
+        self.transcript_tokens = 0
+
+    def last_turn(self):
+        """Return the stats of the latest turn, or None before the first one."""
+        return self.turn_stats[-1] if self.turn_stats else None
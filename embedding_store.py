@@ -0,0 +1,237 @@
+"""
+Per-chunk embedding store shared by the Chat with Doc pages.
+
+Vectors are keyed by a hash of the embedding model and the chunk text and kept in an
+append-only float32 file that is memory-mapped for reads, with a sidecar file listing
+the key of each row. Re-uploading overlapping documents only pays for chunks that have
+never been embedded before.
+
+The Streamlit server and the knowledge_base CLI can share a store: appends hold an
+exclusive lock on the store's lock file, and every store picks up the rows other
+processes appended from the tail of the keys file before it assigns or reads a row.
+Only document chunks are stored; queries are embedded on every call.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+import session_resources
+import token_counter
+import utils
+
+STORE_DIR = utils.get_cache_dir("embeddings")
+
+# Request size limits for one embeddings call, and the calls sent at once
+MAX_BATCH_INPUTS = 1000
+MAX_BATCH_TOKENS = 100000
+MAX_CONCURRENT_REQUESTS = 4
+
+
+class EmbeddingStore:
+    """Append-only, memory-mapped vector store for one embedding model."""
+
+    def __init__(self, model, directory=None):
+        self.model = model
+        self.directory = directory or os.path.join(STORE_DIR, hashlib.sha256(model.encode("utf-8")).hexdigest()[:16])
+        os.makedirs(self.directory, exist_ok=True)
+        self.vectors_path = os.path.join(self.directory, "vectors.f32")
+        self.keys_path = os.path.join(self.directory, "keys.txt")
+        self.meta_path = os.path.join(self.directory, "meta.json")
+        self.lock_path = os.path.join(self.directory, "lock")
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+        self.dim = None
+        self.rows = {}
+        # Lines of the keys file read so far (the row count) and where they end
+        self.count = 0
+        self.keys_offset = 0
+        self._mmap = None
+        with self.lock, self._file_lock():
+            self._sync()
+            self._truncate_torn()
+
+    @contextmanager
+    def _file_lock(self):
+        """Hold the store's lock across processes."""
+        with open(self.lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _sync(self):
+        """Pick up the rows other processes appended since the last call. Hold self.lock."""
+        if self.dim is None and os.path.exists(self.meta_path):
+            self.dim = json.loads(utils.open_file(self.meta_path))["dim"]
+        if self.dim is None or not os.path.exists(self.keys_path) or os.path.getsize(self.keys_path) <= self.keys_offset:
+            return
+        with open(self.keys_path, "rb") as f:
+            f.seek(self.keys_offset)
+            tail = f.read()
+        # A key is written after its vector, so every complete line has its row
+        end = tail.rfind(b"\n") + 1
+        for key in tail[:end].decode("utf-8").split():
+            self.rows.setdefault(key, self.count)
+            self.count += 1
+        self.keys_offset += end
+
+    def _truncate_torn(self):
+        """Drop vectors an interrupted append wrote without their keys. Hold both locks."""
+        if self.dim is None or not os.path.exists(self.vectors_path):
+            return
+        size = self.count * self.dim * 4
+        if os.path.getsize(self.vectors_path) != size:
+            with open(self.vectors_path, "r+b") as f:
+                f.truncate(size)
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).hexdigest()
+
+    def _vectors(self):
+        """Return a read-only memory map over all stored rows, remapping after appends."""
+        if self._mmap is None or len(self._mmap) < self.count:
+            self._mmap = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self.count, self.dim))
+        return self._mmap
+
+    def get(self, keys):
+        """
+        Look up stored vectors.
+
+        :param keys: Keys from key().
+
+        :return: A dict of key -> vector for the keys that are stored.
+        """
+        with self.lock:
+            self._sync()
+            found = [key for key in keys if key in self.rows]
+            if not found:
+                return {}
+            vectors = self._vectors()
+            return {key: vectors[self.rows[key]].tolist() for key in found}
+
+    def put(self, items):
+        """
+        Append vectors to the store.
+
+        :param items: A dict of key -> vector.
+        """
+        with self.lock, self._file_lock():
+            self._sync()
+            items = {key: vector for key, vector in items.items() if key not in self.rows}
+            if not items:
+                return
+            array = np.asarray(list(items.values()), dtype=np.float32)
+            if self.dim is None:
+                self.dim = array.shape[1]
+                utils.save_file(json.dumps({"model": self.model, "dim": self.dim}), self.meta_path)
+            self._truncate_torn()
+            with open(self.vectors_path, "ab") as f:
+                f.write(array.tobytes())
+            with open(self.keys_path, "a", encoding="utf-8") as f:
+                f.write("".join(f"{key}\n" for key in items))
+            self._sync()
+
+    def record(self, hit_texts, miss_count):
+        saved_tokens = sum(token_counter.count_batch(hit_texts))
+        with self.lock:
+            self.hits += len(hit_texts)
+            self.misses += miss_count
+            self.saved_tokens += saved_tokens
+
+    def stats(self):
+        """
+        :return: A dict with the hit/miss counters, the estimated tokens saved and the store size.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "saved_tokens": self.saved_tokens,
+            "stored_vectors": len(self.rows),
+        }
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+session_resources.register_shared(lambda: list(_stores.values()))
+
+
+def get_store(model):
+    """Return the process-wide store for an embedding model."""
+    with _stores_lock:
+        if model not in _stores:
+            _stores[model] = EmbeddingStore(model)
+        return _stores[model]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Drop-in wrapper around an Embeddings object (e.g. OpenAIEmbeddings) that only sends
+    texts it has never embedded before to the underlying model, packed into requests
+    that fill the request-size limits and sent concurrently.
+    """
+
+    def __init__(self, embeddings, store=None, max_batch_inputs=MAX_BATCH_INPUTS, max_batch_tokens=MAX_BATCH_TOKENS, max_concurrency=MAX_CONCURRENT_REQUESTS):
+        self.embeddings = embeddings
+        self.model = getattr(embeddings, "model", type(embeddings).__name__)
+        self.store = store or get_store(self.model)
+        self.max_batch_inputs = max_batch_inputs
+        self.max_batch_tokens = max_batch_tokens
+        self.max_concurrency = max_concurrency
+
+    def embed_documents(self, texts):
+        keys = [self.store.key(text) for text in texts]
+        found = self.store.get(set(keys))
+
+        # Embed each unseen text once, even if it repeats within the batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self._embed_batched(list(missing.values()))
+            new = dict(zip(missing.keys(), vectors))
+            self.store.put(new)
+            found.update(new)
+
+        self.store.record([text for key, text in zip(keys, texts) if key not in missing], len(missing))
+        return [found[key] for key in keys]
+
+    def _batches(self, texts):
+        """Pack texts, in order, into batches within the input-count and token limits."""
+        batch, batch_tokens = [], 0
+        for text, tokens in zip(texts, token_counter.count_batch(texts)):
+            if batch and (len(batch) >= self.max_batch_inputs or batch_tokens + tokens > self.max_batch_tokens):
+                yield batch
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            yield batch
+
+    def _embed_batched(self, texts):
+        batches = list(self._batches(texts))
+        if len(batches) == 1:
+            return self.embeddings.embed_documents(batches[0])
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            results = executor.map(self.embeddings.embed_documents, batches)
+            return [vector for vectors in results for vector in vectors]
+
+    def embed_query(self, text):
+        # Not stored: queries (and the response cache's prompts) belong to one user and rarely repeat
+        return self.embeddings.embed_query(text)
+
+    def stats(self):
+        return self.store.stats()
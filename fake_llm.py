@@ -0,0 +1,152 @@
+"""
+Deterministic local stand-ins for the OpenAI models, so the pages, the tests and the
+benchmarks run without a key or network.
+
+Set FUNDBRIDGE_LLM_BACKEND=fake and llm_pool hands these out instead of ChatOpenAI and
+OpenAIEmbeddings, so the pages themselves run offline. Their latency comes from:
+
+    FUNDBRIDGE_FAKE_LATENCY            seconds before the first token, default 0.05
+    FUNDBRIDGE_FAKE_TOKENS_PER_SECOND  streaming rate, default 200 (0 for no delay)
+    FUNDBRIDGE_FAKE_EMBED_LATENCY      seconds per embeddings request, default 0.02
+"""
+
+import asyncio
+import hashlib
+import os
+import random
+import re
+import time
+from typing import Optional
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.pydantic_v1 import Field
+
+WORD_RE = re.compile(r"[A-Za-z]+|\$?\d[\d,.]*%?")
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Hashed bag-of-words embeddings. Texts that share words get similar vectors, so
+    retrieval quality can be compared across settings, and the same text always gets
+    the same vector.
+
+    :param dim: The vector size.
+
+    :param request_latency: Seconds each embed_documents call sleeps, like a network round-trip.
+
+    :param seconds_per_token: Extra seconds per (whitespace) token in the request.
+
+    Other keyword arguments (e.g. openai_api_key, model) are accepted and ignored, so
+    it can be built with the parameters of OpenAIEmbeddings.
+    """
+
+    def __init__(self, dim=256, request_latency=0.0, seconds_per_token=0.0, **kwargs):
+        self.dim = dim
+        self.request_latency = request_latency
+        self.seconds_per_token = seconds_per_token
+        self.model = f"fake-embedding-{dim}"
+        self.requests = 0
+
+    def _bucket(self, word):
+        return int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=4).digest(), "little") % self.dim
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in WORD_RE.findall(text.lower()):
+            vector[self._bucket(word)] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        self.requests += 1
+        delay = self.request_latency + self.seconds_per_token * sum(len(text.split()) for text in texts)
+        if delay:
+            time.sleep(delay)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def _env_float(name, default):
+    return float(os.environ.get(name, default))
+
+
+def backend_embeddings(**params):
+    """Return the FakeEmbeddings llm_pool uses for FUNDBRIDGE_LLM_BACKEND=fake."""
+    return FakeEmbeddings(request_latency=_env_float("FUNDBRIDGE_FAKE_EMBED_LATENCY", "0.02"), **params)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model that answers with words drawn from its prompt, seeded by the prompt, so
+    the same prompt always gets the same answer.
+
+    It waits latency seconds, then emits completion_tokens tokens at tokens_per_second,
+    streaming them to the callbacks when streaming is set, like ChatOpenAI. It accepts
+    the ChatOpenAI parameters the pages pass and skips the LLM cache unless cache=True,
+    so repeated benchmark rounds do the same work.
+    """
+
+    model_name: str = "fake-chat"
+    temperature: float = 0.7
+    streaming: bool = False
+    max_retries: int = 0
+    openai_api_key: Optional[str] = None
+    latency: float = Field(default_factory=lambda: _env_float("FUNDBRIDGE_FAKE_LATENCY", "0.05"))
+    tokens_per_second: float = Field(default_factory=lambda: _env_float("FUNDBRIDGE_FAKE_TOKENS_PER_SECOND", "200"))
+    completion_tokens: int = 60
+    cache: Optional[bool] = False
+
+    class Config:
+        extra = "ignore"
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    @property
+    def _identifying_params(self):
+        return {"model_name": self.model_name, "temperature": self.temperature}
+
+    def reply(self, messages):
+        """Return the answer to messages as a list of tokens."""
+        prompt = "\n".join(str(message.content) for message in messages)
+        rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+        words = WORD_RE.findall(prompt) or ["ok"]
+        return [("" if i == 0 else " ") + rng.choice(words) for i in range(self.completion_tokens)]
+
+    def _result(self, messages, tokens):
+        text = "".join(tokens)
+        prompt_tokens = sum(len(str(message.content).split()) for message in messages)
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=text))],
+            llm_output={
+                "token_usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens)},
+                "model_name": self.model_name
+            }
+        )
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self.reply(messages)
+        time.sleep(self.latency)
+        for token in tokens:
+            if self.tokens_per_second:
+                time.sleep(1 / self.tokens_per_second)
+            if self.streaming and run_manager:
+                run_manager.on_llm_new_token(token)
+        return self._result(messages, tokens)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self.reply(messages)
+        await asyncio.sleep(self.latency)
+        for token in tokens:
+            if self.tokens_per_second:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            if self.streaming and run_manager:
+                await run_manager.on_llm_new_token(token)
+        return self._result(messages, tokens)
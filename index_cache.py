@@ -0,0 +1,392 @@
+"""
+Content-addressed on-disk cache for the FAISS indexes built by the Chat with Doc pages.
+
+An index is keyed by a hash of the uploaded file bytes plus the splitter and embedding
+settings used to build it, so a later turn (or a later session) over the same files
+reloads the index from disk instead of re-parsing and re-embedding the corpus. Each
+entry also holds the BM25 index over the same chunks used by retrieval.HybridRetriever.
+Sessions search entries memory-mapped and read-only, sharing one copy per process.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from langchain.vectorstores import faiss
+from streamlit.logger import get_logger
+
+import session_resources
+import tracing
+import utils
+import vector_index
+from retrieval import LexicalIndex
+
+LOGGER = get_logger(__name__)
+
+CACHE_DIR = utils.get_cache_dir("faiss")
+MAX_CACHE_BYTES = int(os.environ.get("FUNDBRIDGE_INDEX_CACHE_MB", "2048")) * 1024 * 1024
+META_FILE = "meta.json"
+EMBED_BATCH_SIZE = 256
+MAX_SHARED = 8
+SESSION_KEY = "faiss_index"
+
+# key -> {"index", "docstore", "ids", "lexical"} of the entries sessions are searching
+_shared = OrderedDict()
+_shared_lock = threading.Lock()
+session_resources.register_shared(lambda: [obj for entry in list(_shared.values()) for obj in entry.values()])
+
+
+def file_digest(uploaded_file):
+    """
+    Hash the contents of an uploaded file.
+
+    :param uploaded_file: The Streamlit UploadedFile (or any object with getvalue()).
+
+    :return: The hex sha256 digest of the file bytes.
+    """
+    return hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+
+
+def settings_key(**settings):
+    """
+    Hash the splitter and embedding settings of an index.
+
+    :param settings: Splitter and embedding settings that change the index contents.
+
+    :return: The hex digest of the settings.
+    """
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def cache_key(digests, **settings):
+    """
+    Build the cache key for a set of files and index settings.
+
+    The key does not depend on upload order or file names, only on the file bytes
+    and the settings.
+
+    :param digests: The file_digest() of each file the index is built from.
+
+    :param settings: Splitter and embedding settings that change the index contents.
+
+    :return: The hex digest identifying the index.
+    """
+    payload = {"files": sorted(set(digests)), "settings": settings_key(**settings)}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _entry_path(key):
+    return os.path.join(CACHE_DIR, key)
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _touch(path):
+    """Record an access on a cache entry (the meta file mtime is the last access time)."""
+    try:
+        os.utime(os.path.join(path, META_FILE), None)
+    except OSError:
+        pass
+
+
+def _load_shared(key, path):
+    with _shared_lock:
+        entry = _shared.get(key)
+        if entry is None:
+            index = vector_index.read_mmap(os.path.join(path, "index.faiss"))
+            # The pickled docstore was written by this app, not an untrusted third party.
+            with open(os.path.join(path, "index.pkl"), "rb") as f:
+                docstore, ids = pickle.load(f)
+            entry = _shared[key] = {"index": index, "docstore": docstore, "ids": ids, "lexical": None}
+            while len(_shared) > MAX_SHARED:
+                _shared.popitem(last=False)
+        _shared.move_to_end(key)
+        return entry
+
+
+def load(key, embeddings, shared=False):
+    """
+    Load a cached index from disk.
+
+    :param key: The cache key from cache_key().
+
+    :param embeddings: The embeddings object used to embed queries against the index.
+
+    :param shared: Return a store over the process-wide, memory-mapped, read-only copy of
+        the entry instead of a private writable one. Don't add documents to it.
+
+    :return: The FAISS vector store, or None if the key is not cached.
+    """
+    path = _entry_path(key)
+    if not os.path.exists(os.path.join(path, META_FILE)):
+        return None
+    try:
+        if shared:
+            entry = _load_shared(key, path)
+            db = faiss.FAISS(embeddings, entry["index"], entry["docstore"], entry["ids"])
+        else:
+            # The pickled docstore was written by this app, not an untrusted third party.
+            db = faiss.FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+    except Exception as e:
+        LOGGER.warning("Discarding unreadable index cache entry %s: %s", key, e)
+        shutil.rmtree(path, ignore_errors=True)
+        return None
+    _touch(path)
+    return db
+
+
+def save(key, db, **meta):
+    """
+    Write an index to the cache and evict old entries if the cache is over its size limit.
+
+    :param key: The cache key from cache_key().
+
+    :param db: The FAISS vector store to persist.
+
+    :param meta: Extra metadata recorded alongside the index.
+    """
+    path = _entry_path(key)
+    # Write into a scratch directory first so readers never see a half-written entry.
+    scratch = tempfile.mkdtemp(prefix=f".{key}.", dir=CACHE_DIR)
+    try:
+        db.save_local(scratch)
+        LexicalIndex.from_faiss(db).save(scratch)
+        meta = dict(meta, key=key, created=time.time(), size=_dir_size(scratch))
+        utils.save_file(json.dumps(meta, default=str), os.path.join(scratch, META_FILE))
+        try:
+            os.rename(scratch, path)
+        except OSError:
+            # Another session finished building the same index first.
+            shutil.rmtree(scratch, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(scratch, ignore_errors=True)
+        raise
+    evict(keep=key)
+
+
+def load_lexical(key, db):
+    """
+    Return the BM25 index of a cached entry, building and storing it if it is missing.
+
+    :param key: The cache key from cache_key().
+
+    :param db: The FAISS vector store of that entry.
+
+    :return: The LexicalIndex.
+    """
+    with _shared_lock:
+        entry = _shared.get(key)
+        if entry and entry["lexical"] is not None:
+            return entry["lexical"]
+    path = _entry_path(key)
+    lexical = LexicalIndex.load(path) if os.path.isdir(path) else None
+    if lexical is None or len(lexical) != db.index.ntotal:
+        lexical = LexicalIndex.from_faiss(db)
+        if os.path.isdir(path):
+            lexical.save(path)
+    with _shared_lock:
+        if key in _shared:
+            _shared[key]["lexical"] = lexical
+    return lexical
+
+
+def session_lexical(db):
+    """
+    Return the BM25 index for the session's current index (from load_or_build), loading it once.
+
+    :param db: The FAISS vector store returned by load_or_build().
+
+    :return: The LexicalIndex.
+    """
+    cached = session_resources.get(SESSION_KEY)
+    if not cached or cached["db"] is not db:
+        return LexicalIndex.from_faiss(db)
+    if "lexical" not in cached:
+        cached["lexical"] = load_lexical(cached["key"], db)
+    return cached["lexical"]
+
+
+def _read_meta(key):
+    try:
+        return json.loads(utils.open_file(os.path.join(_entry_path(key), META_FILE)))
+    except (OSError, ValueError):
+        return None
+
+
+def entries():
+    """
+    List the cache entries.
+
+    :return: A list of (key, size_in_bytes, last_access) tuples, least recently used first.
+    """
+    result = []
+    for key in os.listdir(CACHE_DIR):
+        path = _entry_path(key)
+        meta_path = os.path.join(path, META_FILE)
+        if key.startswith(".") or not os.path.exists(meta_path):
+            continue
+        result.append((key, _dir_size(path), os.path.getmtime(meta_path)))
+    return sorted(result, key=lambda entry: entry[2])
+
+
+def find_base(digests, settings_hash):
+    """
+    Find the largest cached index built with the same settings from a subset of the files.
+
+    :param digests: The file digests of the index being requested.
+
+    :param settings_hash: The settings_key() of the index being requested.
+
+    :return: A (key, digests) tuple for the best entry, or None.
+    """
+    best = None
+    for key, _, _ in entries():
+        meta = _read_meta(key)
+        if not meta or meta.get("settings_key") != settings_hash:
+            continue
+        cached = set(meta.get("digests", []))
+        if cached and cached < digests and (best is None or len(cached) > len(best[1])):
+            best = (key, cached)
+    return best
+
+
+def evict(max_bytes=None, keep=None):
+    """
+    Remove least recently used entries until the cache fits in max_bytes.
+
+    :param max_bytes: The size limit, defaults to MAX_CACHE_BYTES.
+
+    :param keep: A key that must not be evicted, e.g. the entry just written.
+    """
+    max_bytes = MAX_CACHE_BYTES if max_bytes is None else max_bytes
+    cached = entries()
+    total = sum(size for _, size, _ in cached)
+    for key, size, _ in cached:
+        if total <= max_bytes:
+            break
+        if key == keep:
+            continue
+        with _shared_lock:
+            # Sessions searching it keep their mapping; new ones reload from disk
+            _shared.pop(key, None)
+        shutil.rmtree(_entry_path(key), ignore_errors=True)
+        total -= size
+
+
+def add_documents(documents, embeddings, db=None, batch_size=EMBED_BATCH_SIZE):
+    """
+    Embed documents into an index batch by batch, as they arrive.
+
+    :param documents: An iterable of Documents, e.g. the generator from ingest.iter_documents.
+        Embedding starts with the first batch while later documents are still being parsed.
+
+    :param embeddings: The embeddings object used to embed the documents.
+
+    :param db: The FAISS vector store to extend, or None to create one.
+
+    :return: The FAISS vector store, or None if there were no documents and no db.
+    """
+    batch = []
+    for doc in documents:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            db = _add_batch(db, batch, embeddings)
+            batch = []
+    if batch:
+        db = _add_batch(db, batch, embeddings)
+    return db
+
+
+def _add_batch(db, batch, embeddings):
+    texts = [doc.page_content for doc in batch]
+    metadatas = [doc.metadata for doc in batch]
+    with tracing.span("embed", inputs=len(texts), tokens=sum(doc.metadata.get("token_count", 0) for doc in batch)):
+        vectors = embeddings.embed_documents(texts)
+    with tracing.span("index", vectors=len(vectors)):
+        if db is None:
+            return faiss.FAISS.from_embeddings(list(zip(texts, vectors)), embeddings, metadatas=metadatas)
+        db.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas)
+    return db
+
+
+def load_or_build(uploaded_files, embeddings, load_fn, **settings):
+    """
+    Return the index for a set of uploaded files, embedding only what is not cached.
+
+    On an exact hit the index is reloaded as is. When the files are a superset of an
+    index that is already in the session or on disk, only the new files are loaded and
+    added to a copy of that index instead of rebuilding it. A new index is converted to
+    settings['index_type'] (see vector_index) before it is saved. The returned store
+    searches the saved entry memory-mapped and shared with other sessions; it is also
+    kept in the session state, so later turns don't touch the disk.
+
+    :param uploaded_files: The files the index is built from.
+
+    :param embeddings: The embeddings object used to embed documents and queries.
+
+    :param load_fn: Called with a list of files, returns the documents (a list or a
+        generator) to index for them.
+
+    :param settings: Splitter and embedding settings that change the index contents,
+        plus the optional index_type.
+
+    :return: The FAISS vector store.
+    """
+    files = {file_digest(file): file for file in uploaded_files}
+    digests = set(files)
+    settings_hash = settings_key(**settings)
+    key = cache_key(digests, **settings)
+
+    cached = session_resources.get(SESSION_KEY)
+    if cached and cached["key"] == key:
+        return cached["db"]
+
+    db = load(key, embeddings, shared=True)
+    if db is None:
+        base = None
+        if cached and cached["settings_key"] == settings_hash and cached["digests"] < digests:
+            found = (cached["key"], cached["digests"])
+        else:
+            found = find_base(digests, settings_hash)
+        if found:
+            # A private copy; the shared one is read-only
+            base_db = load(found[0], embeddings)
+            base = (base_db, found[1]) if base_db is not None else None
+
+        if base:
+            db, indexed = base
+            db = add_documents(load_fn([files[digest] for digest in digests - indexed]), embeddings, db)
+        else:
+            db = add_documents(load_fn(list(files.values())), embeddings)
+        if db is None:
+            raise ValueError("The uploaded files contain no text to index.")
+        vector_index.convert(db, settings.get("index_type", "flat"))
+        save(
+            key,
+            db,
+            files=[file.name for file in uploaded_files],
+            digests=sorted(digests),
+            settings_key=settings_hash,
+            settings=settings
+        )
+        # Search the saved copy, shared with other sessions, instead of this private one
+        db = load(key, embeddings, shared=True) or db
+
+    # No spill: after an eviction the next call loads the shared copy from disk again
+    session_resources.put(SESSION_KEY, {"key": key, "db": db, "digests": digests, "settings_key": settings_hash})
+    return db
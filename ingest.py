@@ -0,0 +1,213 @@
+"""
+Document ingestion shared by the document pages.
+
+Text uploads are decoded straight from their in-memory buffers. A PDF is written once to
+a private spool file, and its pages are extracted in a process pool, split into page
+ranges so one large filing is spread over several workers. Tasks carry the file's path,
+not its bytes, and each worker opens a PDF once and keeps the reader for the file's
+other ranges. Documents are yielded as soon as their range is parsed so chunking and
+embedding can start before the last page is read.
+"""
+
+import atexit
+import io
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import pypdf
+from langchain.docstore.document import Document
+
+import tracing
+
+PAGES_PER_TASK = 16
+MAX_WORKERS = int(os.environ.get("FUNDBRIDGE_INGEST_WORKERS", str(os.cpu_count() or 2)))
+# PDF readers a worker keeps open, for the files whose ranges are still coming
+MAX_OPEN_READERS = 4
+
+_pool = None
+_pool_lock = threading.Lock()
+# path -> PdfReader, in worker processes (see _init_worker)
+_readers = None
+
+
+def get_pool():
+    """Return the process pool shared by all sessions, starting it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, so workers never inherit the Streamlit server's threads and locks
+            _pool = ProcessPoolExecutor(
+                max_workers=MAX_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker
+            )
+            atexit.register(_pool.shutdown, wait=False, cancel_futures=True)
+        return _pool
+
+
+def _init_worker():
+    global _readers
+    _readers = OrderedDict()
+
+
+def _reader(path):
+    """Return the worker's PdfReader for a spool file, opening it on the file's first task."""
+    reader = _readers.get(path)
+    if reader is None:
+        reader = _readers[path] = pypdf.PdfReader(path)
+        while len(_readers) > MAX_OPEN_READERS:
+            _readers.popitem(last=False)
+    _readers.move_to_end(path)
+    return reader
+
+
+def _extract(reader, start, stop):
+    return [(number, reader.pages[number].extract_text()) for number in range(start, stop)]
+
+
+def count_pdf_pages(path):
+    """
+    Count the pages of a spooled PDF. Runs in a worker process, which keeps the reader.
+
+    :param path: The PDF file.
+
+    :return: The number of pages.
+    """
+    return len(_reader(path).pages)
+
+
+def parse_pdf_pages(path, start, stop):
+    """
+    Extract the text of a range of PDF pages. Runs in a worker process.
+
+    :param path: The PDF file.
+
+    :param start: The first page number (0-based).
+
+    :param stop: One past the last page number.
+
+    :return: A list of (page_number, text) tuples.
+    """
+    return _extract(_reader(path), start, stop)
+
+
+def _spool(data):
+    """Write PDF bytes to a file only this user can read, for the workers to open."""
+    fd, path = tempfile.mkstemp(prefix="fundbridge-", suffix=".pdf")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    return path
+
+
+def is_pdf(name, data):
+    return name.lower().endswith(".pdf") or data[:5] == b"%PDF-"
+
+
+def parse_bytes(name, data):
+    """
+    Parse a whole file in the current process.
+
+    :param name: The file name, stored as the 'source' metadata.
+
+    :param data: The file bytes.
+
+    :return: A list of Documents, one per PDF page or one for a text file.
+    """
+    if is_pdf(name, data):
+        reader = pypdf.PdfReader(io.BytesIO(data))
+        return [
+            Document(page_content=text, metadata={"source": name, "page": number})
+            for number, text in _extract(reader, 0, len(reader.pages))
+        ]
+    return [Document(page_content=data.decode("utf-8"), metadata={"source": name})]
+
+
+def iter_documents(uploaded_files, pages_per_task=PAGES_PER_TASK):
+    """
+    Parse uploaded pdf and txt files, yielding Documents in file and page order.
+
+    :param uploaded_files: Streamlit UploadedFiles, or any objects with name and getvalue().
+
+    :param pages_per_task: The PDF pages parsed by one worker task.
+
+    :return: A generator of Documents with the same metadata as PyPDFLoader/TextLoader.
+        Reading the uploads and parsing them are recorded as the 'read' and 'parse' spans
+        of the current trace; parse runs until the last page was yielded.
+    """
+    active = tracing.current()
+    start = time.perf_counter()
+
+    # Read every buffer and spool every PDF up front, so all files parse in parallel
+    files = []
+    spooled = []
+    total_bytes = 0
+    for file in uploaded_files:
+        data = file.getvalue()
+        total_bytes += len(data)
+        if is_pdf(file.name, data):
+            spooled.append(_spool(data))
+            files.append((file.name, spooled[-1]))
+        else:
+            files.append((file.name, [Document(page_content=data.decode("utf-8"), metadata={"source": file.name})]))
+    tracing.record("read", start, trace=active, files=len(uploaded_files), bytes=total_bytes)
+
+    futures = []
+    pages = 0
+    first_page = None
+    try:
+        if spooled:
+            pool = get_pool()
+            counts = {path: pool.submit(count_pdf_pages, path) for path in spooled}
+            tasks = []
+            for name, task in files:
+                if isinstance(task, list):
+                    tasks.append((name, task))
+                    continue
+                page_count = counts[task].result()
+                ranges = [
+                    pool.submit(parse_pdf_pages, task, first, min(first + pages_per_task, page_count))
+                    for first in range(0, page_count, pages_per_task)
+                ]
+                futures.extend(ranges)
+                tasks.append((name, ranges))
+        else:
+            tasks = files
+
+        for name, task in tasks:
+            for item in task:
+                if isinstance(item, Document):
+                    parsed = [item]
+                else:
+                    parsed = [Document(page_content=text, metadata={"source": name, "page": number}) for number, text in item.result()]
+                for doc in parsed:
+                    if not pages:
+                        first_page = time.perf_counter() - start
+                    pages += 1
+                    yield doc
+    finally:
+        # The consumer stopped early; don't keep workers busy on pages nobody reads
+        for future in futures:
+            future.cancel()
+        for path in spooled:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        tracing.record("parse", start, trace=active, pages=pages, bytes=total_bytes, first_page_seconds=first_page or 0.0)
+
+
+def format_timings(trace):
+    """Render the read and parse spans that iter_documents recorded in a trace for display."""
+    parse = trace.spans.get("parse") if trace is not None else None
+    if parse is None:
+        return ""
+    read = trace.spans.get("read")
+    return (
+        f"Parsed {parse.attributes['pages']} pages ({parse.attributes['bytes'] / 1e6:.1f} MB) in {parse.seconds:.2f}s: "
+        f"read {read.seconds if read else 0:.2f}s, first page after {parse.attributes['first_page_seconds']:.2f}s"
+    )
@@ -0,0 +1,159 @@
+"""
+OpenAI API key validation without spending a completion.
+
+A key is checked by listing models, which is free and fast. Results are cached per key
+hash for the whole process, so every session and rerun shares them, and checks run on a
+background thread so a page never waits for one. Failures are sorted into an invalid
+key, a rate limit (the key works but is throttled) and an outage on OpenAI's side.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from streamlit.logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+VALID = "valid"
+INVALID = "invalid"
+RATE_LIMITED = "rate_limited"
+OUTAGE = "outage"
+PENDING = "pending"
+
+# How long a result is trusted; transient failures are retried much sooner
+TTL_SECONDS = {
+    VALID: int(os.environ.get("FUNDBRIDGE_KEY_TTL", "3600")),
+    INVALID: 600,
+    RATE_LIMITED: 30,
+    OUTAGE: 30,
+}
+# Seconds validate() waits for a check before reporting it as still pending
+WAIT_SECONDS = 10
+MAX_ENTRIES = 1024
+
+MESSAGES = {
+    VALID: "API key is valid.",
+    INVALID: "Key not valid.",
+    RATE_LIMITED: "Key is valid but currently rate limited by OpenAI.",
+    OUTAGE: "OpenAI is having issues, try again shortly.",
+    PENDING: "Checking API key...",
+}
+
+Result = namedtuple("Result", ["status", "message", "checked_at"])
+
+_results = {}
+_futures = {}
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="key-validation")
+
+
+def _key_hash(api_key):
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+
+
+def classify(error):
+    """
+    Sort an exception from the OpenAI client into a validation status.
+
+    :param error: The exception raised by the check.
+
+    :return: INVALID, RATE_LIMITED or OUTAGE.
+    """
+    import openai
+    if isinstance(error, (openai.error.AuthenticationError, openai.error.PermissionError)):
+        return INVALID
+    if isinstance(error, openai.error.RateLimitError):
+        return RATE_LIMITED
+    if isinstance(error, openai.error.InvalidRequestError) and getattr(error, "http_status", None) in (401, 403):
+        return INVALID
+    return OUTAGE
+
+
+def check(api_key):
+    """
+    Check a key against the models endpoint, bypassing the cache.
+
+    :param api_key: The OpenAI API key to check.
+
+    :return: A Result.
+    """
+    if not api_key:
+        return Result(INVALID, MESSAGES[INVALID], time.time())
+    if os.environ.get("FUNDBRIDGE_LLM_BACKEND") == "fake":
+        # The offline benchmark models (see llm_pool) take any key
+        return Result(VALID, MESSAGES[VALID], time.time())
+    # Imported here so pages don't pay for the openai client before their first paint
+    import openai
+    try:
+        openai.Model.list(api_key=api_key)
+        status, message = VALID, MESSAGES[VALID]
+    except Exception as e:
+        status = classify(e)
+        message = f"{MESSAGES[status]} ({e})" if status != INVALID else MESSAGES[INVALID]
+        LOGGER.warning("API key check failed (%s): %s", status, e)
+    return Result(status, message, time.time())
+
+
+def _cached(key_hash, now):
+    result = _results.get(key_hash)
+    if result is not None and now - result.checked_at <= TTL_SECONDS[result.status]:
+        return result
+    return None
+
+
+def _run(key_hash, api_key):
+    result = check(api_key)
+    with _lock:
+        _results[key_hash] = result
+        _futures.pop(key_hash, None)
+        if len(_results) > MAX_ENTRIES:
+            # Oldest first; dicts keep insertion order
+            for stale in list(_results)[:len(_results) - MAX_ENTRIES]:
+                del _results[stale]
+    return result
+
+
+def start(api_key):
+    """
+    Return the cached result for a key, starting a background check if there is none.
+
+    :param api_key: The OpenAI API key.
+
+    :return: A Result, with status PENDING while the check is running.
+    """
+    key_hash = _key_hash(api_key)
+    with _lock:
+        result = _cached(key_hash, time.time())
+        if result is not None:
+            return result
+        if key_hash not in _futures:
+            _futures[key_hash] = _executor.submit(_run, key_hash, api_key)
+    return Result(PENDING, MESSAGES[PENDING], None)
+
+
+def validate(api_key, timeout=WAIT_SECONDS):
+    """
+    Return the result for a key, waiting up to timeout seconds for a running check.
+
+    :param api_key: The OpenAI API key.
+
+    :param timeout: Seconds to wait for the check.
+
+    :return: A Result, with status PENDING if the check did not finish in time.
+    """
+    result = start(api_key)
+    if result.status != PENDING:
+        return result
+    with _lock:
+        future = _futures.get(_key_hash(api_key))
+    if future is None:
+        # Finished between start() and now
+        return start(api_key)
+    try:
+        return future.result(timeout=timeout)
+    except Exception:
+        return result
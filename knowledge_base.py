@@ -0,0 +1,277 @@
+"""
+Persistent knowledge base searched by the Chat with Large Doc page, filled headless:
+
+    python knowledge_base.py ingest reports/AAPL-10K-2023.pdf --ticker AAPL --period FY2023 --doc-type 10-K
+    python knowledge_base.py list
+
+Documents are parsed, chunked and embedded once, with their ticker, period and doc type
+stored on every chunk. Each ingest writes a complete new generation of the index
+(FAISS vectors, docstore, BM25 index and a documents.json manifest) and then switches
+the CURRENT pointer to it, so readers never see a half-written index. Every session of
+the app shares one read-only, memory-mapped copy of the current generation, and
+searches can be restricted to matching documents before the vector lookup.
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+import session_resources
+import utils
+import vector_index
+from retrieval import LexicalIndex
+
+KB_DIR = os.environ.get("FUNDBRIDGE_KB_DIR") or utils.get_cache_dir("knowledge_base")
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "documents.json"
+LOCK_FILE = ".lock"
+METADATA_FIELDS = ["ticker", "period", "doc_type"]
+# Same chunking as the Chat with Large Doc page
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 60
+SEPARATORS = ["\n", "\n\n", "(?<=\. )", "", " "]
+KEEP_GENERATIONS = 2
+
+_shared = {}
+_lock = threading.Lock()
+session_resources.register_shared(lambda: list(_shared.values()))
+
+
+class KnowledgeBase:
+    """
+    A read-only handle on one generation of the knowledge base.
+
+    The index is memory-mapped, so handles on the same generation in different processes
+    share its pages. Get the process-wide handle with open_shared().
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The generation directory.
+        """
+        self.path = path
+        self.generation = os.path.basename(path)
+        self.documents = json.loads(utils.open_file(os.path.join(path, MANIFEST_FILE)))
+        self.index = vector_index.read_mmap(os.path.join(path, "index.faiss"))
+        # The pickled docstore was written by this app, not an untrusted third party.
+        with open(os.path.join(path, "index.pkl"), "rb") as f:
+            self.docstore, self.index_to_docstore_id = pickle.load(f)
+        self.lexical = LexicalIndex.load(path)
+
+    def __len__(self):
+        return self.index.ntotal
+
+    def store(self, embeddings):
+        """
+        Return a LangChain FAISS store over the shared index.
+
+        :param embeddings: This session's embeddings, used to embed queries.
+        """
+        from langchain.vectorstores import faiss
+        return faiss.FAISS(embeddings, self.index, self.docstore, self.index_to_docstore_id)
+
+    def values(self, field):
+        """Return the distinct values of a metadata field, sorted."""
+        return sorted({doc[field] for doc in self.documents if doc.get(field)})
+
+    def positions(self, **filters):
+        """
+        Return the index positions of the chunks of the documents matching the filters.
+
+        :param filters: Metadata fields mapped to a value or a list of accepted values;
+            empty values don't filter.
+
+        :return: A sorted int64 array, or None when nothing is filtered.
+        """
+        filters = {field: value if isinstance(value, (list, tuple, set)) else [value] for field, value in filters.items() if value}
+        if not filters:
+            return None
+        ranges = [
+            np.arange(doc["start"], doc["stop"], dtype=np.int64)
+            for doc in self.documents
+            if all(doc.get(field) in accepted for field, accepted in filters.items())
+        ]
+        return np.concatenate(ranges) if ranges else np.empty(0, dtype=np.int64)
+
+
+def _current_generation(directory):
+    try:
+        return utils.open_file(os.path.join(directory, CURRENT_FILE)).strip() or None
+    except OSError:
+        return None
+
+
+def open_shared(directory=KB_DIR):
+    """
+    Return the process-wide read-only handle on the current generation.
+
+    A new handle is opened when an ingest has switched to a newer generation since the
+    last call; sessions still holding the old one keep working.
+
+    :return: The KnowledgeBase, or None if nothing was ingested yet.
+    """
+    generation = _current_generation(directory)
+    if generation is None:
+        return None
+    with _lock:
+        kb = _shared.get(directory)
+        if kb is None or kb.generation != generation:
+            kb = _shared[directory] = KnowledgeBase(os.path.join(directory, generation))
+        return kb
+
+
+def _load_writable(directory, embeddings):
+    """Return (db, documents) of the current generation as a private, writable copy."""
+    generation = _current_generation(directory)
+    if generation is None:
+        return None, []
+    from langchain.vectorstores import faiss
+    path = os.path.join(directory, generation)
+    db = faiss.FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+    return db, json.loads(utils.open_file(os.path.join(path, MANIFEST_FILE)))
+
+
+def _publish(directory, db, documents):
+    """Write a new generation and point CURRENT at it."""
+    generation = f"gen-{time.time_ns()}"
+    scratch = tempfile.mkdtemp(prefix=f".{generation}.", dir=directory)
+    try:
+        db.save_local(scratch)
+        LexicalIndex.from_faiss(db).save(scratch)
+        utils.save_file(json.dumps(documents, indent=1), os.path.join(scratch, MANIFEST_FILE))
+        os.rename(scratch, os.path.join(directory, generation))
+    except Exception:
+        shutil.rmtree(scratch, ignore_errors=True)
+        raise
+    pointer = os.path.join(directory, f".{CURRENT_FILE}.tmp")
+    utils.save_file(generation, pointer)
+    os.replace(pointer, os.path.join(directory, CURRENT_FILE))
+
+    # Readers of older generations keep their open files; only the directory names go
+    generations = sorted(name for name in os.listdir(directory) if name.startswith("gen-"))
+    for name in generations[:-KEEP_GENERATIONS]:
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    return generation
+
+
+def ingest(sources, embeddings, directory=KB_DIR, index_type="auto", on_document=None, **metadata):
+    """
+    Add documents to the knowledge base and publish a new generation.
+
+    Documents already in the knowledge base (same bytes) are skipped. Only one ingest
+    runs at a time per directory.
+
+    :param sources: batch_summarizer.Source objects (name, data, digest).
+
+    :param embeddings: The embeddings used for the chunks, e.g. CachedEmbeddings.
+
+    :param directory: The knowledge base directory.
+
+    :param index_type: One of vector_index.INDEX_TYPES, applied once the corpus is large enough.
+
+    :param on_document: Optional callback, called with each new manifest entry.
+
+    :param metadata: ticker, period and doc_type, stored on the document and all its chunks.
+
+    :return: The manifest entries of the documents added.
+    """
+    import chunking
+    import ingest as parsing
+    import index_cache
+
+    os.makedirs(directory, exist_ok=True)
+    splitter = chunking.make_splitter(CHUNK_SIZE, CHUNK_OVERLAP, separators=SEPARATORS)
+    with open(os.path.join(directory, LOCK_FILE), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        db, documents = _load_writable(directory, embeddings)
+        known = {doc["digest"] for doc in documents}
+        added = []
+        for source in sources:
+            if source.digest in known:
+                continue
+            known.add(source.digest)
+            entry = dict(
+                {field: metadata.get(field) for field in METADATA_FIELDS},
+                digest=source.digest,
+                name=source.name,
+                added=time.time()
+            )
+            data = source.data
+            if data is None:
+                with open(source.path, "rb") as f:
+                    data = f.read()
+            pages = parsing.parse_bytes(source.name, data)
+            for page in pages:
+                page.metadata.update({field: entry[field] for field in METADATA_FIELDS}, digest=source.digest)
+            entry["start"] = db.index.ntotal if db is not None else 0
+            db = index_cache.add_documents(chunking.iter_chunks(pages, splitter), embeddings, db)
+            entry["stop"] = db.index.ntotal if db is not None else 0
+            if entry["stop"] == entry["start"]:
+                continue
+            documents.append(entry)
+            added.append(entry)
+            if on_document:
+                on_document(entry)
+        if added:
+            vector_index.convert(db, index_type)
+            _publish(directory, db, documents)
+    return added
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the shared knowledge base searched by Chat with Large Doc.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser('ingest', help="Parse, embed and add pdf or txt files.")
+    add.add_argument('inputs', nargs='+', help="Files or directories to add.")
+    add.add_argument('--ticker', help="Ticker the documents are about, e.g. AAPL.")
+    add.add_argument('--period', help="Reporting period, e.g. FY2023 or Q3 2023.")
+    add.add_argument('--doc-type', help="Document type, e.g. 10-K, transcript, research.")
+    add.add_argument('--index-type', default='auto', choices=vector_index.INDEX_TYPES)
+    add.add_argument('--dir', default=KB_DIR, help="The knowledge base directory.")
+    show = commands.add_parser('list', help="List the documents in the knowledge base.")
+    show.add_argument('--dir', default=KB_DIR, help="The knowledge base directory.")
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        generation = _current_generation(args.dir)
+        if generation is None:
+            print(f"The knowledge base in {args.dir} is empty.")
+            return 0
+        kb = KnowledgeBase(os.path.join(args.dir, generation))
+        print(f"{generation}: {len(kb.documents)} documents, {len(kb):,} chunks, {vector_index.describe(kb.index)} index")
+        for doc in kb.documents:
+            tags = ", ".join(f"{field}={doc[field]}" for field in METADATA_FIELDS if doc.get(field))
+            print(f"  {doc['digest'][:8]}  {doc['name']}  ({doc['stop'] - doc['start']} chunks{', ' + tags if tags else ''})")
+        return 0
+
+    if not os.environ.get('OPENAI_API_KEY'):
+        parser.error("Set OPENAI_API_KEY to embed the documents.")
+    import llm_pool
+    from batch_summarizer import sources_from_paths
+    from embedding_store import CachedEmbeddings
+
+    embeddings = CachedEmbeddings(llm_pool.get_embeddings(api_key=os.environ['OPENAI_API_KEY']))
+    added = ingest(
+        sources_from_paths(args.inputs),
+        embeddings,
+        args.dir,
+        args.index_type,
+        on_document=lambda doc: print(f"Added {doc['name']} ({doc['stop'] - doc['start']} chunks)"),
+        ticker=args.ticker,
+        period=args.period,
+        doc_type=args.doc_type
+    )
+    print(f"Done: {len(added)} document(s) added to {args.dir}.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,205 @@
+"""
+Shared registry of OpenAI clients and per-session chains.
+
+Chat models and embeddings are stateless, so one instance per (API key, model,
+parameters) is shared by every rerun and every session and evicted once idle. Chains
+carry conversation memory, so they are kept per session by session_resources, which
+may evict an idle session's chains and hands their conversation back on rebuild. All
+OpenAI calls share one pooled HTTP session, so TLS connections are reused across
+reruns (each Streamlit rerun runs on a new thread, and the openai client otherwise
+keeps one HTTP session per thread). Chat models answer from the response cache when
+they can, and every request they and the embeddings send goes through the process-wide
+scheduler, which keeps the org key within its rate limits and serves chat turns first.
+
+With FUNDBRIDGE_LLM_BACKEND=fake the registry hands out the deterministic offline
+models from fake_llm instead, so the pages run without a key or network.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import openai
+import requests
+import streamlit as st
+from langchain.chat_models import ChatOpenAI
+from langchain.embeddings.openai import OpenAIEmbeddings
+
+import response_cache
+import scheduler
+import session_resources
+
+IDLE_SECONDS = int(os.environ.get("FUNDBRIDGE_CLIENT_IDLE_SECONDS", "1800"))
+MAX_CLIENTS = 64
+MAX_SESSION_CHAINS = 4
+SESSION_KEY = "chains"
+# 'openai', or 'fake' for the offline models used by the benchmarks
+BACKEND = os.environ.get("FUNDBRIDGE_LLM_BACKEND", "openai")
+
+_clients = OrderedDict()
+_lock = threading.RLock()
+session_resources.register_shared(lambda: [client for client, _ in list(_clients.values())])
+
+
+def _http_session():
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=64)
+    session.mount("https://", adapter)
+    return session
+
+
+if not isinstance(openai.requestssession, requests.Session):
+    openai.requestssession = _http_session()
+
+
+def current_api_key():
+    """Return this session's API key, falling back to the environment."""
+    return st.session_state.get("OPENAI_API_KEY") or os.environ.get("OPENAI_API_KEY")
+
+
+def _key_hash(api_key):
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+
+
+def _get(kind, api_key, params, factory):
+    key = (kind, _key_hash(api_key), tuple(sorted(params.items())))
+    now = time.monotonic()
+    with _lock:
+        evict_idle(now=now)
+        entry = _clients.get(key)
+        if entry is None:
+            entry = _clients[key] = [factory(), now]
+            while len(_clients) > MAX_CLIENTS:
+                _clients.popitem(last=False)
+        entry[1] = now
+        _clients.move_to_end(key)
+        return entry[0]
+
+
+def _semantic_cache_embeddings():
+    # Imported here: embedding_store needs utils, which imports this module
+    from embedding_store import CachedEmbeddings
+    return CachedEmbeddings(get_embeddings())
+
+
+def get_chat_model(model_name, api_key=None, priority=scheduler.INTERACTIVE, **params):
+    """
+    Return the shared ChatOpenAI for a key, model and parameters.
+
+    :param model_name: The OpenAI model name.
+
+    :param api_key: The API key, defaults to current_api_key().
+
+    :param priority: scheduler.INTERACTIVE for chat turns, scheduler.BULK for summaries.
+
+    :param params: Other ChatOpenAI parameters, e.g. temperature=0, streaming=True.
+
+    :return: A ChatOpenAI. Pass per-request callbacks to the call, not to the model.
+    """
+    api_key = api_key or current_api_key()
+    params = dict(params, model_name=model_name)
+    if BACKEND == "fake":
+        # Uncached, so repeated benchmark rounds do the same work
+        from fake_llm import FakeChatModel as base
+        cache = {}
+    else:
+        base = ChatOpenAI
+        # Responses are only shared between the models of the same key
+        cache = {"cache": response_cache.for_key(api_key, embeddings_factory=_semantic_cache_embeddings)}
+    chat_class = scheduler.scheduled_chat_class(base, priority)
+    return _get(("chat", priority), api_key, params, lambda: chat_class(openai_api_key=api_key, **cache, **params))
+
+
+def get_embeddings(api_key=None, **params):
+    """
+    Return the shared OpenAIEmbeddings for a key and parameters.
+
+    :param api_key: The API key, defaults to current_api_key().
+
+    :param params: Other OpenAIEmbeddings parameters, e.g. model.
+
+    :return: An OpenAIEmbeddings, wrapped in a scheduler.ScheduledEmbeddings.
+    """
+    api_key = api_key or current_api_key()
+    if BACKEND == "fake":
+        from fake_llm import backend_embeddings
+        return _get("embeddings", api_key, params, lambda: scheduler.ScheduledEmbeddings(backend_embeddings(**params)))
+    return _get("embeddings", api_key, params, lambda: scheduler.ScheduledEmbeddings(OpenAIEmbeddings(openai_api_key=api_key, **params)))
+
+
+def evict_idle(max_idle=IDLE_SECONDS, now=None):
+    """Drop shared clients that have not been used for max_idle seconds."""
+    now = time.monotonic() if now is None else now
+    with _lock:
+        for key in [key for key, (_, last_used) in _clients.items() if now - last_used > max_idle]:
+            del _clients[key]
+
+
+def _memory_state(chains):
+    """Return the conversation held by each chain's memory, to spill on eviction."""
+    from langchain.schema.messages import messages_to_dict
+    state = {}
+    for cache_key, chain in chains.items():
+        memory = getattr(chain, "memory", None)
+        chat_memory = getattr(memory, "chat_memory", None)
+        if chat_memory is None or not chat_memory.messages:
+            continue
+        # Turns still waiting to be summarized come first; prune() queues them again
+        messages = list(getattr(memory, "pending", [])) + list(chat_memory.messages)
+        state[cache_key] = {
+            "messages": messages_to_dict(messages),
+            "summary": getattr(memory, "moving_summary_buffer", ""),
+        }
+    return state
+
+
+def _restore_memory(chain, state):
+    from langchain.schema.messages import messages_from_dict
+    memory = getattr(chain, "memory", None)
+    if memory is None or not hasattr(memory, "chat_memory"):
+        return
+    memory.chat_memory.messages = messages_from_dict(state["messages"])
+    if hasattr(memory, "moving_summary_buffer"):
+        memory.moving_summary_buffer = state["summary"]
+    if hasattr(memory, "prune"):
+        memory.prune()
+
+
+def session_chain(name, key, factory):
+    """
+    Return a chain cached in this session, building it with factory() on first use.
+
+    Only the most recently used MAX_SESSION_CHAINS chains are kept per session. If the
+    session's chains were evicted while it was idle, the rebuilt chain gets its
+    conversation memory back.
+
+    :param name: The kind of chain, e.g. 'context_chat'.
+
+    :param key: Whatever the chain depends on, e.g. the model name. A new key builds a new chain.
+
+    :param factory: Called with no arguments to build the chain.
+
+    :return: The chain.
+    """
+    chains = session_resources.get(SESSION_KEY)
+    if chains is None:
+        chains = session_resources.put(SESSION_KEY, OrderedDict(), spill=_memory_state)
+        spilled = session_resources.restore(SESSION_KEY) or {}
+    else:
+        spilled = {}
+    cache_key = (name, key)
+    if cache_key not in chains:
+        chains[cache_key] = factory()
+        if cache_key in spilled:
+            _restore_memory(chains[cache_key], spilled[cache_key])
+        while len(chains) > MAX_SESSION_CHAINS:
+            chains.popitem(last=False)
+    chains.move_to_end(cache_key)
+    return chains[cache_key]
+
+
+def clear_session():
+    """Drop this session's chains (and their memory), leaving other sessions alone."""
+    session_resources.pop(SESSION_KEY)
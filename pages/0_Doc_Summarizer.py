@@ -1,12 +1,8 @@
+import os
 import streamlit as st
 
 import utils
-from utils import create_temp_file, num_tokens_from_string, select_prompt
-
-from langchain.llms import OpenAI
-from langchain.chat_models import ChatOpenAI
-from langchain.document_loaders import TextLoader, UnstructuredPDFLoader, PyPDFLoader
-from langchain.chains.summarize import load_summarize_chain
+from utils import select_prompt, select_prompt_name
 
 st.set_page_config(page_title="Doc Summarizer", page_icon="📹")
 st.markdown("# :green[Doc Summarizer]")
@@ -24,43 +20,223 @@ class DocSummarizer:
         self.openai_model = utils.select_openai_model()        
     
     def main(self):
+        # Imported on first use, like utils.num_tokens_from_string, so tiktoken stays off the first paint
+        import token_counter
+
+        mode = st.radio("Mode", ["Single document", "Several prompts", "Batch"], horizontal=True)
+        if mode == "Batch":
+            self.batch()
+            return
+        if mode == "Several prompts":
+            self.multi_prompt()
+            return
+
         uploaded_file = st.file_uploader(":blue[Upload a document to summarize]", type=['txt', 'pdf'])
-        max_tokens = {
-            'gpt-4-turbo-preview': 100000,
-            'gpt-4': 6000,
-            'gpt-3.5-turbo-1106': 12000,
-            'gpt-3.5-turbo': 2500,
-            'gpt-3.5-turbo-16k': 12000   
-        }
-        st.write ("MAX TOKENS:", max_tokens[self.openai_model])
+        max_tokens = token_counter.max_prompt_tokens(self.openai_model)
+        st.write ("MAX TOKENS:", max_tokens)
         prompt = select_prompt()
+        compress, fit = self.select_compression()
 
         if st.button(":green[Summarize (click once and wait)] :coffee:"):
-            with st.spinner("Summarizing... please wait..."):
-                temp_filepath = create_temp_file (uploaded_file)
-                if uploaded_file.type == 'application/pdf':
-                    st.write ("File is a PDF!")
-                    loader = PyPDFLoader(temp_filepath)
-                    transcript = loader.load()
-                else:
-                    st.write ("File is a text!")
-                    loader = TextLoader(temp_filepath, encoding = 'UTF-8')
-                    transcript = loader.load()
-
-                total_token_count = 0
-                for page in transcript:
-                    token_count = num_tokens_from_string(page.page_content,encoding_name='cl100k_base')
-                    total_token_count += token_count 
-                st.write (f"This document contains {total_token_count} TOKENS!")
-
-                if total_token_count < max_tokens[self.openai_model]:
-                    llm = ChatOpenAI(model_name=self.openai_model)
+            # Heavy imports happen on first use (utils.warm_up usually got to them first)
+            import llm_pool
+            import response_cache
+            import scheduler
+            import tracing
+            from summarize import MapReduceSummarizer, SummaryTooLongError
+            from langchain.chains.summarize import load_summarize_chain
+
+            with st.spinner("Summarizing... please wait..."), tracing.trace("summarize", page="Doc Summarizer", model=self.openai_model) as trace:
+                transcript, total_token_count = self.load_document(uploaded_file, max_tokens, compress, fit, trace)
+
+                if total_token_count < max_tokens:
+                    llm = llm_pool.get_chat_model(self.openai_model, priority=scheduler.BULK)
                     chain = load_summarize_chain(llm, chain_type='stuff', prompt=prompt)
-                    output_summary = chain.run(transcript)
+                    output_summary = chain.run(transcript, callbacks=[tracing.TraceCallback()])
                     st.text_area(label='SUMMARY', value=output_summary, height=800)
                     st.code(output_summary)
+                    response_cache.show_stats()
+                else:
+                    st.write ("Document is too large for a single call, summarizing it in parts...")
+                    llm = llm_pool.get_chat_model(self.openai_model, max_retries=0, priority=scheduler.BULK)
+                    summarizer = MapReduceSummarizer(llm, prompt, max_tokens, callbacks=[tracing.TraceCallback()])
+                    progress = st.progress(0.0)
+                    try:
+                        output_summary = summarizer.summarize(
+                            transcript,
+                            on_progress=lambda done, total: progress.progress(done / total, text=f"{done}/{total} calls done")
+                        )
+                    except SummaryTooLongError as e:
+                        st.error(str(e))
+                    else:
+                        st.text_area(label='SUMMARY', value=output_summary, height=800)
+                        st.code(output_summary)
+                    response_cache.show_stats()
+            scheduler.show_stats()
+            utils.show_trace(trace)
+
+    def select_compression(self):
+        compress = st.checkbox("Compress first: drop headers, footers, page numbers and boilerplate", value=False)
+        fit = st.checkbox("If it is still too large for one call, keep only the sentences with the most financial detail", value=False, disabled=not compress)
+        return compress, fit
+
+    def load_document(self, uploaded_file, max_tokens, compress, fit, trace):
+        """Parse, compress and tokenize an upload, showing what each step did; returns (documents, tokens)."""
+        import compression
+        import ingest
+        import token_counter
+
+        transcript = list(ingest.iter_documents([uploaded_file]))
+        st.caption(ingest.format_timings(trace))
+
+        if compress:
+            # Before the token check, so more documents fit the single 'stuff' call
+            transcript, reports = compression.compress_documents(transcript, target_tokens=max_tokens if fit else None)
+            for report in reports:
+                st.caption(compression.format_report(report))
+
+        # One batch call; each page keeps its count in metadata['token_count']
+        total_token_count = token_counter.count_documents(transcript)
+        st.write (f"This document contains {total_token_count} TOKENS!")
+        return transcript, total_token_count
+
+    def multi_prompt(self):
+        import token_counter
+
+        uploaded_file = st.file_uploader(":blue[Upload a document to summarize]", type=['txt', 'pdf'])
+        max_tokens = token_counter.max_prompt_tokens(self.openai_model)
+        st.write ("MAX TOKENS:", max_tokens)
+        prompt_names = utils.select_prompt_names()
+        compress, fit = self.select_compression()
+
+        if st.button(":green[Summarize with every selected prompt] :coffee:"):
+            if not uploaded_file or not prompt_names:
+                st.warning("Please upload a document and select at least one prompt.")
+                return
+            import threading
+            import time
+
+            import llm_pool
+            import prompts
+            import response_cache
+            import scheduler
+            import tracing
+            from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+            from streaming import StreamHandler
+            from summarize import MapReduceSummarizer
+            from langchain.chains.summarize import load_summarize_chain
+
+            available = prompts.get_prompts()
+            with tracing.trace("summarize", page="Doc Summarizer", model=self.openai_model, prompts=len(prompt_names)) as trace:
+                # Parsed and tokenized once for all the prompts
+                with st.spinner("Reading the document..."):
+                    transcript, total_token_count = self.load_document(uploaded_file, max_tokens, compress, fit, trace)
+                if total_token_count < max_tokens:
+                    llm = llm_pool.get_chat_model(self.openai_model, streaming=True, priority=scheduler.BULK)
                 else:
-                    st.write ("Document is too large for selected model!  Choose another model.")
+                    st.write ("Document is too large for a single call, summarizing it in parts...")
+                    llm = llm_pool.get_chat_model(self.openai_model, max_retries=0, priority=scheduler.BULK)
+
+                panels = {}
+                for name in prompt_names:
+                    panel = st.expander(name, expanded=True)
+                    panels[name] = (panel, panel.empty(), panel.empty())
+                results = {}
+
+                def summarize(name):
+                    # Runs on its own thread, writing only to its own panel
+                    panel, output, progress = panels[name]
+                    start = time.perf_counter()
+                    try:
+                        if total_token_count < max_tokens:
+                            chain = load_summarize_chain(llm, chain_type='stuff', prompt=available[name])
+                            results[name] = chain.run(transcript, callbacks=[StreamHandler(output), tracing.TraceCallback(trace)])
+                        else:
+                            summarizer = MapReduceSummarizer(llm, available[name], max_tokens, callbacks=[tracing.TraceCallback(trace)])
+                            results[name] = summarizer.summarize(
+                                transcript,
+                                on_progress=lambda done, total: progress.progress(done / total, text=f"{done}/{total} calls done")
+                            )
+                            output.markdown(results[name])
+                    except Exception as e:
+                        results[name] = e
+                    tracing.record(f"prompt:{name}", start, trace=trace)
+
+                threads = [threading.Thread(target=summarize, args=(name,), name=f"summarize-{name}") for name in prompt_names]
+                ctx = get_script_run_ctx()
+                for thread in threads:
+                    add_script_run_ctx(thread, ctx)
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+                for name in prompt_names:
+                    panel, output, progress = panels[name]
+                    progress.empty()
+                    if isinstance(results.get(name), Exception):
+                        panel.error(f"{name} failed: {results[name]}")
+                response_cache.show_stats()
+            scheduler.show_stats()
+            utils.show_trace(trace)
+
+    def batch(self):
+        uploaded_files = st.file_uploader(":blue[Upload the documents to summarize]", type=['txt', 'pdf'], accept_multiple_files=True)
+        prompt_name = select_prompt_name()
+        folder = st.text_input("Output folder", value="default", help="Summaries are kept on the server under this name and offered as downloads.")
+        concurrency = st.slider("Concurrent LLM calls", min_value=1, max_value=16, value=4)
+        compress = st.checkbox("Compress first: drop headers, footers, page numbers and boilerplate", value=False)
+
+        if st.button(":green[Summarize all] :coffee:"):
+            if not uploaded_files:
+                st.warning("Please upload files.")
+                return
+            import io
+            import zipfile
+
+            from batch_summarizer import BatchSummarizer, output_dir, sources_from_uploads
+
+            try:
+                # Always under the local cache: the folder comes from a web user
+                out_dir = output_dir(folder, utils.get_cache_dir("summaries"))
+            except ValueError as e:
+                st.warning(str(e))
+                return
+            batch = BatchSummarizer(out_dir, self.openai_model, prompt_name, concurrency, compress=compress)
+            sources = sources_from_uploads(uploaded_files)
+            summaries = {}
+
+            # Documents finished by an earlier run are shown, not summarized again
+            for source in sources:
+                if batch.is_done(source):
+                    name = batch.output_name(source)
+                    summaries[name] = utils.open_file(os.path.join(out_dir, name))
+                    with st.expander(f"{source.name} (from a previous run)"):
+                        st.code(summaries[name])
+                        st.download_button("Download", summaries[name], file_name=name, key=f"download-{name}")
+
+            progress = st.progress(0.0)
+
+            def show_result(result, done, total):
+                progress.progress(done / total, text=f"{done}/{total} documents done")
+                with st.expander(result['name']):
+                    if 'error' in result:
+                        st.error(result['error'])
+                    else:
+                        summaries[result['output']] = result['summary']
+                        tokens = f"{result['tokens']} tokens"
+                        if 'tokens_before' in result:
+                            tokens += f" (compressed from {result['tokens_before']})"
+                        st.write(f"{tokens} in {result['seconds']}s")
+                        st.code(result['summary'])
+                        st.download_button("Download", result['summary'], file_name=result['output'], key=f"download-{result['output']}")
+
+            batch.run(sources, on_result=show_result)
+            if summaries:
+                archive = io.BytesIO()
+                with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as f:
+                    for name, summary in summaries.items():
+                        f.writestr(name, summary)
+                st.download_button(f"Download all {len(summaries)} summaries", archive.getvalue(), file_name=f"{os.path.basename(out_dir)}.zip", mime="application/zip")
 
 if __name__ == "__main__":
     obj = DocSummarizer()
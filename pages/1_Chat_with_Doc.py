@@ -1,17 +1,6 @@
 import streamlit as st
 
 import utils
-from utils import create_temp_file, num_tokens_from_string, select_prompt
-
-from streaming import StreamHandler
-
-from langchain.chat_models import ChatOpenAI
-from langchain.document_loaders import TextLoader, UnstructuredPDFLoader, PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.vectorstores import faiss
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationalRetrievalChain
 
 st.set_page_config(page_title="Chat with Doc", page_icon="📈")
 st.markdown("# Chat with Doc")
@@ -25,52 +14,81 @@ st.write(
 )
 
 class CustomDataChatbot:
+    # Chunking settings for this page, in tokens
+    chunk_size = 400
+    chunk_overlap = 50
 
     def __init__(self):
         utils.configure_openai_api_key()
         self.openai_model = utils.select_openai_model()   
 
+    def load_documents(self, uploaded_files):
+        import chunking
+        import ingest
+
+        # Parse in parallel; chunks stream into the index as pages are parsed
+        docs = ingest.iter_documents(uploaded_files)
+        text_splitter = chunking.make_splitter(self.chunk_size, self.chunk_overlap)
+        return chunking.iter_chunks(docs, text_splitter)
+
     @st.spinner('Analyzing documents..')
     def setup_qa_chain(self, uploaded_files):
-        # Load documents
-        docs = []
-        for file in uploaded_files:
-            file_path = create_temp_file (file)
-            if file.type == 'application/pdf':
-                st.write ("File is a PDF!")
-                loader = PyPDFLoader(file_path)
-                docs.extend(loader.load())
-            else:
-                st.write ("File is a text!")
-                loader = TextLoader(file_path, encoding = 'UTF-8')
-                docs.extend(loader.load())
-        
-        # Split documents
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1500,
-            chunk_overlap=200
+        # Heavy imports happen on first use (utils.warm_up usually got to them first)
+        import index_cache
+        import ingest
+        import llm_pool
+        import tracing
+        from embedding_store import CachedEmbeddings
+
+        # Reuse the cached index for these files, embedding only chunks not seen before
+        embeddings = CachedEmbeddings(llm_pool.get_embeddings())
+        db = index_cache.load_or_build(
+            uploaded_files,
+            embeddings,
+            self.load_documents,
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
+            chunk_unit='tokens',
+            embedding_model=embeddings.model
+        )
+        timings = ingest.format_timings(tracing.current())
+        if timings:
+            st.caption(timings)
+        stats = embeddings.stats()
+        st.sidebar.caption(
+            f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses, ~{stats['saved_tokens']} tokens saved"
         )
-        splits = text_splitter.split_documents(docs)
-
-        # Create embeddings and store in vectordb
-        db = faiss.FAISS.from_documents (docs, OpenAIEmbeddings())
 
-        # Define retriever
-        retriever = db.as_retriever(
-            search_type='mmr',
-            search_kwargs={'k':2, 'fetch_k':4}
+        # Reuse this session's chain (and its memory) while the index and model stay the same
+        return llm_pool.session_chain(
+            'qa_chain',
+            (id(db), self.openai_model),
+            lambda: self.build_qa_chain(db, index_cache.session_lexical(db))
         )
 
-        # Setup memory for contextual conversation        
-        memory = ConversationBufferMemory(
+    def build_qa_chain(self, db, lexical):
+        import llm_pool
+        from retrieval import HybridRetriever
+        from query_pipeline import QueryPipeline
+        from conversation_memory import BudgetedMemory, history_budget
+
+        # Define retriever: BM25 + vector search over a wide candidate set, re-ranked down
+        # to the same two chunks of context as before
+        retriever = HybridRetriever(vectorstore=db, lexical=lexical, k=2, fetch_k=20)
+
+        # Setup memory for contextual conversation: recent turns verbatim within a budget,
+        # older ones summarized in the background
+        memory = BudgetedMemory(
+            llm=llm_pool.get_chat_model(self.openai_model, temperature=0),
+            max_token_limit=history_budget(self.openai_model),
             memory_key='chat_history',
+            output_key='answer',
             return_messages=True
         )
 
-        # Setup LLM and QA chain
-        llm = ChatOpenAI(model_name=self.openai_model, temperature=0, streaming=True)
-        qa_chain = ConversationalRetrievalChain.from_llm(llm, retriever=retriever, memory=memory, verbose=True)
-        return qa_chain
+        # Setup LLM and QA pipeline: no condense call, the history goes into the answer prompt
+        llm = llm_pool.get_chat_model(self.openai_model, temperature=0, streaming=True)
+        return QueryPipeline(retriever, llm, memory)
 
     @utils.enable_chat_history
     def main(self):
@@ -84,14 +102,22 @@ class CustomDataChatbot:
         user_query = st.chat_input(placeholder="Ask me anything!")
 
         if uploaded_files and user_query:
-            qa_chain = self.setup_qa_chain(uploaded_files)
-
-            utils.display_msg(user_query, 'user')
-
-            with st.chat_message("assistant"):
-                st_cb = StreamHandler(st.empty())
-                response = qa_chain.run(user_query, callbacks=[st_cb])
-                st.session_state.messages.append({"role": "assistant", "content": response})
+            import tracing
+            with tracing.trace("chat_turn", page="Chat with Doc", model=self.openai_model) as trace:
+                qa_chain = self.setup_qa_chain(uploaded_files)
+
+                utils.display_msg(user_query, 'user')
+                from streaming import StreamHandler
+                from query_pipeline import format_citations
+
+                with st.chat_message("assistant"):
+                    st_cb = StreamHandler(st.empty())
+                    response = qa_chain.run(user_query, callbacks=[st_cb])
+                    utils.record_msg(response, 'assistant')
+                    if qa_chain.last_citations:
+                        st.caption(format_citations(qa_chain.last_citations))
+                utils.show_prompt_tokens(st_cb, qa_chain.memory)
+            utils.show_trace(trace)
 
 if __name__ == "__main__":
     obj = CustomDataChatbot()
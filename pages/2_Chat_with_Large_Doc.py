@@ -1,17 +1,6 @@
 import streamlit as st
 
 import utils
-from utils import create_temp_file, num_tokens_from_string, select_prompt
-
-from streaming import StreamHandler
-
-from langchain.chat_models import ChatOpenAI
-from langchain.document_loaders import TextLoader, UnstructuredPDFLoader, PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.vectorstores import faiss
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationalRetrievalChain
 
 st.set_page_config(page_title="Chat with Large Doc", page_icon="📈")
 st.markdown("# Chat with Large Doc")
@@ -25,74 +14,174 @@ st.write(
 )
 
 class CustomDataChatbot:
+    # Chunking settings for this page, in tokens
+    chunk_size = 500
+    chunk_overlap = 60
+    separators = ["\n", "\n\n", "(?<=\. )", "", " "]
 
     def __init__(self):
         utils.configure_openai_api_key()
         self.openai_model = utils.select_openai_model()   
+        self.index_type = 'auto'
+
+    def select_index_type(self):
+        import vector_index
+
+        index_type = st.sidebar.selectbox(":blue[Select an index type:]", vector_index.INDEX_TYPES)
+        st.sidebar.caption(
+            f"Corpora under {vector_index.TRAIN_THRESHOLD:,} chunks always use an exact flat index; "
+            f"'auto' switches to {vector_index.AUTO_TYPE} above that."
+        )
+        return index_type
+
+    def load_documents(self, uploaded_files):
+        import chunking
+        import ingest
+
+        # Parse in parallel; chunks stream into the index as pages are parsed
+        docs = ingest.iter_documents(uploaded_files)
+        text_splitter = chunking.make_splitter(self.chunk_size, self.chunk_overlap, separators=self.separators)
+        return chunking.iter_chunks(docs, text_splitter)
 
     @st.spinner('Loading knowledge base documents..')
     def setup_qa_chain(self, uploaded_files):
-        # Load documents
-        docs = []
-        for file in uploaded_files:
-            file_path = create_temp_file (file)
-            if file.type == 'application/pdf':
-                st.write ("File is a PDF!")
-                loader = PyPDFLoader(file_path)
-                docs.extend(loader.load())
-            else:
-                st.write ("File is a text!")
-                loader = TextLoader(file_path, encoding = 'UTF-8')
-                docs.extend(loader.load())
-        
-        # Split documents
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1500,
-            chunk_overlap=200,
-            separators=["\n", "\n\n", "(?<=\. )", "", " "]
+        # Heavy imports happen on first use (utils.warm_up usually got to them first)
+        import index_cache
+        import ingest
+        import llm_pool
+        import tracing
+        import vector_index
+        from embedding_store import CachedEmbeddings
+
+        # Reuse the cached index for these files, embedding only chunks not seen before
+        embeddings = CachedEmbeddings(llm_pool.get_embeddings())
+        db = index_cache.load_or_build(
+            uploaded_files,
+            embeddings,
+            self.load_documents,
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
+            chunk_unit='tokens',
+            separators=self.separators,
+            embedding_model=embeddings.model,
+            index_type=self.index_type
+        )
+        timings = ingest.format_timings(tracing.current())
+        if timings:
+            st.caption(timings)
+        st.caption(f"{db.index.ntotal:,} chunks, {vector_index.describe(db.index)} index")
+        stats = embeddings.stats()
+        st.sidebar.caption(
+            f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses, ~{stats['saved_tokens']} tokens saved"
         )
-        splits = text_splitter.split_documents(docs)
 
-        # Create embeddings and store in vectordb
-        db = faiss.FAISS.from_documents (docs, OpenAIEmbeddings())
+        # Reuse this session's chain (and its memory) while the index and model stay the same
+        return llm_pool.session_chain(
+            'qa_chain',
+            (id(db), self.openai_model),
+            lambda: self.build_qa_chain(db, index_cache.session_lexical(db))
+        )
 
-        # Define retriever
-        retriever = db.as_retriever(
-            search_type='mmr',
-            search_kwargs={'k':2, 'fetch_k':4}
+    def select_filters(self, kb):
+        import knowledge_base
+
+        filters = {}
+        for field in knowledge_base.METADATA_FIELDS:
+            values = kb.values(field)
+            if values:
+                label = field.replace('_', ' ').capitalize()
+                filters[field] = st.sidebar.multiselect(f":blue[{label}:]", values)
+        return filters
+
+    def setup_kb_chain(self, kb, filters):
+        import llm_pool
+        from embedding_store import CachedEmbeddings
+
+        allowed = kb.positions(**filters)
+        searched = len(kb) if allowed is None else len(allowed)
+        st.caption(f"Searching {searched:,} of {len(kb):,} knowledge base chunks")
+
+        # One chain per knowledge base generation; changing the filters keeps the conversation
+        qa_chain = llm_pool.session_chain(
+            'kb_chain',
+            (kb.generation, self.openai_model),
+            lambda: self.build_qa_chain(kb.store(CachedEmbeddings(llm_pool.get_embeddings())), kb.lexical)
         )
+        qa_chain.retriever.allowed = allowed
+        return qa_chain
 
-        # Setup memory for contextual conversation        
-        memory = ConversationBufferMemory(
+    def build_qa_chain(self, db, lexical):
+        import llm_pool
+        from retrieval import HybridRetriever
+        from query_pipeline import QueryPipeline
+        from conversation_memory import BudgetedMemory, history_budget
+
+        # Define retriever: BM25 + vector search over a wide candidate set, re-ranked down
+        # to the same two chunks of context as before
+        retriever = HybridRetriever(vectorstore=db, lexical=lexical, k=2, fetch_k=20)
+
+        # Setup memory for contextual conversation: recent turns verbatim within a budget,
+        # older ones summarized in the background
+        memory = BudgetedMemory(
+            llm=llm_pool.get_chat_model(self.openai_model, temperature=0),
+            max_token_limit=history_budget(self.openai_model),
             memory_key='chat_history',
+            output_key='answer',
             return_messages=True
         )
 
-        # Setup LLM and QA chain
-        llm = ChatOpenAI(model_name=self.openai_model, temperature=0, streaming=True)
-        qa_chain = ConversationalRetrievalChain.from_llm(llm, retriever=retriever, memory=memory, verbose=True)
-        return qa_chain
+        # Setup LLM and QA pipeline: no condense call, the history goes into the answer prompt
+        llm = llm_pool.get_chat_model(self.openai_model, temperature=0, streaming=True)
+        return QueryPipeline(retriever, llm, memory)
 
     @utils.enable_chat_history
     def main(self):
 
-        # User Inputs
-        uploaded_files = st.file_uploader(label='Upload PDF or text files', type=['pdf','txt'], accept_multiple_files=True)
-        if not uploaded_files:
-            st.error("Please upload documents to continue!")
+        import knowledge_base
+
+        # Search the shared knowledge base, or files uploaded in this session
+        kb = knowledge_base.open_shared()
+        source = st.radio("Search", ["Knowledge base", "Uploaded files"], horizontal=True, index=0 if kb else 1)
+        if source == "Knowledge base" and kb is None:
+            st.info(
+                "The knowledge base is empty. Add documents with "
+                "`python knowledge_base.py ingest FILES --ticker AAPL --period FY2023 --doc-type 10-K`, "
+                "or upload files instead."
+            )
             st.stop()
 
-        user_query = st.chat_input(placeholder="Ask me anything!")
-
-        if uploaded_files and user_query:
-            qa_chain = self.setup_qa_chain(uploaded_files)
+        # User Inputs
+        if source == "Knowledge base":
+            filters = self.select_filters(kb)
+        else:
+            self.index_type = self.select_index_type()
+            uploaded_files = st.file_uploader(label='Upload PDF or text files', type=['pdf','txt'], accept_multiple_files=True)
+            if not uploaded_files:
+                st.error("Please upload documents to continue!")
+                st.stop()
 
-            utils.display_msg(user_query, 'user')
+        user_query = st.chat_input(placeholder="Ask me anything!")
 
-            with st.chat_message("assistant"):
-                st_cb = StreamHandler(st.empty())
-                response = qa_chain.run(user_query, callbacks=[st_cb])
-                st.session_state.messages.append({"role": "assistant", "content": response})
+        if user_query:
+            import tracing
+            with tracing.trace("chat_turn", page="Chat with Large Doc", model=self.openai_model) as trace:
+                if source == "Knowledge base":
+                    qa_chain = self.setup_kb_chain(kb, filters)
+                else:
+                    qa_chain = self.setup_qa_chain(uploaded_files)
+
+                utils.display_msg(user_query, 'user')
+                from streaming import StreamHandler
+                from query_pipeline import format_citations
+
+                with st.chat_message("assistant"):
+                    st_cb = StreamHandler(st.empty())
+                    response = qa_chain.run(user_query, callbacks=[st_cb])
+                    utils.record_msg(response, 'assistant')
+                    if qa_chain.last_citations:
+                        st.caption(format_citations(qa_chain.last_citations))
+                utils.show_prompt_tokens(st_cb, qa_chain.memory)
+            utils.show_trace(trace)
 
 if __name__ == "__main__":
     obj = CustomDataChatbot()
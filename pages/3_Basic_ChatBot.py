@@ -1,11 +1,5 @@
 import utils
 import streamlit as st
-from streaming import StreamHandler
-
-from langchain.llms import OpenAI
-from langchain.chat_models import ChatOpenAI
-from langchain.chains import ConversationChain
-
 
 st.set_page_config(page_title="Chatbot", page_icon="💬")
 st.markdown("# :green[Basic Chatbot]")
@@ -18,20 +12,33 @@ class Basic:
         self.openai_model = utils.select_openai_model()
     
     def setup_chain(self):
-        llm = ChatOpenAI(model_name=self.openai_model, temperature=0, streaming=True)
-        chain = ConversationChain(llm=llm, verbose=True)
+        # Imported on first use so the page paints before langchain loads
+        import llm_pool
+        from langchain.chains import ConversationChain
+
+        # Reuse this session's chain; the model client is shared across sessions
+        chain = llm_pool.session_chain('basic_chat', self.openai_model, lambda: ConversationChain(
+            llm=llm_pool.get_chat_model(self.openai_model, temperature=0, streaming=True),
+            verbose=True
+        ))
+        # This chatbot has no memory; start every turn from an empty buffer
+        chain.memory.clear()
         return chain
     
     @utils.enable_chat_history
     def main(self):
-        chain = self.setup_chain()
         user_query = st.chat_input(placeholder="Ask me anything!")
         if user_query:
-            utils.display_msg(user_query, 'user')
-            with st.chat_message("assistant"):
-                st_cb = StreamHandler(st.empty())
-                response = chain.run(user_query, callbacks=[st_cb])
-                st.session_state.messages.append({"role": "assistant", "content": response})
+            import tracing
+            with tracing.trace("chat_turn", page="Basic ChatBot", model=self.openai_model) as trace:
+                chain = self.setup_chain()
+                from streaming import StreamHandler
+                utils.display_msg(user_query, 'user')
+                with st.chat_message("assistant"):
+                    st_cb = StreamHandler(st.empty())
+                    response = chain.run(user_query, callbacks=[st_cb, tracing.TraceCallback()])
+                    utils.record_msg(response, 'assistant')
+            utils.show_trace(trace)
 
 if __name__ == "__main__":
     obj = Basic()
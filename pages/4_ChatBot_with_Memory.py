@@ -1,11 +1,5 @@
 import utils
 import streamlit as st
-from streaming import StreamHandler
-
-from langchain.llms import OpenAI
-from langchain.chat_models import ChatOpenAI
-from langchain.chains import ConversationChain
-from langchain.memory import ConversationBufferMemory
 
 st.set_page_config(page_title="Context aware chatbot", page_icon="⭐")
 st.markdown("# :green[ChatBot with Memory]")
@@ -17,23 +11,41 @@ class ContextChatbot:
         utils.configure_openai_api_key()
         self.openai_model = utils.select_openai_model()
     
-    @st.cache_resource
-    def setup_chain(_self):
-        memory = ConversationBufferMemory()
-        llm = ChatOpenAI(model_name=_self.openai_model, temperature=0, streaming=True)
+    def setup_chain(self):
+        # One chain (and memory) per session and model; the model client is shared
+        import llm_pool
+        return llm_pool.session_chain('context_chat', self.openai_model, self.build_chain)
+
+    def build_chain(self):
+        # Imported on first use so the page paints before langchain loads
+        import llm_pool
+        from langchain.chains import ConversationChain
+        from conversation_memory import BudgetedMemory, history_budget
+
+        # Recent turns verbatim within a budget, older ones summarized in the background
+        memory = BudgetedMemory(
+            llm=llm_pool.get_chat_model(self.openai_model, temperature=0),
+            max_token_limit=history_budget(self.openai_model)
+        )
+        llm = llm_pool.get_chat_model(self.openai_model, temperature=0, streaming=True)
         chain = ConversationChain(llm=llm, memory=memory, verbose=True)
         return chain
     
     @utils.enable_chat_history
     def main(self):
-        chain = self.setup_chain()
         user_query = st.chat_input(placeholder="Ask me anything!")
         if user_query:
-            utils.display_msg(user_query, 'user')
-            with st.chat_message("assistant"):
-                st_cb = StreamHandler(st.empty())
-                response = chain.run(user_query, callbacks=[st_cb])
-                st.session_state.messages.append({"role": "assistant", "content": response})
+            import tracing
+            with tracing.trace("chat_turn", page="ChatBot with Memory", model=self.openai_model) as trace:
+                chain = self.setup_chain()
+                from streaming import StreamHandler
+                utils.display_msg(user_query, 'user')
+                with st.chat_message("assistant"):
+                    st_cb = StreamHandler(st.empty())
+                    response = chain.run(user_query, callbacks=[st_cb, tracing.TraceCallback()])
+                    utils.record_msg(response, 'assistant')
+                utils.show_prompt_tokens(st_cb, chain.memory)
+            utils.show_trace(trace)
 
 if __name__ == "__main__":
     obj = ContextChatbot()
@@ -1,5 +1,31 @@
+"""
+The summary prompts, by name.
+
+Every prompt is a PromptTemplate with a single {text} input. Besides the built-in ones,
+each *.txt file in PROMPTS_DIR (FUNDBRIDGE_PROMPTS_DIR, default prompt_templates/ next
+to this file) is a prompt named after the file, picked up without a restart. An optional
+first line "Description: ..." is shown in the prompt picker:
+
+    Description: Risks and mitigations raised on the call.
+
+    List every business risk discussed in the transcript below ...
+
+    TRANSCRIPT:
+    {text}
+"""
+
+import glob
+import os
+import threading
+
 from langchain.prompts import PromptTemplate
-from langchain.chains.summarize import load_summarize_chain
+from streamlit.logger import get_logger
+
+LOGGER = get_logger(__name__)
+PROMPTS_DIR = os.environ.get(
+    "FUNDBRIDGE_PROMPTS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompt_templates")
+)
+DESCRIPTION_PREFIX = "Description:"
 
 earnings_prompt_template = """Summarize key takeaways in the transcript of an earnings call.  In your summary, address the following points about financial performance metrics one-by-one.
 
@@ -68,4 +94,94 @@ ARTICLE:
 {text}
 """
 
-PROMPT_investment = PromptTemplate(template=investment_prompt_template, input_variables=["text"])
\ No newline at end of file
+PROMPT_investment = PromptTemplate(template=investment_prompt_template, input_variables=["text"])
+
+# Prompts selectable in the UI and the batch CLI, by name; see get_prompts() for custom ones
+PROMPTS = {
+    'short_default': PROMPT_short,
+    'earnings': PROMPT_earnings,
+    'investment': PROMPT_investment
+}
+DESCRIPTIONS = {
+    'short_default': 'Generic summary prompt. 100-150 word summary.',
+    'earnings': 'Prompt for Earnings Call Transcripts. Focused on financial metrics.',
+    'investment': 'Prompt to summarize an investment write-up.'
+}
+
+_lock = threading.Lock()
+_custom = {}  # path -> (mtime, name, prompt, description)
+
+
+def register_prompt(name, template, description=""):
+    """
+    Add a prompt to the registry, replacing any prompt of the same name.
+
+    :param name: The name shown in the UI and accepted by the batch CLI.
+
+    :param template: The template text, or a PromptTemplate, with a single {text} input.
+
+    :param description: A one-line description for the prompt picker.
+
+    :return: The PromptTemplate.
+    """
+    prompt = template if isinstance(template, PromptTemplate) else PromptTemplate.from_template(template)
+    if prompt.input_variables != ["text"]:
+        raise ValueError(f"Prompt {name!r} must have exactly one input, {{text}}, not {prompt.input_variables}.")
+    PROMPTS[name] = prompt
+    DESCRIPTIONS[name] = description
+    return prompt
+
+
+def parse_prompt_file(path):
+    """
+    :param path: A template file, see the module docstring.
+
+    :return: A (name, PromptTemplate, description) tuple.
+    """
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    description = ""
+    first_line, _, rest = text.partition("\n")
+    if first_line.startswith(DESCRIPTION_PREFIX):
+        description, text = first_line[len(DESCRIPTION_PREFIX):].strip(), rest.lstrip("\n")
+    prompt = PromptTemplate.from_template(text)
+    if prompt.input_variables != ["text"]:
+        raise ValueError(f"needs exactly one input, {{text}}, not {prompt.input_variables}")
+    return os.path.splitext(os.path.basename(path))[0], prompt, description
+
+
+def get_prompts(directory=None):
+    """
+    Return every prompt by name: the registered ones and those in the prompts directory.
+    Template files are re-read only when they change; invalid ones are skipped with a warning.
+
+    :param directory: The directory of template files, defaults to PROMPTS_DIR.
+
+    :return: A dict of name -> PromptTemplate, built-in prompts first.
+    """
+    directory = directory or PROMPTS_DIR
+    paths = sorted(glob.glob(os.path.join(directory, "*.txt")))
+    with _lock:
+        for path in set(_custom) - set(paths):
+            del _custom[path]
+        for path in paths:
+            mtime = os.path.getmtime(path)
+            if path in _custom and _custom[path][0] == mtime:
+                continue
+            try:
+                _custom[path] = (mtime, *parse_prompt_file(path))
+            except (OSError, ValueError) as e:
+                LOGGER.warning("Skipping prompt template %s: %s", path, e)
+                _custom.pop(path, None)
+        custom = list(_custom.values())
+    prompts = dict(PROMPTS)
+    prompts.update((name, prompt) for _, name, prompt, _ in custom)
+    return prompts
+
+
+def describe(name):
+    """Return the description of a prompt from get_prompts(), or ''."""
+    for _, custom_name, _, description in list(_custom.values()):
+        if custom_name == name:
+            return description
+    return DESCRIPTIONS.get(name, "")
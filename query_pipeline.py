@@ -0,0 +1,179 @@
+"""
+Asynchronous question answering for the Chat with Doc pages, in place of
+ConversationalRetrievalChain.
+
+ConversationalRetrievalChain runs every stage in turn: an LLM call to condense a
+follow-up into a standalone question, the query embedding, the search, then the answer.
+QueryPipeline instead:
+
+- makes no condense call on the first turn, and by default none on follow-ups either:
+  the search runs on the question plus the previous question, and the conversation goes
+  into the answer prompt, where the model resolves "it" or "that quarter" itself. Pass
+  condense_llm to get the standalone-question call back on follow-ups;
+- embeds the query (and runs the vector search) while the BM25 prefetch runs;
+- starts streaming the answer while the citations of the retrieved chunks are collected.
+
+Every stage is recorded as a span of the current trace (see tracing), logged, and kept
+in last_timings.
+"""
+
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.messages import HumanMessage, SystemMessage, get_buffer_string
+from streamlit.logger import get_logger
+
+import tracing
+
+LOGGER = get_logger(__name__)
+
+# The prompts ConversationalRetrievalChain used, so answers read the same
+ANSWER_PROMPT = """Use the following pieces of context to answer the user's question.
+If you don't know the answer, just say that you don't know, don't try to make up an answer.
+----------------
+{context}"""
+CONDENSE_PROMPT = """Given the following conversation and a follow up question, rephrase the follow up question to be a standalone question, in its original language.
+
+Chat History:
+{chat_history}
+Follow Up Input: {question}
+Standalone question:"""
+
+# Retrieval work is blocking (HTTP for the query embedding, numpy for BM25), so it runs
+# on threads while the event loop waits on both
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="query")
+
+
+def collect_citations(docs):
+    """
+    :param docs: The retrieved chunks, best first.
+
+    :return: One {'source', 'pages'} dict per source file, in retrieval order; pages are
+        1-based and empty for text files.
+    """
+    found = {}
+    for doc in docs:
+        source = doc.metadata.get("source", "unknown")
+        entry = found.setdefault(source, {"source": source, "pages": []})
+        page = doc.metadata.get("page")
+        if page is not None and page + 1 not in entry["pages"]:
+            entry["pages"].append(page + 1)
+    for entry in found.values():
+        entry["pages"].sort()
+    return list(found.values())
+
+
+def format_citations(citations):
+    """Return e.g. 'Sources: report.pdf (p. 3, 7), notes.txt'."""
+    parts = []
+    for citation in citations:
+        name = citation["source"].rsplit("/", 1)[-1]
+        if citation["pages"]:
+            name += f" (p. {', '.join(str(page) for page in citation['pages'])})"
+        parts.append(name)
+    return "Sources: " + ", ".join(parts) if parts else ""
+
+
+class QueryPipeline:
+    """
+    Answers questions over a HybridRetriever with conversation memory.
+
+    Callbacks passed to run() are called on the thread that calls run(), so a
+    StreamHandler can write to Streamlit as with the synchronous chain.
+    """
+
+    def __init__(self, retriever, llm, memory, condense_llm=None):
+        """
+        :param retriever: The retrieval.HybridRetriever to search.
+
+        :param llm: The chat model for the answer, usually with streaming=True.
+
+        :param memory: A BudgetedMemory with return_messages=True.
+
+        :param condense_llm: Optional chat model to rewrite follow-ups as standalone questions.
+        """
+        self.retriever = retriever
+        self.llm = llm
+        self.memory = memory
+        self.condense_llm = condense_llm
+        self.last_timings = {}
+        self.last_citations = []
+
+    async def _search_query(self, question, history, timings):
+        """Return the text to search for: the question, with context from earlier turns."""
+        previous = [message.content for message in history if isinstance(message, HumanMessage)]
+        if not previous:
+            return question
+        if self.condense_llm is None:
+            return f"{previous[-1]}\n{question}"
+        with tracing.span("condense") as span:
+            standalone = await self.condense_llm.apredict(
+                CONDENSE_PROMPT.format(chat_history=get_buffer_string(history), question=question)
+            )
+        timings["condense"] = span.seconds
+        return standalone
+
+    async def _retrieve(self, query, timings):
+        loop = asyncio.get_running_loop()
+
+        async def timed(stage, ranking):
+            with tracing.span(stage) as span:
+                # With the context copied, so spans recorded in the worker reach the trace
+                result = await loop.run_in_executor(_executor, contextvars.copy_context().run, ranking, query)
+                span.set(candidates=len(result))
+            timings[stage] = span.seconds
+            return result
+
+        vector, lexical = await asyncio.gather(
+            timed("embed_query_and_search", self.retriever.vector_ranking),
+            timed("lexical_search", self.retriever.lexical_ranking)
+        )
+        with tracing.span("rerank") as span:
+            docs = [self.retriever.document(position) for position, _ in self.retriever.fuse(query, vector, lexical)]
+            span.set(chunks=len(docs))
+        timings["rerank"] = span.seconds
+        return docs
+
+    async def arun(self, question, callbacks=None):
+        """
+        Answer a question and save the turn to memory.
+
+        :param question: The user's question.
+
+        :param callbacks: Callbacks for the answer's LLM call, e.g. a StreamHandler.
+
+        :return: The answer text. The citations are in last_citations afterwards.
+        """
+        timings = {}
+        start = time.perf_counter()
+        history = self.memory.load_memory_variables({})[self.memory.memory_key]
+        with tracing.span("retrieve") as span:
+            query = await self._search_query(question, history, timings)
+            docs = await self._retrieve(query, timings)
+        timings["retrieve"] = span.seconds
+
+        loop = asyncio.get_running_loop()
+        citations = loop.run_in_executor(_executor, contextvars.copy_context().run, collect_citations, docs)
+
+        context = "\n\n".join(doc.page_content for doc in docs)
+        messages = [SystemMessage(content=ANSWER_PROMPT.format(context=context)), *history, HumanMessage(content=question)]
+        tracer = tracing.TraceCallback()
+        generate_start = time.perf_counter()
+        result = await self.llm.agenerate([messages], callbacks=[*(callbacks or []), tracer])
+        answer = result.generations[0][0].text
+        if tracer.first_token_at is not None:
+            timings["first_token"] = tracer.first_token_at - start
+        timings["generate"] = time.perf_counter() - generate_start
+
+        self.last_citations = await citations
+        self.memory.save_context({"question": question}, {"answer": answer})
+        timings["total"] = time.perf_counter() - start
+        self.last_timings = timings
+        LOGGER.info("Query pipeline: %s", ", ".join(f"{stage} {seconds * 1000:.0f}ms" for stage, seconds in timings.items()))
+        return answer
+
+    def run(self, question, callbacks=None):
+        """Synchronous entry point for the Streamlit script thread; see arun()."""
+        return asyncio.run(self.arun(question, callbacks))
@@ -0,0 +1,289 @@
+"""
+Response cache for every LLM call made by the pages, backed by a local SQLite file.
+
+llm_pool gives every model the cache of its API key (for_key()), so the exact key is a
+hash of the API key, the full prompt sent to the model (which includes the question and
+any retrieved context) and the model and its parameters. One user's answers, and the
+private documents behind them, are never served to another key. Optionally, a miss
+falls back to a semantic lookup: the prompt is embedded and the closest cached prompt
+for the same key and model is reused if its cosine similarity is above a threshold.
+Cached answers still reach StreamHandler, which replays them as a stream.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import streamlit as st
+from langchain.schema import Generation
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+from streamlit.logger import get_logger
+
+import session_resources
+import utils
+
+LOGGER = get_logger(__name__)
+
+DB_FILE = "responses.sqlite3"
+TTL_SECONDS = int(os.environ.get("FUNDBRIDGE_RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+MAX_CACHE_BYTES = int(os.environ.get("FUNDBRIDGE_RESPONSE_CACHE_MB", "256")) * 1024 * 1024
+# Unset disables the semantic lookup; e.g. 0.97 enables it
+SEMANTIC_THRESHOLD = os.environ.get("FUNDBRIDGE_SEMANTIC_CACHE_THRESHOLD")
+SEMANTIC_CANDIDATES = 5000
+EVICT_EVERY = 50
+MAX_PENDING = 1000
+
+
+def _prompt_text(prompt):
+    """Pull the human-readable text out of a serialized chat prompt for embedding."""
+    try:
+        data = json.loads(prompt)
+    except ValueError:
+        return prompt
+    texts = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            if isinstance(node.get("content"), str):
+                texts.append(node["content"])
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(data)
+    return "\n".join(texts) or prompt
+
+
+class ResponseCache(BaseCache):
+
+    def __init__(self, path=None, ttl=TTL_SECONDS, max_bytes=MAX_CACHE_BYTES, semantic_threshold=None, embeddings_factory=None):
+        """
+        :param path: The SQLite file, defaults to responses.sqlite3 in the local cache.
+
+        :param ttl: Seconds a cached response stays valid.
+
+        :param max_bytes: Size limit for the stored responses; least recently used go first.
+
+        :param semantic_threshold: Cosine similarity needed for a semantic hit, None disables it.
+
+        :param embeddings_factory: Called with no arguments to get the Embeddings used for
+            semantic lookups.
+        """
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.semantic_threshold = semantic_threshold
+        self.embeddings_factory = embeddings_factory
+        self.lock = threading.Lock()
+        path = path or os.path.join(utils.get_cache_dir("responses"), DB_FILE)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(responses)")]
+        if columns and "namespace" not in columns:
+            # Written before responses were kept per API key; they can't be attributed
+            self.conn.execute("DROP TABLE responses")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, namespace TEXT, llm TEXT, response TEXT, embedding BLOB,"
+            " latency REAL, created REAL, last_hit REAL, hits INTEGER DEFAULT 0)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_llm ON responses (namespace, llm, created)")
+        self.conn.commit()
+        self.pending = {}  # key -> (start time, prompt embedding) of lookups that missed
+        self.updates = 0
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "seconds_saved": 0.0}
+
+    @staticmethod
+    def key(prompt, llm_string, namespace=""):
+        return hashlib.sha256(f"{namespace}\0{llm_string}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def _embed(self, prompt):
+        if self.semantic_threshold is None or self.embeddings_factory is None:
+            return None
+        try:
+            vector = np.asarray(self.embeddings_factory().embed_query(_prompt_text(prompt)), dtype=np.float32)
+        except Exception as e:
+            LOGGER.warning("Semantic cache lookup skipped: %s", e)
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _semantic_match(self, namespace, llm_string, vector, now):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT key, embedding FROM responses"
+                " WHERE namespace = ? AND llm = ? AND embedding IS NOT NULL AND created > ?"
+                " ORDER BY created DESC LIMIT ?",
+                (namespace, llm_string, now - self.ttl, SEMANTIC_CANDIDATES)
+            ).fetchall()
+        if not rows:
+            return None
+        matrix = np.frombuffer(b"".join(row[1] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+        if matrix.shape[1] != len(vector):
+            return None
+        scores = matrix @ vector
+        best = int(np.argmax(scores))
+        return rows[best][0] if scores[best] >= self.semantic_threshold else None
+
+    def _hit(self, key, kind, now):
+        with self.lock:
+            row = self.conn.execute("SELECT response, latency FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE responses SET last_hit = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.stats[kind] += 1
+            self.stats["seconds_saved"] += row[1] or 0.0
+        try:
+            return [loads(item) for item in json.loads(row[0])]
+        except Exception:
+            return [Generation(text=item) for item in json.loads(row[0])]
+
+    def lookup(self, prompt, llm_string, namespace=""):
+        """
+        :param namespace: Keeps the responses of different API keys apart, see for_key().
+        """
+        now = time.time()
+        key = self.key(prompt, llm_string, namespace)
+        with self.lock:
+            row = self.conn.execute("SELECT created FROM responses WHERE key = ?", (key,)).fetchone()
+        if row and now - row[0] <= self.ttl:
+            return self._hit(key, "exact_hits", now)
+
+        vector = self._embed(prompt)
+        if vector is not None:
+            match = self._semantic_match(namespace, llm_string, vector, now)
+            if match:
+                return self._hit(match, "semantic_hits", now)
+
+        with self.lock:
+            self.stats["misses"] += 1
+            if len(self.pending) >= MAX_PENDING:
+                # Calls that failed never update; don't let their start times pile up
+                self.pending.clear()
+            self.pending[key] = (time.perf_counter(), vector)
+        return None
+
+    def update(self, prompt, llm_string, return_val, namespace=""):
+        key = self.key(prompt, llm_string, namespace)
+        with self.lock:
+            start, vector = self.pending.pop(key, (None, None))
+            latency = time.perf_counter() - start if start is not None else None
+            now = time.time()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, namespace, llm, response, embedding, latency, created, last_hit)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    namespace,
+                    llm_string,
+                    json.dumps([dumps(generation) for generation in return_val]),
+                    vector.tobytes() if vector is not None else None,
+                    latency,
+                    now,
+                    now
+                )
+            )
+            self.conn.commit()
+            self.updates += 1
+            if self.updates % EVICT_EVERY == 0:
+                self._evict(now)
+
+    def _evict(self, now):
+        """Drop expired entries, then least recently used ones until under max_bytes. Holds the lock."""
+        self.conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        total = self.conn.execute("SELECT COALESCE(SUM(LENGTH(response) + COALESCE(LENGTH(embedding), 0)), 0) FROM responses").fetchone()[0]
+        if total > self.max_bytes:
+            rows = self.conn.execute(
+                "SELECT key, LENGTH(response) + COALESCE(LENGTH(embedding), 0) FROM responses ORDER BY last_hit"
+            ).fetchall()
+            doomed = []
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                doomed.append((key,))
+                total -= size
+            self.conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+        self.conn.commit()
+
+    def clear(self, **kwargs):
+        with self.lock:
+            self.conn.execute("DELETE FROM responses")
+            self.conn.commit()
+
+    def hit_rate(self):
+        lookups = self.stats["exact_hits"] + self.stats["semantic_hits"] + self.stats["misses"]
+        return (self.stats["exact_hits"] + self.stats["semantic_hits"]) / lookups if lookups else 0.0
+
+
+class KeyedCache(BaseCache):
+    """The view of a ResponseCache for one API key, given to that key's models as their cache."""
+
+    def __init__(self, cache, namespace):
+        self.cache = cache
+        self.namespace = namespace
+
+    def lookup(self, prompt, llm_string):
+        return self.cache.lookup(prompt, llm_string, self.namespace)
+
+    def update(self, prompt, llm_string, return_val):
+        self.cache.update(prompt, llm_string, return_val, self.namespace)
+
+    def clear(self, **kwargs):
+        self.cache.clear()
+
+    def __repr__(self):
+        # Part of the model's llm_string, which must not change between processes
+        return "KeyedCache()"
+
+
+_cache = None
+_cache_lock = threading.Lock()
+session_resources.register_shared(lambda: [_cache] if _cache is not None else [])
+
+
+def enable(semantic_threshold=SEMANTIC_THRESHOLD, embeddings_factory=None):
+    """
+    Open the process-wide response cache, once per process.
+
+    :return: The ResponseCache.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(
+                semantic_threshold=float(semantic_threshold) if semantic_threshold else None,
+                embeddings_factory=embeddings_factory
+            )
+        return _cache
+
+
+def for_key(api_key, **kwargs):
+    """
+    Return the cache for the models of one API key.
+
+    :param api_key: The OpenAI API key; only a hash of it is stored.
+
+    :param kwargs: Passed to enable() the first time.
+
+    :return: A KeyedCache, to pass as the model's cache.
+    """
+    return KeyedCache(enable(**kwargs), hashlib.sha256((api_key or "").encode("utf-8")).hexdigest())
+
+
+def show_stats():
+    """Show the cache hit rate and the LLM time it saved in the sidebar."""
+    cache = _cache
+    if cache is not None:
+        stats = cache.stats
+        st.sidebar.caption(
+            f"Response cache: {cache.hit_rate():.0%} hit rate "
+            f"({stats['exact_hits']} exact, {stats['semantic_hits']} similar, {stats['misses']} misses), "
+            f"{stats['seconds_saved']:.1f}s of LLM time saved"
+        )
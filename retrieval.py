@@ -0,0 +1,277 @@
+"""
+Hybrid retrieval for the Chat with Doc pages: BM25 over the chunks plus the FAISS vector
+search, fused with reciprocal rank fusion and re-ranked on the CPU.
+
+Vector search finds chunks that mean the same thing as the question; BM25 finds the
+chunk that contains the exact ticker, figure or period the analyst typed, which
+embeddings tend to blur. The tokenizer keeps numbers whole ("1,234.5" and "1234.5" are
+the same token, "$" and "%" are dropped) and keeps tickers such as "BRK.B" in one piece.
+The lexical index is positional: entry i is the chunk at position i of the FAISS index,
+so both searches share ids.
+"""
+
+import json
+import os
+import re
+from typing import Any
+
+import numpy as np
+from langchain_core.retrievers import BaseRetriever
+
+import vector_index
+
+LEXICAL_FILE = "bm25.npz"
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+# Weight of the exact-match features in the re-rank, relative to the fused rank score
+EXACT_WEIGHT = 0.02
+
+TOKEN_PATTERN = re.compile(r"\d[\d,]*(?:\.\d+)?|[A-Za-z][A-Za-z0-9]*(?:[.&-][A-Za-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by did do does for from had has have how in is it its of on or "
+    "s that the their this to was were what when which who why will with".split()
+)
+
+
+def _terms(text):
+    """Yield (token as written, BM25 term) pairs, skipping stopwords."""
+    for token in TOKEN_PATTERN.findall(text):
+        if token[0].isdigit():
+            term = token.replace(",", "").rstrip(".")
+        else:
+            term = token.lower()
+            if term in STOPWORDS:
+                continue
+        yield token, term
+
+
+def tokenize(text):
+    """
+    Split text into lowercase BM25 terms.
+
+    :param text: The text to tokenize.
+
+    :return: A list of terms. Numbers lose their thousands separators, so "$1,234.5"
+        becomes "1234.5"; tickers and dotted names such as "BRK.B" stay whole.
+    """
+    return [term for _, term in _terms(text)]
+
+
+def is_exact_term(token):
+    """
+    Numbers, short alphanumeric codes (Q3, FY23), dotted names and all-caps tickers (AAPL)
+    must match exactly to count.
+
+    :param token: The token as written, before lowercasing.
+    """
+    return any(c.isdigit() for c in token) or "." in token or (token.isupper() and 2 <= len(token) <= 5)
+
+
+def exact_terms(text):
+    """Return the BM25 terms of text whose tokens are exact terms (see is_exact_term)."""
+    return {term for token, term in _terms(text) if is_exact_term(token)}
+
+
+class LexicalIndex:
+    """
+    A BM25 inverted index stored as flat numpy arrays.
+
+    The postings of term t are doc_ids[offsets[t]:offsets[t + 1]] with the matching
+    term frequencies in tfs.
+    """
+
+    def __init__(self, vocabulary, offsets, doc_ids, tfs, doc_lengths):
+        self.vocabulary = vocabulary
+        self.term_ids = {term: i for i, term in enumerate(vocabulary)}
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.avg_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+        doc_freq = np.diff(offsets)
+        n = len(doc_lengths)
+        self.idf = np.log(1 + (n - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    @classmethod
+    def build(cls, texts):
+        """
+        :param texts: The chunk texts, in FAISS index order.
+
+        :return: A LexicalIndex.
+        """
+        postings = {}
+        lengths = []
+        for doc_id, text in enumerate(texts):
+            terms = tokenize(text)
+            lengths.append(len(terms))
+            counts = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, count in counts.items():
+                postings.setdefault(term, []).append((doc_id, count))
+
+        vocabulary = sorted(postings)
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        for i, term in enumerate(vocabulary):
+            offsets[i + 1] = offsets[i] + len(postings[term])
+        doc_ids = np.empty(offsets[-1], dtype=np.int32)
+        tfs = np.empty(offsets[-1], dtype=np.float32)
+        for i, term in enumerate(vocabulary):
+            entries = np.asarray(postings[term])
+            doc_ids[offsets[i]:offsets[i + 1]] = entries[:, 0]
+            tfs[offsets[i]:offsets[i + 1]] = entries[:, 1]
+        return cls(vocabulary, offsets, doc_ids, tfs, np.asarray(lengths, dtype=np.float32))
+
+    @classmethod
+    def from_faiss(cls, db):
+        """Build the index over the chunks of a FAISS vector store, in index order."""
+        return cls.build(chunk_texts(db))
+
+    def save(self, directory):
+        path = os.path.join(directory, LEXICAL_FILE)
+        scratch = path + ".tmp.npz"
+        np.savez(
+            scratch,
+            vocabulary=np.frombuffer(json.dumps(self.vocabulary).encode("utf-8"), dtype=np.uint8),
+            offsets=self.offsets,
+            doc_ids=self.doc_ids,
+            tfs=self.tfs,
+            doc_lengths=self.doc_lengths
+        )
+        os.replace(scratch, path)
+
+    @classmethod
+    def load(cls, directory):
+        """
+        :return: The LexicalIndex saved in directory, or None if there is none.
+        """
+        path = os.path.join(directory, LEXICAL_FILE)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            vocabulary = json.loads(data["vocabulary"].tobytes().decode("utf-8"))
+            return cls(vocabulary, data["offsets"], data["doc_ids"], data["tfs"], data["doc_lengths"])
+
+    def scores(self, terms):
+        """Return the BM25 score of every chunk for the query terms."""
+        scores = np.zeros(len(self), dtype=np.float32)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths / (self.avg_length or 1.0))
+        for term in set(terms):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            start, stop = self.offsets[term_id], self.offsets[term_id + 1]
+            docs, tf = self.doc_ids[start:stop], self.tfs[start:stop]
+            scores[docs] += self.idf[term_id] * tf * (BM25_K1 + 1) / (tf + norm[docs])
+        return scores
+
+    def search(self, query, k, allowed=None):
+        """
+        :param allowed: Optional sorted array of the positions that may be returned.
+
+        :return: Up to k (position, score) tuples, best first, for chunks matching any query term.
+        """
+        scores = self.scores(tokenize(query))
+        if allowed is not None:
+            mask = np.zeros(len(scores), dtype=bool)
+            mask[allowed] = True
+            scores[~mask] = 0
+        k = min(k, int(np.count_nonzero(scores)))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+
+def chunk_texts(db):
+    """Return the chunk texts of a FAISS vector store in index order."""
+    return [db.docstore.search(db.index_to_docstore_id[i]).page_content for i in range(db.index.ntotal)]
+
+
+def reciprocal_rank_fusion(rankings, rrf_k=RRF_K):
+    """
+    :param rankings: Lists of positions, best first.
+
+    :return: A dict mapping each position to its fused score.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, position in enumerate(ranking):
+            fused[position] = fused.get(position, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return fused
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever that fuses FAISS and BM25 rankings and re-ranks the candidates.
+
+    The re-rank adds to the fused score the share of query terms a chunk contains and,
+    with a higher weight, the share of exact terms (numbers, tickers, periods) it contains,
+    so the chunk holding the figure asked about wins over chunks that only talk about it.
+    When allowed is set (e.g. by a metadata filter), both searches only consider those
+    positions.
+    """
+
+    vectorstore: Any
+    lexical: Any
+    k: int = 2
+    fetch_k: int = 20
+    allowed: Any = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def vector_ranking(self, query):
+        """Embed the query and return the nearest positions, best first."""
+        vector = np.asarray([self.vectorstore.embeddings.embed_query(query)], dtype=np.float32)
+        index = self.vectorstore.index
+        if self.allowed is None:
+            _, positions = index.search(vector, min(self.fetch_k, index.ntotal))
+        elif not len(self.allowed):
+            return []
+        else:
+            params = vector_index.search_params(index, self.allowed)
+            _, positions = index.search(vector, min(self.fetch_k, len(self.allowed)), params=params)
+        return [int(i) for i in positions[0] if i != -1]
+
+    def lexical_ranking(self, query):
+        """Return the best BM25 positions, best first."""
+        return [position for position, _ in self.lexical.search(query, self.fetch_k, self.allowed)]
+
+    def document(self, position):
+        return self.vectorstore.docstore.search(self.vectorstore.index_to_docstore_id[position])
+
+    def fuse(self, query, vector_ranking, lexical_ranking):
+        """
+        Fuse the two rankings and re-rank the candidates.
+
+        :return: A list of (position, score) tuples for the best k chunks, best first.
+        """
+        fused = reciprocal_rank_fusion([vector_ranking, lexical_ranking])
+
+        terms = set(tokenize(query))
+        exact = exact_terms(query)
+        scored = []
+        for position, score in fused.items():
+            chunk_terms = set(tokenize(self.document(position).page_content))
+            if terms:
+                score += EXACT_WEIGHT * 0.5 * len(terms & chunk_terms) / len(terms)
+            if exact:
+                score += EXACT_WEIGHT * len(exact & chunk_terms) / len(exact)
+            scored.append((position, score))
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return scored[:self.k]
+
+    def rank(self, query):
+        """
+        :return: A list of (position, score) tuples for the best k chunks, best first.
+        """
+        return self.fuse(query, self.vector_ranking(query), self.lexical_ranking(query))
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return [self.document(position) for position, _ in self.rank(query)]
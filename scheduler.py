@@ -0,0 +1,431 @@
+"""
+Process-wide scheduler for OpenAI requests.
+
+Every session shares the org key, so requests are admitted against one
+requests-per-minute and one tokens-per-minute token bucket per model, shared by all
+sessions, instead of each script thread firing at OpenAI until it gets a 429. A
+request's tokens are estimated up front with tiktoken (the prompt plus max_tokens or
+a default completion) and corrected with the usage OpenAI reports once it is done.
+
+Requests waiting for a model are admitted by priority, then in arrival order.
+Interactive requests (chat turns, query embeddings) go ahead of bulk ones (document
+embeddings, summaries), and bulk requests leave RESERVE of each bucket for them. A
+request bigger than a bucket waits until the bucket is full and then is charged all but
+the reserve, so it can't put the model into a debt that interactive requests would wait
+out. Identical requests already in flight on the same API key are coalesced: the later
+caller waits for the first one's result, and its own callbacks see the request end,
+instead of paying for it again. Streamed requests are never coalesced, since only the
+first caller's callbacks would see the tokens.
+
+llm_pool hands out chat models and embeddings that go through SCHEDULER, so the pages
+don't call it themselves. Rate limits are off unless the deployment sets its org's
+limits (requests:tokens per minute), e.g.
+
+    FUNDBRIDGE_RATE_LIMITS="gpt-4=500:10000,gpt-3.5-turbo=3500:90000"
+
+or FUNDBRIDGE_RATE_LIMITS=tier for the MODEL_LIMITS below, which can be combined with
+overrides ("tier,gpt-4=500:40000"). Without limits requests are only coalesced.
+"""
+
+import asyncio
+import collections
+import functools
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import ClassVar
+
+import streamlit as st
+from langchain.embeddings.base import Embeddings
+from streamlit.logger import get_logger
+
+import token_counter
+import tracing
+
+LOGGER = get_logger(__name__)
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+# (requests per minute, tokens per minute) of a low usage tier, used with FUNDBRIDGE_RATE_LIMITS=tier
+MODEL_LIMITS = {
+    'gpt-4-turbo-preview': (500, 30000),
+    'gpt-4': (500, 10000),
+    'gpt-3.5-turbo-1106': (3500, 60000),
+    'gpt-3.5-turbo': (3500, 60000),
+    'gpt-3.5-turbo-16k': (3500, 60000),
+    'text-embedding-ada-002': (3000, 1000000),
+}
+RATE_LIMITS = os.environ.get("FUNDBRIDGE_RATE_LIMITS", "")
+# Share of each bucket that bulk requests leave for interactive ones
+RESERVE = 0.1
+# Completion tokens assumed for requests without max_tokens
+DEFAULT_COMPLETION_TOKENS = 256
+# Tokens OpenAI adds per chat message and per reply
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+RECENT_WAITS = 1000
+
+
+def parse_limits(spec):
+    """
+    :param spec: 'model=rpm:tpm,...', optionally with 'tier' for MODEL_LIMITS; '' or 'off'
+        for no limits.
+
+    :return: A dict of model -> (rpm, tpm), or None when limits are off. Models not listed
+        are not limited.
+    """
+    if spec.strip().lower() in ("", "off", "0", "false"):
+        return None
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        if item.lower() == "tier":
+            limits.update(MODEL_LIMITS)
+            continue
+        model, _, values = item.partition("=")
+        rpm, _, tpm = values.partition(":")
+        limits[model.strip()] = (int(rpm), int(tpm))
+    return limits
+
+
+class TokenBucket:
+    """Holds up to per_minute units and refills at per_minute / 60 units per second."""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount, reserve=0.0, now=None):
+        """Return the seconds until amount can be taken leaving reserve (a share of capacity) behind."""
+        self._refill(time.monotonic() if now is None else now)
+        # A request bigger than the bucket goes once the bucket is full
+        needed = min(amount + reserve * self.capacity, self.capacity)
+        return max(0.0, (needed - self.level) / self.rate)
+
+    def charge(self, amount):
+        """Return what taking amount costs: a request bigger than the bucket leaves the reserve."""
+        return amount if amount <= self.capacity else self.capacity * (1 - RESERVE)
+
+    def take(self, amount):
+        # Never more than one bucket in debt, whatever the estimates
+        self.level = max(-self.capacity, self.level - self.charge(amount))
+
+    def adjust(self, amount):
+        """Give back (or, if negative, charge) tokens once the real usage is known."""
+        self.level = max(-self.capacity, min(self.capacity, self.level + amount))
+
+
+class _Lane:
+    """The buckets and waiting requests of one model."""
+
+    def __init__(self, limits):
+        rpm, tpm = limits if limits else (None, None)
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.waiting = []
+
+    def delay(self, requests, tokens, priority):
+        reserve = RESERVE if priority > INTERACTIVE else 0.0
+        now = time.monotonic()
+        return max(
+            self.requests.delay(requests, reserve, now) if self.requests else 0.0,
+            self.tokens.delay(tokens, reserve, now) if self.tokens else 0.0
+        )
+
+    def take(self, requests, tokens):
+        if self.requests:
+            self.requests.take(requests)
+        if self.tokens:
+            self.tokens.take(tokens)
+
+
+class Scheduler:
+
+    def __init__(self, limits=None):
+        """
+        :param limits: A dict of model -> (rpm, tpm), or None to admit everything at once.
+        """
+        self.limits = limits
+        self._cond = threading.Condition()
+        self._lanes = {}
+        self._sequence = itertools.count()
+        self._inflight = {}
+        self._waits = {priority: collections.deque(maxlen=RECENT_WAITS) for priority in PRIORITY_NAMES}
+        self._admitted = collections.Counter()
+        self._coalesced = 0
+
+    def _lane(self, model):
+        lane = self._lanes.get(model)
+        if lane is None:
+            lane = self._lanes[model] = _Lane((self.limits or {}).get(model))
+        return lane
+
+    def acquire(self, model, tokens, priority=INTERACTIVE, requests=1):
+        """
+        Block until the model's budgets admit a request.
+
+        :param model: The OpenAI model name.
+
+        :param tokens: The estimated tokens of the request, prompt and completion.
+
+        :param priority: INTERACTIVE or BULK.
+
+        :param requests: How many API requests the call makes, e.g. for batched embeddings.
+
+        :return: The seconds spent waiting.
+        """
+        start = time.monotonic()
+        with self._cond:
+            lane = self._lane(model)
+            entry = (priority, next(self._sequence))
+            heapq.heappush(lane.waiting, entry)
+            try:
+                while True:
+                    if lane.waiting[0] != entry:
+                        self._cond.wait()
+                        continue
+                    delay = lane.delay(requests, tokens, priority)
+                    if delay <= 0:
+                        lane.take(requests, tokens)
+                        break
+                    self._cond.wait(delay)
+            finally:
+                lane.waiting.remove(entry)
+                heapq.heapify(lane.waiting)
+                self._cond.notify_all()
+            waited = time.monotonic() - start
+            self._waits[priority].append(waited)
+            self._admitted[priority] += 1
+        if waited > 1:
+            LOGGER.info("%s request for %s waited %.1fs for its rate limit", PRIORITY_NAMES[priority], model, waited)
+        return waited
+
+    async def acquire_async(self, model, tokens, priority=INTERACTIVE, requests=1):
+        """acquire() for the event loop: waits on a thread so other tasks keep running."""
+        return await asyncio.to_thread(self.acquire, model, tokens, priority, requests)
+
+    def settle(self, model, estimated, actual):
+        """Correct a model's token bucket once a request's real usage is known."""
+        with self._cond:
+            lane = self._lanes.get(model)
+            if lane is not None and lane.tokens is not None and actual is not None:
+                lane.tokens.adjust(lane.tokens.charge(estimated) - actual)
+                self._cond.notify_all()
+
+    def _join(self, key):
+        """Return (future, leader): the future of the in-flight request with this key."""
+        with self._cond:
+            future = self._inflight.get(key)
+            if future is not None:
+                self._coalesced += 1
+                return future, False
+            future = self._inflight[key] = Future()
+            return future, True
+
+    def _finish(self, key, future, result=None, error=None):
+        with self._cond:
+            self._inflight.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def run(self, key, model, tokens, priority, call, requests=1, usage=None):
+        """
+        Make a call through the scheduler, or wait for the identical call in flight.
+
+        :param key: Identifies identical requests, or None to never coalesce.
+
+        :param model: The model whose budgets the call uses.
+
+        :param tokens: The estimated tokens of the call.
+
+        :param priority: INTERACTIVE or BULK.
+
+        :param call: Makes the request when called with no arguments.
+
+        :param requests: The API requests the call makes.
+
+        :param usage: Optional function returning the tokens the result actually used.
+
+        :return: The call's result.
+        """
+        future, leader = self._join(key) if key is not None else (None, True)
+        if not leader:
+            return future.result()
+        try:
+            waited = self.acquire(model, tokens, priority, requests)
+            tracing.record("queue_wait", time.perf_counter() - waited, priority=PRIORITY_NAMES[priority])
+            result = call()
+        except BaseException as e:
+            if future is not None:
+                self._finish(key, future, error=e)
+            raise
+        self.settle(model, tokens, usage(result) if usage else None)
+        if future is not None:
+            self._finish(key, future, result)
+        return result
+
+    async def arun(self, key, model, tokens, priority, call, requests=1, usage=None):
+        """run() for coroutines: call returns an awaitable."""
+        future, leader = self._join(key) if key is not None else (None, True)
+        if not leader:
+            return await asyncio.wrap_future(future)
+        try:
+            waited = await self.acquire_async(model, tokens, priority, requests)
+            tracing.record("queue_wait", time.perf_counter() - waited, priority=PRIORITY_NAMES[priority])
+            result = await call()
+        except BaseException as e:
+            if future is not None:
+                self._finish(key, future, error=e)
+            raise
+        self.settle(model, tokens, usage(result) if usage else None)
+        if future is not None:
+            self._finish(key, future, result)
+        return result
+
+    def stats(self):
+        """
+        :return: A dict with the requests queued per model and, per priority, the requests
+            queued, admitted, and their median, p95 and max wait over the recent requests.
+        """
+        with self._cond:
+            queued = {model: len(lane.waiting) for model, lane in self._lanes.items() if lane.waiting}
+            by_priority = {}
+            for priority, name in PRIORITY_NAMES.items():
+                waits = sorted(self._waits[priority])
+                by_priority[name] = {
+                    "queued": sum(1 for lane in self._lanes.values() for entry in lane.waiting if entry[0] == priority),
+                    "admitted": self._admitted[priority],
+                    "median_wait": waits[len(waits) // 2] if waits else 0.0,
+                    "p95_wait": waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+                    "max_wait": waits[-1] if waits else 0.0,
+                }
+            return {"queued": queued, "priorities": by_priority, "coalesced": self._coalesced}
+
+
+SCHEDULER = Scheduler(parse_limits(RATE_LIMITS))
+
+
+def show_stats():
+    """Show the queue depth and rate-limit waits in the sidebar."""
+    stats = SCHEDULER.stats()
+    parts = [
+        f"{name} {entry['queued']} queued, p95 wait {entry['p95_wait']:.1f}s"
+        for name, entry in stats["priorities"].items() if entry["admitted"] or entry["queued"]
+    ]
+    if parts:
+        st.sidebar.caption(f"OpenAI queue: {'; '.join(parts)}; {stats['coalesced']} coalesced")
+
+
+def _request_key(api_key, *parts):
+    """Identify a request by its API key (so keys never share results) and its contents."""
+    if hasattr(api_key, "get_secret_value"):
+        api_key = api_key.get_secret_value()
+    key_hash = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+    return hashlib.sha256(json.dumps([key_hash, parts], sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _count(model, text):
+    return len(token_counter.encoding_for_model(model).encode_ordinary(text))
+
+
+class _ScheduledChat:
+    """Sends a chat model's requests through SCHEDULER; mixed in by scheduled_chat_class()."""
+
+    def _schedule(self, messages, stop, run_manager, kwargs):
+        model = self.model_name
+        prompt_tokens = sum(_count(model, str(message.content)) + TOKENS_PER_MESSAGE for message in messages) + TOKENS_PER_REPLY
+        tokens = prompt_tokens + (kwargs.get("max_tokens") or getattr(self, "max_tokens", None) or DEFAULT_COMPLETION_TOKENS)
+        if self.streaming:
+            # A follower's callbacks would never see the tokens. Without streaming the
+            # callbacks only hear the start and end, which every caller's generate() sends.
+            key = None
+        else:
+            key = _request_key(
+                getattr(self, "openai_api_key", None),
+                self._identifying_params, [(message.type, message.content) for message in messages], stop, kwargs
+            )
+
+        def usage(result):
+            # Streamed responses come without usage; count the reply instead
+            reported = (result.llm_output or {}).get("token_usage") or {}
+            if reported.get("prompt_tokens") is not None and reported.get("completion_tokens") is not None:
+                return reported["prompt_tokens"] + reported["completion_tokens"]
+            return prompt_tokens + sum(_count(model, generation.text) for generation in result.generations)
+
+        return model, tokens, key, usage
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        model, tokens, key, usage = self._schedule(messages, stop, run_manager, kwargs)
+        return SCHEDULER.run(
+            key, model, tokens, self.priority,
+            lambda: super(_ScheduledChat, self)._generate(messages, stop=stop, run_manager=run_manager, **kwargs),
+            usage=usage
+        )
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        model, tokens, key, usage = self._schedule(messages, stop, run_manager, kwargs)
+        return await SCHEDULER.arun(
+            key, model, tokens, self.priority,
+            lambda: super(_ScheduledChat, self)._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs),
+            usage=usage
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def scheduled_chat_class(base, priority=INTERACTIVE):
+    """
+    Return a subclass of a chat model class (e.g. ChatOpenAI) whose requests go through
+    SCHEDULER with the given priority.
+
+    It keeps base's name, so it serializes like base and the response cache keys its
+    answers as before, shared between priorities.
+    """
+    return type(base.__name__, (_ScheduledChat, base), {
+        "__module__": __name__,
+        "__qualname__": f"scheduled_chat_class.<{base.__name__}, {PRIORITY_NAMES[priority]}>",
+        "__annotations__": {"priority": ClassVar[int]},
+        "priority": priority,
+        "lc_id": classmethod(lambda cls: base.lc_id()),
+    })
+
+
+class ScheduledEmbeddings(Embeddings):
+    """
+    Sends an Embeddings object's requests through SCHEDULER: embed_documents as BULK,
+    embed_query as INTERACTIVE, since queries are embedded while a user waits.
+    """
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.model = getattr(embeddings, "model", type(embeddings).__name__)
+        self.api_key = getattr(embeddings, "openai_api_key", None)
+        self.chunk_size = getattr(embeddings, "chunk_size", 1000) or 1000
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        return SCHEDULER.run(
+            _request_key(self.api_key, self.model, texts), self.model, sum(token_counter.count_batch(texts)), BULK,
+            lambda: self.embeddings.embed_documents(texts),
+            requests=max(1, math.ceil(len(texts) / self.chunk_size))
+        )
+
+    def embed_query(self, text):
+        return SCHEDULER.run(
+            _request_key(self.api_key, self.model, "query", text), self.model, token_counter.count_tokens(text), INTERACTIVE,
+            lambda: self.embeddings.embed_query(text)
+        )
@@ -0,0 +1,421 @@
+"""
+Per-session memory accounting and idle-session eviction.
+
+Sessions keep their heavy objects (chains with their conversation memory, the index
+handle of the Chat with Doc pages, the chat transcript) here instead of in
+st.session_state, so that one place knows what every session holds:
+
+    chains = session_resources.get("chains")
+    if chains is None:
+        chains = build()
+        session_resources.put("chains", chains, spill=save_state)
+
+Each object's footprint is estimated by walking it, leaving out what sessions share
+(registered with register_shared(), e.g. the pooled LLM clients, the embedding stores,
+the response cache and the memory-mapped indexes). The walk runs when an object is put
+and then at most every ESTIMATE_SECONDS, not on every rerun. Once the sessions together hold more than MEMORY_CAP, the least recently seen
+sessions are evicted until they fit; sessions idle for IDLE_SECONDS are evicted anyway.
+Eviction drops a session's objects after writing what can't be rebuilt (spill(), e.g.
+the conversation so far) to SPILL_DIR. The next request finds the object missing,
+rebuilds it, and gets the spilled state back from restore(), so the user only notices
+a slower turn. Sessions idle for EXPIRE_SECONDS are forgotten along with their files.
+"""
+
+import os
+import pickle
+import shutil
+import sys
+import threading
+import time
+import types
+import uuid
+import weakref
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import streamlit as st
+from streamlit.logger import get_logger
+
+import utils
+
+LOGGER = get_logger(__name__)
+
+MEMORY_CAP = int(os.environ.get("FUNDBRIDGE_SESSION_MEMORY_MB", "1024")) * 2 ** 20
+IDLE_SECONDS = int(os.environ.get("FUNDBRIDGE_SESSION_IDLE_SECONDS", "900"))
+EXPIRE_SECONDS = int(os.environ.get("FUNDBRIDGE_SESSION_EXPIRE_SECONDS", str(24 * 3600)))
+SPILL_DIR = utils.get_cache_dir("sessions")
+SESSION_ID_KEY = "_session_id"
+# How long checkpoint() trusts a size estimate before walking the object again
+ESTIMATE_SECONDS = int(os.environ.get("FUNDBRIDGE_SESSION_ESTIMATE_SECONDS", "60"))
+# Objects visited per size estimate, so a huge object graph can't stall a rerun
+MAX_OBJECTS = 200000
+SKIP_TYPES = (
+    type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+    types.CodeType, threading.Thread, type(threading.Lock()), type(threading.RLock()),
+)
+
+_sessions = {}
+_lock = threading.RLock()
+_shared_providers = []
+_over_cap = False
+
+
+class _Slot:
+
+    def __init__(self, value, spill):
+        self.value = value
+        self.spill = spill
+        self.size = 0
+        self.estimated = time.monotonic()
+        self.evicted = False
+
+
+class _Session:
+
+    def __init__(self, session_id):
+        self.id = session_id
+        self.last_seen = time.monotonic()
+        self.running = 0
+        self.evictions = 0
+        self.slots = OrderedDict()
+
+    @property
+    def size(self):
+        return sum(slot.size for slot in self.slots.values())
+
+    @property
+    def idle(self):
+        return time.monotonic() - self.last_seen
+
+
+def session_id():
+    """
+    Return an id for this browser session, stable across reruns.
+
+    It is kept in the session state rather than taken from the script run context,
+    whose id every streamlit.testing AppTest shares.
+    """
+    if SESSION_ID_KEY not in st.session_state:
+        st.session_state[SESSION_ID_KEY] = uuid.uuid4().hex
+    return st.session_state[SESSION_ID_KEY]
+
+
+def _current_id():
+    """Return this session's id, or None outside a script run (e.g. from a test)."""
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    if get_script_run_ctx() is None:
+        return None
+    return st.session_state.get(SESSION_ID_KEY)
+
+
+def _forget(sid):
+    with _lock:
+        _sessions.pop(sid, None)
+    shutil.rmtree(os.path.join(SPILL_DIR, sid), ignore_errors=True)
+
+
+def _current():
+    """Return this session's record, creating it on first use, and mark it as seen."""
+    sid = session_id()
+    with _lock:
+        session = _sessions.get(sid)
+        if session is None:
+            session = _sessions[sid] = _Session(sid)
+            # Forget the session as soon as Streamlit drops its state
+            from streamlit.runtime.scriptrunner import get_script_run_ctx
+            ctx = get_script_run_ctx()
+            state = getattr(getattr(ctx, "session_state", None), "_state", None)
+            if state is not None:
+                try:
+                    weakref.finalize(state, _forget, sid)
+                except TypeError:
+                    pass
+        session.last_seen = time.monotonic()
+        return session
+
+
+def register_shared(provider):
+    """
+    :param provider: A function returning objects shared between sessions, which size
+        estimates leave out, e.g. lambda: list(_clients.values()).
+    """
+    _shared_providers.append(provider)
+
+
+def _shared_ids():
+    ids = set()
+    for provider in _shared_providers:
+        try:
+            ids.update(id(obj) for obj in provider())
+        except Exception as e:
+            LOGGER.warning("Could not list shared objects: %s", e)
+    return ids
+
+
+def estimate_size(obj, exclude=(), max_objects=MAX_OBJECTS):
+    """
+    Estimate the bytes an object holds, following containers and attributes.
+
+    Numpy arrays count their buffer unless it is memory-mapped; FAISS indexes count
+    their codes (ntotal * code_size). Classes, modules, functions, threads and locks
+    are not followed.
+
+    :param obj: The object.
+
+    :param exclude: Ids of objects not to count or follow, e.g. shared ones.
+
+    :param max_objects: Stop after visiting this many objects.
+
+    :return: The estimated size in bytes.
+    """
+    numpy = sys.modules.get("numpy")
+    seen = set(exclude)
+    stack = [obj]
+    total = 0
+    while stack and len(seen) < max_objects:
+        item = stack.pop()
+        if id(item) in seen or item is None or isinstance(item, SKIP_TYPES):
+            continue
+        seen.add(id(item))
+        if numpy is not None and isinstance(item, numpy.ndarray):
+            mapped = isinstance(item, numpy.memmap) or isinstance(getattr(item, "base", None), numpy.memmap)
+            total += 0 if mapped else item.nbytes
+            continue
+        if type(item).__module__.startswith("faiss") and hasattr(item, "ntotal"):
+            total += item.ntotal * getattr(item, "code_size", getattr(item, "d", 0) * 4)
+            continue
+        total += sys.getsizeof(item, 0)
+        if isinstance(item, (str, bytes, int, float, bool)):
+            continue
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset, deque)):
+            stack.extend(item)
+        attributes = getattr(item, "__dict__", None)
+        if attributes is not None:
+            stack.append(attributes)
+        for name in getattr(type(item), "__slots__", ()):
+            stack.append(getattr(item, name, None))
+    return total
+
+
+def get(name):
+    """
+    :param name: The object's name, e.g. 'chains'.
+
+    :return: This session's object, or None if it was never put or has been evicted.
+    """
+    session = _current()
+    with _lock:
+        slot = session.slots.get(name)
+        if slot is None or slot.value is None:
+            return None
+        session.slots.move_to_end(name)
+        return slot.value
+
+
+def put(name, value, spill=None):
+    """
+    Keep an object for this session.
+
+    :param name: The object's name.
+
+    :param value: The object.
+
+    :param spill: Optional function called with the object when it is evicted, returning
+        picklable state to hand back through restore() after the object is rebuilt.
+
+    :return: value.
+    """
+    session = _current()
+    size = estimate_size(value, _shared_ids())
+    with _lock:
+        slot = session.slots[name] = _Slot(value, spill)
+        slot.size = size
+    enforce()
+    return value
+
+
+def _spill_path(sid, name):
+    return os.path.join(SPILL_DIR, sid, f"{name}.pkl")
+
+
+def restore(name):
+    """
+    Return the state spilled when this session's object was evicted, or None; the
+    state is only returned once.
+    """
+    path = _spill_path(session_id(), name)
+    try:
+        # Written by _evict in this app, not by a third party
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    os.remove(path)
+    return state
+
+
+def pop(name):
+    """Drop this session's object and any state spilled for it."""
+    session = _current()
+    with _lock:
+        session.slots.pop(name, None)
+    try:
+        os.remove(_spill_path(session.id, name))
+    except OSError:
+        pass
+
+
+@contextmanager
+def active():
+    """Mark this session as running a script, so it is not evicted meanwhile."""
+    session = _current()
+    with _lock:
+        session.running += 1
+    try:
+        yield session
+    finally:
+        with _lock:
+            session.running -= 1
+
+
+def checkpoint():
+    """
+    Re-estimate this session's objects, which grow as it chats, then enforce the cap.
+    Objects estimated less than ESTIMATE_SECONDS ago keep their size.
+    """
+    session = _current()
+    now = time.monotonic()
+    with _lock:
+        stale = [slot for slot in session.slots.values() if slot.value is not None and now - slot.estimated >= ESTIMATE_SECONDS]
+    if stale:
+        shared = _shared_ids()
+        for slot in stale:
+            slot.size = estimate_size(slot.value, shared)
+            slot.estimated = now
+    enforce()
+
+
+def _evict(session):
+    """Spill and drop a session's objects. Call with _lock held."""
+    for name, slot in session.slots.items():
+        if slot.value is None:
+            continue
+        if slot.spill is not None:
+            try:
+                state = slot.spill(slot.value)
+                if state is not None:
+                    os.makedirs(os.path.join(SPILL_DIR, session.id), exist_ok=True)
+                    with open(_spill_path(session.id, name), "wb") as f:
+                        pickle.dump(state, f)
+            except Exception as e:
+                LOGGER.warning("Could not spill %s of session %s, it will start over: %s", name, session.id[:8], e)
+        slot.value = None
+        slot.size = 0
+        slot.evicted = True
+    session.evictions += 1
+
+
+def enforce(cap=None):
+    """
+    Forget expired sessions, evict idle ones, then evict the least recently seen
+    sessions until all of them hold at most cap bytes. Sessions running a script and the
+    calling session are never evicted.
+
+    :param cap: The limit, defaults to MEMORY_CAP.
+    """
+    global _over_cap
+    cap = MEMORY_CAP if cap is None else cap
+    current = _current_id()
+    expired = []
+    with _lock:
+        for session in list(_sessions.values()):
+            if session.idle > EXPIRE_SECONDS and not session.running:
+                del _sessions[session.id]
+                expired.append(session.id)
+        candidates = sorted(
+            (session for session in _sessions.values() if session.id != current and not session.running and session.size),
+            key=lambda session: session.last_seen
+        )
+        total = sum(session.size for session in _sessions.values())
+        for session in candidates:
+            if total <= cap and session.idle <= IDLE_SECONDS:
+                continue
+            total -= session.size
+            LOGGER.info("Evicting session %s (%.1f MB, idle %.0fs)", session.id[:8], session.size / 2 ** 20, session.idle)
+            _evict(session)
+        if total > cap and not _over_cap:
+            LOGGER.warning("Sessions hold %.0f MB, over the %.0f MB cap, but none can be evicted", total / 2 ** 20, cap / 2 ** 20)
+        _over_cap = total > cap
+    for sid in expired:
+        shutil.rmtree(os.path.join(SPILL_DIR, sid), ignore_errors=True)
+
+
+def process_rss():
+    """Return the resident memory of this process in bytes, or None if unknown."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def usage():
+    """
+    :return: A list of {'session', 'current', 'idle_seconds', 'bytes', 'objects',
+        'evicted', 'evictions'} dicts, one per session, the largest first.
+    """
+    current = _current_id()
+    with _lock:
+        rows = [{
+            "session": session.id,
+            "current": session.id == current,
+            "idle_seconds": session.idle,
+            "bytes": session.size,
+            "objects": {name: slot.size for name, slot in session.slots.items() if slot.value is not None},
+            "evicted": [name for name, slot in session.slots.items() if slot.value is None and slot.evicted],
+            "evictions": session.evictions,
+        } for session in _sessions.values()]
+    return sorted(rows, key=lambda row: -row["bytes"])
+
+
+def show_usage():
+    """
+    Show this session's memory as a collapsed sidebar expander.
+
+    Set FUNDBRIDGE_MEMORY_PANEL=0 to hide it, or =all on an admin deployment to list
+    every session and the server's total.
+    """
+    panel = os.environ.get("FUNDBRIDGE_MEMORY_PANEL", "1")
+    if panel == "0":
+        return
+    rows = usage()
+    mine = next((row for row in rows if row["current"]), None)
+    lines = []
+    if panel == "all":
+        total = sum(row["bytes"] for row in rows)
+        rss = process_rss()
+        lines += [
+            f"All sessions: {total / 2 ** 20:.1f} MB of {MEMORY_CAP / 2 ** 20:.0f} MB"
+            + (f", server RSS {rss / 2 ** 20:.0f} MB" if rss else ""),
+            "",
+        ]
+    else:
+        # Other sessions' ids and sizes are not this user's business
+        rows = [mine] if mine else []
+    lines += [
+        "| Session | Idle | MB | Objects | Evictions |",
+        "|---|---:|---:|---|---:|",
+    ]
+    for row in rows:
+        objects = ", ".join(f"{name} {size / 2 ** 20:.1f}" for name, size in row["objects"].items())
+        if row["evicted"]:
+            objects += (", " if objects else "") + "spilled: " + ", ".join(row["evicted"])
+        lines.append(
+            f"| {row['session'][:8]}{' (you)' if row['current'] else ''} | {row['idle_seconds']:.0f}s "
+            f"| {row['bytes'] / 2 ** 20:.1f} | {objects} | {row['evictions']} |"
+        )
+    with st.sidebar.expander(f"Session memory: {(mine['bytes'] if mine else 0) / 2 ** 20:.1f} MB"):
+        st.markdown("\n".join(lines))
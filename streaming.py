@@ -1,11 +1,115 @@
+import re
+import time
+
 from langchain.callbacks.base import BaseCallbackHandler
 
+import token_counter
+
 class StreamHandler(BaseCallbackHandler):
-    
-    def __init__(self, container, initial_text=""):
+    """
+    Streams LLM tokens into a Streamlit placeholder.
+
+    Tokens are buffered and flushed every flush_interval seconds or flush_tokens tokens.
+    Finished paragraphs are rendered once into their own element; only the unfinished
+    tail of the message is re-rendered on each flush. Responses served from the response
+    cache arrive without tokens and are replayed through the same path.
+    """
+
+    # Called on the event loop's thread by async chains, which is the script thread
+    run_inline = True
+
+    def __init__(self, container, initial_text="", flush_interval=0.1, flush_tokens=20):
         self.container = container
-        self.text = initial_text
+        self.flush_interval = flush_interval
+        self.flush_tokens = flush_tokens
+        self._buffer = []
+        self._text = initial_text
+        self._committed = 0  # length of the prefix already rendered as finished paragraphs
+        self._blocks = None
+        self._tail = None
+        self._last_flush = time.perf_counter()
+
+        # Metrics
+        self.created = time.perf_counter()
+        self.first_token_at = None
+        self.last_token_at = None
+        self.token_count = 0
+        self.prompt_tokens = 0  # summed over every LLM call made for this request
+        self._run_tokens = 0
+        self.cache_hits = 0
+
+    @property
+    def text(self):
+        if self._buffer:
+            self._text += "".join(self._buffer)
+            self._buffer = []
+        return self._text
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self._run_tokens = 0
+        self.prompt_tokens += sum(token_counter.count_tokens(prompt) for prompt in prompts)
 
     def on_llm_new_token(self, token: str, **kwargs):
-        self.text += token
-        self.container.markdown(self.text)
\ No newline at end of file
+        self._run_tokens += 1
+        now = time.perf_counter()
+        if self.first_token_at is None:
+            self.first_token_at = now
+        self.last_token_at = now
+        self.token_count += 1
+
+        self._buffer.append(token)
+        if len(self._buffer) >= self.flush_tokens or now - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def on_llm_end(self, response, **kwargs):
+        if not self._run_tokens and response is not None and response.generations and response.generations[0]:
+            # A cache hit never streams; replay the cached text word by word
+            self.cache_hits += 1
+            for word in re.findall(r"\S+\s*|\s+", response.generations[0][0].text):
+                self.on_llm_new_token(word)
+        self.flush()
+
+    def on_llm_error(self, error, **kwargs):
+        self.flush()
+
+    def flush(self):
+        """Render whatever has been buffered since the last flush."""
+        text = self.text
+        self._last_flush = time.perf_counter()
+        if self._tail is None:
+            self._blocks = self.container.container()
+            self._tail = self._blocks.empty()
+
+        split = self._paragraph_boundary(text)
+        if split > self._committed:
+            # Freeze the finished paragraphs and start a new tail below them
+            self._tail.markdown(text[self._committed:split])
+            self._committed = split
+            self._tail = self._blocks.empty()
+        self._tail.markdown(text[self._committed:])
+
+    def _paragraph_boundary(self, text):
+        """Return the end of the last finished paragraph that is not inside a code block."""
+        split = text.rfind("\n\n", self._committed)
+        while split != -1 and text.count("```", 0, split) % 2:
+            split = text.rfind("\n\n", self._committed, split)
+        return split + 2 if split != -1 else self._committed
+
+    @property
+    def time_to_first_token(self):
+        """Seconds from creating the handler (i.e. the user's request) to the first token."""
+        return None if self.first_token_at is None else self.first_token_at - self.created
+
+    @property
+    def tokens_per_second(self):
+        if self.token_count < 2 or self.last_token_at == self.first_token_at:
+            return None
+        return (self.token_count - 1) / (self.last_token_at - self.first_token_at)
+
+    def metrics(self):
+        return {
+            "time_to_first_token": self.time_to_first_token,
+            "tokens_per_second": self.tokens_per_second,
+            "tokens": self.token_count,
+            "prompt_tokens": self.prompt_tokens,
+        }
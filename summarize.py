@@ -0,0 +1,184 @@
+"""
+Map-reduce summarization for documents that don't fit in the selected model's context.
+
+The document is split by token budget, every part is summarized concurrently with the
+selected prompt, and the partial summaries are reduced in a tree, again with the same
+prompt, until they fit in one final call. If they stop shrinking first, summarize()
+raises SummaryTooLongError rather than drop part of the document.
+"""
+
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import openai
+from langchain.chains import LLMChain
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+import token_counter
+
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.APIConnectionError,
+    openai.error.Timeout,
+    openai.error.TryAgain,
+)
+
+
+class SummaryTooLongError(RuntimeError):
+    """The partial summaries stopped shrinking before they fit in one final call."""
+
+
+class MapReduceSummarizer:
+    """
+    Summarizes arbitrarily long documents with any single-input ({text}) prompt,
+    e.g. PROMPT_earnings, PROMPT_short or PROMPT_investment.
+    """
+
+    def __init__(self, llm, prompt, max_tokens, max_workers=8, max_retries=6, max_depth=5, limiter=None, encoding_name='cl100k_base', callbacks=None):
+        """
+        :param llm: The chat model. Create it with max_retries=0, retries are handled here.
+
+        :param prompt: The summary PromptTemplate, with a single {text} input variable.
+
+        :param max_tokens: The most prompt tokens a single call may use.
+
+        :param max_workers: The most calls in flight at once.
+
+        :param max_retries: How often a call is retried on rate limits and outages.
+
+        :param max_depth: The most reduce rounds before the final call; summarize() raises
+            SummaryTooLongError if the partial summaries still don't fit.
+
+        :param limiter: Optional semaphore shared between summarizers to cap the calls
+            in flight across all of them.
+
+        :param callbacks: Optional callbacks for every LLM call, e.g. a tracing.TraceCallback.
+            They are called from the worker threads.
+        """
+        self.chain = LLMChain(llm=llm, prompt=prompt)
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.max_depth = max_depth
+        self.limiter = limiter
+        self.encoding_name = encoding_name
+        self.callbacks = callbacks
+        self.budget = max_tokens - self.count_tokens(prompt.format(text=""))
+        if self.budget <= 0:
+            raise ValueError("The prompt alone does not fit in max_tokens.")
+        self.splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+            encoding_name=encoding_name,
+            chunk_size=self.budget,
+            chunk_overlap=min(200, self.budget // 10)
+        )
+        self.calls_done = 0
+        self.calls_total = 0
+
+    def count_tokens(self, text):
+        return token_counter.count_tokens(text, self.encoding_name)
+
+    def summarize(self, documents, on_progress=None):
+        """
+        Summarize a list of Documents.
+
+        :param documents: The pages of the document, e.g. from PyPDFLoader. Token counts
+            are stored in their metadata.
+
+        :param on_progress: Optional callback(done, total) called from the calling thread
+            after every finished LLM call.
+
+        :return: The summary text.
+
+        :raises SummaryTooLongError: If the partial summaries stop shrinking, or are still
+            too long after max_depth reduce rounds.
+        """
+        self.calls_done = 0
+        self.calls_total = 0
+        text = "\n\n".join(doc.page_content for doc in documents)
+        # Page counts from token_counter.count_documents are reused; the separators add
+        # at most a token or two per page.
+        known_tokens = token_counter.count_documents(documents, self.encoding_name) + 2 * len(documents)
+        parts = [text] if known_tokens <= self.budget else self.splitter.split_text(text)
+        if len(parts) == 1:
+            # Fits in one call, which is the plain 'stuff' summary.
+            self.calls_total = 1
+            summary = self._call(parts[0])
+            self._progress(on_progress)
+            return summary
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            summaries = self._map(executor, parts, on_progress)
+            tokens = self.count_tokens("\n\n".join(summaries))
+            for _ in range(self.max_depth):
+                if tokens <= self.budget:
+                    break
+                summaries = self._map(executor, self._pack(summaries), on_progress)
+                previous, tokens = tokens, self.count_tokens("\n\n".join(summaries))
+                if tokens >= previous:
+                    break
+
+        if tokens > self.budget:
+            # Cutting the combined summaries to fit would silently drop part of the document
+            raise SummaryTooLongError(
+                f"The partial summaries stopped shrinking at {tokens:,} tokens, over the "
+                f"{self.budget:,} tokens of one call; try a model with a larger context or a shorter prompt."
+            )
+        combined = "\n\n".join(summaries)
+        self.calls_total += 1
+        summary = self._call(combined)
+        self._progress(on_progress)
+        return summary
+
+    def _map(self, executor, texts, on_progress):
+        """Summarize each text concurrently, keeping the input order."""
+        self.calls_total += len(texts)
+        futures = {executor.submit(self._call, text): i for i, text in enumerate(texts)}
+        results = [None] * len(texts)
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            self._progress(on_progress)
+        return results
+
+    def _pack(self, summaries):
+        """Greedily group consecutive summaries into texts that fit the token budget."""
+        groups, current, current_tokens = [], [], 0
+        for summary in summaries:
+            for piece in self.splitter.split_text(summary) if self.count_tokens(summary) > self.budget else [summary]:
+                tokens = self.count_tokens(piece)
+                if current and current_tokens + tokens > self.budget:
+                    groups.append("\n\n".join(current))
+                    current, current_tokens = [], 0
+                current.append(piece)
+                current_tokens += tokens
+        if current:
+            groups.append("\n\n".join(current))
+        return groups
+
+    def _call(self, text):
+        """Run the prompt on one text, backing off on rate limits and transient outages."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                if self.limiter is None:
+                    return self.chain.run(text=text, callbacks=self.callbacks)
+                with self.limiter:
+                    return self.chain.run(text=text, callbacks=self.callbacks)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self._retry_delay(e, attempt))
+
+    @staticmethod
+    def _retry_delay(error, attempt):
+        """Honour the server's Retry-After header if it sent one, else back off exponentially with jitter."""
+        headers = getattr(error, 'headers', None) or {}
+        retry_after = headers.get('retry-after') if hasattr(headers, 'get') else None
+        try:
+            return float(retry_after)
+        except (TypeError, ValueError):
+            return min(60, 2 ** attempt) * (0.5 + random.random())
+
+    def _progress(self, on_progress):
+        self.calls_done += 1
+        if on_progress:
+            on_progress(self.calls_done, self.calls_total)
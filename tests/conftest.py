@@ -0,0 +1,30 @@
+"""
+pytest setup for the unit tests, run from the repository root:
+
+    python -m pytest tests
+
+Everything runs offline on the fake backend (fake_llm.py) with a fresh cache
+directory, so the tests never touch the real caches or the network.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+# Before any app module is imported: they read these at import time
+os.environ["FUNDBRIDGE_LLM_BACKEND"] = "fake"
+os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+os.environ["FUNDBRIDGE_TRACE_FILE"] = "off"
+os.environ["FUNDBRIDGE_RATE_LIMITS"] = "off"
+_SCRATCH = tempfile.mkdtemp(prefix="fundbridge-tests-")
+os.environ["FUNDBRIDGE_CACHE_DIR"] = os.path.join(_SCRATCH, "cache")
+os.environ["FUNDBRIDGE_KB_DIR"] = os.path.join(_SCRATCH, "knowledge_base")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_SCRATCH, ignore_errors=True)
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+import batch_summarizer
+from batch_summarizer import BatchSummarizer, Source
+
+
+def test_output_name_differs_per_model_and_compression(tmp_path):
+    source = Source("call.txt", data=b"Revenue grew 12% to $4.1 billion.")
+    configs = [("gpt-3.5-turbo", False), ("gpt-4-turbo-preview", False), ("gpt-3.5-turbo", True)]
+    batches = [
+        BatchSummarizer(str(tmp_path), model, "short_default", api_key="sk-test", compress=compress)
+        for model, compress in configs
+    ]
+    names = {batch.output_name(source) for batch in batches}
+    keys = {batch.key(source) for batch in batches}
+    assert len(names) == len(keys) == len(configs)
+
+
+def test_other_config_is_not_done_and_keeps_the_first_file(tmp_path):
+    source = Source("call.txt", data=b"Revenue grew 12% to $4.1 billion.")
+    first = BatchSummarizer(str(tmp_path), "gpt-3.5-turbo", "short_default", api_key="sk-test")
+    first._finish(source, "first summary", tokens=10, seconds=1.0)
+    second = BatchSummarizer(str(tmp_path), "gpt-3.5-turbo", "short_default", api_key="sk-test", compress=True)
+    assert first.is_done(source)
+    assert not second.is_done(source)
+    second._finish(source, "second summary", tokens=8, seconds=1.0, tokens_before=10)
+    assert (tmp_path / first.output_name(source)).read_text() == "first summary"
+    assert (tmp_path / second.output_name(source)).read_text() == "second summary"
+
+
+def test_run_loads_in_spawned_processes(tmp_path, monkeypatch):
+    contexts = []
+
+    class RecordingPool(batch_summarizer.ProcessPoolExecutor):
+        def __init__(self, *args, mp_context=None, **kwargs):
+            contexts.append(mp_context.get_start_method() if mp_context else None)
+            super().__init__(*args, mp_context=mp_context, **kwargs)
+
+    monkeypatch.setattr(batch_summarizer, "ProcessPoolExecutor", RecordingPool)
+    batch = BatchSummarizer(str(tmp_path), "gpt-3.5-turbo", "short_default", load_workers=1, api_key="sk-test")
+    monkeypatch.setattr(batch, "summarize", lambda documents: "summary")
+    results = batch.run([Source("call.txt", data=b"Revenue grew 12% to $4.1 billion.")])
+    assert contexts == ["spawn"]
+    assert [result.get("error") for result in results] == [None]
+
+
+def test_page_output_folders_stay_under_the_root(tmp_path):
+    root = str(tmp_path)
+    assert batch_summarizer.output_dir("q3-earnings", root) == os.path.join(root, "q3-earnings")
+    for folder in ("", "..", "../elsewhere", "/etc", "a/../../b"):
+        with pytest.raises(ValueError):
+            batch_summarizer.output_dir(folder, root)
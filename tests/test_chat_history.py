@@ -0,0 +1,43 @@
+import os
+import time
+
+import chat_history
+from chat_history import ChatHistory
+
+
+def test_window_and_older_pages_read_from_disk(tmp_path):
+    history = ChatHistory(str(tmp_path / "session.jsonl"), recent=4)
+    for i in range(10):
+        history.append("user" if i % 2 == 0 else "assistant", f"message {i}")
+    assert len(history) == 10
+    assert len(history.recent) == 4
+    assert [m["content"] for m in history.messages(7)] == ["message 7", "message 8", "message 9"]
+    assert [m["content"] for m in history.messages(1, 4)] == ["message 1", "message 2", "message 3"]
+    assert history.messages(12) == []
+
+
+def test_transcript_is_read_back_and_a_torn_line_dropped(tmp_path):
+    path = str(tmp_path / "session.jsonl")
+    history = ChatHistory(path)
+    history.append("user", "What was Q3 revenue? Ünïcode ok")
+    history.append("assistant", "$12M")
+    with open(path, "ab") as f:
+        f.write(b'{"role": "user", "con')
+    reloaded = ChatHistory(path)
+    assert reloaded.messages(0) == history.messages(0)
+    reloaded.append("user", "And Q4?")
+    assert [m["content"] for m in ChatHistory(path).messages(0)][1:] == ["$12M", "And Q4?"]
+    reloaded.clear()
+    assert not os.path.exists(path)
+    assert len(reloaded) == 0
+
+
+def test_purge_removes_only_stale_transcripts(tmp_path):
+    stale, fresh = tmp_path / "old.jsonl", tmp_path / "new.jsonl"
+    for path in (stale, fresh):
+        path.write_text("")
+    old = time.time() - 3600
+    os.utime(stale, (old, old))
+    chat_history.purge(str(tmp_path), max_age=60)
+    assert not stale.exists()
+    assert fresh.exists()
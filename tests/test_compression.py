@@ -0,0 +1,80 @@
+from langchain.docstore.document import Document
+
+import compression
+
+RISK_FACTORS = (
+    "Risk Factors. The fund invests in emerging market debt, which carries currency, liquidity and "
+    "political risk. Leverage may magnify losses, and the fund may not be able to sell its holdings "
+    "at a fair price in a stressed market."
+)
+SAFE_HARBOR = (
+    "This call contains forward-looking statements within the meaning of the Private Securities "
+    "Litigation Reform Act. Actual results may differ materially. We undertake no obligation to "
+    "update them."
+)
+RESULTS = "Revenue grew 12% to $4.1 billion and operating margin expanded 150 basis points."
+
+
+def compress(*paragraphs):
+    documents = [Document(page_content="\n\n".join(paragraphs), metadata={"source": "fund.pdf"})]
+    compressed, reports = compression.compress_documents(documents)
+    return "\n\n".join(doc.page_content for doc in compressed), reports[0]
+
+
+def test_risk_factors_survive():
+    text, report = compress(RISK_FACTORS, RESULTS)
+    assert "emerging market debt" in text
+    assert "Leverage may magnify losses" in text
+    assert report["boilerplate_sentences"] == 0
+
+
+def test_safe_harbor_is_dropped_and_results_kept():
+    text, report = compress(SAFE_HARBOR, RESULTS)
+    assert "forward-looking" not in text
+    assert RESULTS in text
+    assert report["boilerplate_sentences"] == 3
+
+
+def test_headers_footers_and_page_numbers_are_dropped():
+    pages = [
+        Document(page_content="\n".join(
+            ["ACME Corp Q3 Earnings Call"]
+            + [f"The discussion on this page covers section {'abcd'[i]}{'efghijkl'[line]}." for line in range(8)]
+            + [str(i + 1)]
+        ), metadata={"source": "call.pdf", "page": i})
+        for i in range(4)
+    ]
+    compressed, report = compression.compress_document(pages)
+    assert len(compressed) == 4
+    assert all("ACME Corp Q3" not in doc.page_content for doc in compressed)
+    assert all("discussion on this page" in doc.page_content for doc in compressed)
+    assert report["furniture_lines"] == 4
+    assert report["page_numbers"] == 4
+
+
+def test_table_figures_are_not_page_numbers():
+    table = "Segment revenue (in millions)\nAmericas\n412\nEurope\n233\nAsia\n97"
+    compressed, report = compression.compress_document([Document(page_content=table, metadata={"source": "10k.pdf"})])
+    assert all(figure in compressed[0].page_content for figure in ("412", "233", "97"))
+    assert report["page_numbers"] == 0
+
+
+def test_only_numbers_that_count_the_pages_are_dropped():
+    pages = [
+        Document(page_content=f"Segment revenue (in millions)\nAmericas\n{400 + i}\nAsia\n{90 + i}\n{i + 5}", metadata={"source": "10k.pdf", "page": i})
+        for i in range(4)
+    ]
+    compressed, report = compression.compress_document(pages)
+    assert report["page_numbers"] == 4
+    for i, doc in enumerate(compressed):
+        assert str(400 + i) in doc.page_content and str(90 + i) in doc.page_content
+        assert not doc.page_content.endswith(f" {i + 5}")
+
+
+def test_form_names_are_dropped_only_as_header_lines():
+    mention = "Our Form 10-K describes the fund's liquidity risk in detail."
+    text, report = compress("FORM 10-K", mention + "\n" + RESULTS)
+    assert mention in text
+    assert "FORM 10-K" not in text
+    assert report["furniture_lines"] == 1
+    assert report["boilerplate_sentences"] == 0
@@ -0,0 +1,54 @@
+import conversation_memory
+from conversation_memory import BudgetedMemory
+from fake_llm import FakeChatModel
+
+
+def memory(max_token_limit=40):
+    return BudgetedMemory(llm=FakeChatModel(latency=0, tokens_per_second=0), max_token_limit=max_token_limit)
+
+
+def chat(memory, turns):
+    for turn in range(turns):
+        memory.save_context({"input": f"question {turn} about the quarterly revenue"}, {"output": f"answer {turn} about the quarterly revenue"})
+
+
+def test_failed_summary_keeps_the_turns_and_retries(monkeypatch):
+    monkeypatch.setattr(conversation_memory, "SUMMARY_RETRY_DELAYS", (0, 0))
+    failures = []
+
+    def flaky(self, messages, existing_summary):
+        if len(failures) < 2:
+            failures.append(len(messages))
+            raise RuntimeError("rate limited")
+        return "summary of the early turns"
+
+    monkeypatch.setattr(BudgetedMemory, "predict_new_summary", flaky)
+    history = memory()
+    chat(history, 6)
+    history.wait(timeout=10)
+    assert len(failures) == 2
+    assert history.moving_summary_buffer == "summary of the early turns"
+    assert not history.pending
+
+
+def test_turns_stay_pending_when_every_retry_fails(monkeypatch):
+    monkeypatch.setattr(conversation_memory, "SUMMARY_RETRY_DELAYS", (0,))
+
+    def broken(self, messages, existing_summary):
+        raise RuntimeError("service unavailable")
+
+    monkeypatch.setattr(BudgetedMemory, "predict_new_summary", broken)
+    history = memory()
+    chat(history, 6)
+    history.wait(timeout=10)
+    assert history.pending
+    assert history.summary_future is None
+    assert history.moving_summary_buffer == ""
+
+
+def test_turn_stats_are_capped():
+    history = memory(max_token_limit=10_000)
+    for _ in range(conversation_memory.MAX_TURN_STATS + 20):
+        history.load_memory_variables({})
+    assert len(history.turn_stats) == conversation_memory.MAX_TURN_STATS
+    assert history.last_turn() == history.turn_stats[-1]
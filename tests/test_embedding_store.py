@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from embedding_store import CachedEmbeddings, EmbeddingStore
+from fake_llm import FakeEmbeddings
+
+
+def cached(tmp_path, **kwargs):
+    embeddings = FakeEmbeddings(dim=16)
+    return CachedEmbeddings(embeddings, store=EmbeddingStore(embeddings.model, str(tmp_path)), **kwargs), embeddings
+
+
+def test_only_unseen_chunks_are_embedded(tmp_path):
+    embedder, embeddings = cached(tmp_path)
+    first = embedder.embed_documents(["revenue grew", "margins fell", "revenue grew"])
+    assert embeddings.requests == 1
+    assert first[0] == first[2]
+    again = embedder.embed_documents(["margins fell", "buyback approved"])
+    assert embeddings.requests == 2
+    assert again[0] == pytest.approx(first[1])
+    stats = embedder.stats()
+    assert stats["stored_vectors"] == 3
+    assert stats["misses"] == 3
+    assert stats["hits"] == 1
+
+
+def test_vectors_survive_a_restart_and_a_torn_append(tmp_path):
+    embedder, _ = cached(tmp_path)
+    vectors = embedder.embed_documents(["revenue grew", "margins fell"])
+    # An append interrupted after the vector but before its key
+    with open(embedder.store.vectors_path, "ab") as f:
+        f.write(np.ones(16, dtype=np.float32).tobytes())
+    store = EmbeddingStore(embedder.store.model, str(tmp_path))
+    assert len(store.rows) == 2
+    found = store.get({store.key("revenue grew"), store.key("margins fell")})
+    assert found[store.key("margins fell")] == pytest.approx(vectors[1])
+
+
+def test_requests_are_packed_within_the_limits(tmp_path):
+    embedder, embeddings = cached(tmp_path, max_batch_inputs=3, max_concurrency=2)
+    texts = [f"chunk number {i}" for i in range(10)]
+    vectors = embedder.embed_documents(texts)
+    assert embeddings.requests == 4
+    assert vectors == [embeddings.embed_query(text) for text in texts]
+
+
+def test_two_writers_on_one_directory_keep_keys_and_rows_aligned(tmp_path):
+    # Like the Streamlit server and the knowledge_base CLI: separate stores, one directory
+    first, embeddings = cached(tmp_path)
+    second = CachedEmbeddings(embeddings, store=EmbeddingStore(embeddings.model, str(tmp_path)))
+    texts = [f"chunk number {i}" for i in range(6)]
+    for i, text in enumerate(texts):
+        (first if i % 2 else second).embed_documents([text])
+    for store in (first.store, second.store):
+        found = store.get({store.key(text) for text in texts})
+        for text in texts:
+            assert found[store.key(text)] == pytest.approx(embeddings.embed_query(text))
+    # The second store sees the first store's rows and doesn't embed them again
+    requests = embeddings.requests
+    second.embed_documents(texts)
+    assert embeddings.requests == requests
+
+
+def test_queries_are_not_stored(tmp_path):
+    embedder, embeddings = cached(tmp_path)
+    assert embedder.embed_query("what did margins do?") == embeddings.embed_query("what did margins do?")
+    assert embedder.stats()["stored_vectors"] == 0
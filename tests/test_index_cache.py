@@ -0,0 +1,57 @@
+import os
+import time
+
+import pytest
+from langchain.docstore.document import Document
+
+import index_cache
+from fake_llm import FakeEmbeddings
+
+CHUNKS = ["Q3 revenue was $12M.", "Margins fell to 18%.", "The board approved a buyback."]
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(index_cache, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(index_cache, "_shared", index_cache.OrderedDict())
+    return tmp_path
+
+
+def build():
+    return index_cache.add_documents([Document(page_content=text, metadata={"page": i}) for i, text in enumerate(CHUNKS)], FakeEmbeddings())
+
+
+def test_key_depends_on_contents_and_settings_only():
+    key = index_cache.cache_key(["b", "a"], chunk_size=500)
+    assert key == index_cache.cache_key(["a", "b", "a"], chunk_size=500)
+    assert key != index_cache.cache_key(["a", "b"], chunk_size=1000)
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_saved_index_loads_back(cache_dir, shared):
+    index_cache.save("entry", build(), digests=["a"])
+    db = index_cache.load("entry", FakeEmbeddings(), shared=shared)
+    assert db.index.ntotal == len(CHUNKS)
+    assert db.similarity_search("buyback", k=1)[0].page_content == CHUNKS[2]
+    assert index_cache.load_lexical("entry", db).search("margins", k=1)[0][0] == 1
+
+
+def test_unreadable_entry_is_discarded(cache_dir):
+    index_cache.save("entry", build())
+    with open(os.path.join(str(cache_dir), "entry", "index.faiss"), "wb") as f:
+        f.write(b"not an index")
+    assert index_cache.load("entry", FakeEmbeddings()) is None
+    assert not os.path.exists(os.path.join(str(cache_dir), "entry"))
+
+
+def test_evict_drops_least_recently_used_entries(cache_dir):
+    for key in ("first", "second", "third"):
+        index_cache.save(key, build())
+    now = time.time()
+    for age, key in enumerate(("third", "first", "second")):
+        os.utime(os.path.join(str(cache_dir), key, index_cache.META_FILE), (now - age, now - age))
+    size = max(size for _, size, _ in index_cache.entries())
+    index_cache.evict(max_bytes=2 * size)
+    assert [key for key, _, _ in index_cache.entries()] == ["first", "third"]
+    index_cache.evict(max_bytes=0, keep="third")
+    assert [key for key, _, _ in index_cache.entries()] == ["third"]
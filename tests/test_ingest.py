@@ -0,0 +1,38 @@
+import glob
+import os
+import tempfile
+
+import ingest
+from benchmarks.corpus import UploadedFile, make_pdf
+
+
+def spooled():
+    return set(glob.glob(os.path.join(tempfile.gettempdir(), "fundbridge-*.pdf")))
+
+
+def pdf(name, pages):
+    return UploadedFile(name, make_pdf([f"{name} page {number} revenue line" for number in range(pages)]))
+
+
+def test_pdf_ranges_are_parsed_in_order_from_one_spool_file():
+    before = spooled()
+    uploads = [pdf("a.pdf", 40), UploadedFile("notes.txt", b"plain notes"), pdf("b.pdf", 3)]
+    docs = list(ingest.iter_documents(uploads, pages_per_task=16))
+    assert [(doc.metadata["source"], doc.metadata.get("page")) for doc in docs] == (
+        [("a.pdf", number) for number in range(40)] + [("notes.txt", None)] + [("b.pdf", number) for number in range(3)]
+    )
+    assert "a.pdf page 37 revenue line" in docs[37].page_content
+    assert spooled() == before
+
+
+def test_spool_files_are_removed_when_the_reader_stops_early():
+    before = spooled()
+    docs = ingest.iter_documents([pdf("a.pdf", 40)], pages_per_task=8)
+    assert next(docs).metadata["page"] == 0
+    docs.close()
+    assert spooled() == before
+
+
+def test_parse_bytes_reads_a_pdf_in_process():
+    docs = ingest.parse_bytes("a.pdf", pdf("a.pdf", 3).getvalue())
+    assert [doc.metadata["page"] for doc in docs] == [0, 1, 2]
@@ -0,0 +1,29 @@
+import asyncio
+
+import tracing
+from query_pipeline import QueryPipeline
+
+
+class TracingRetriever:
+    """Stands in for a HybridRetriever; its rankings record spans like embed_query does."""
+
+    def vector_ranking(self, query):
+        with tracing.span("embed_query"):
+            return [(0, 1.0)]
+
+    def lexical_ranking(self, query):
+        with tracing.span("bm25"):
+            return [(0, 1.0)]
+
+    def fuse(self, query, vector, lexical):
+        return vector
+
+    def document(self, position):
+        return position
+
+
+def test_spans_recorded_in_retrieval_workers_reach_the_trace():
+    pipeline = QueryPipeline(TracingRetriever(), llm=None, memory=None)
+    with tracing.trace("chat_turn") as trace:
+        asyncio.run(pipeline._retrieve("revenue", {}))
+    assert {"embed_query", "bm25", "embed_query_and_search", "lexical_search", "rerank"} <= set(trace.spans)
@@ -0,0 +1,94 @@
+from langchain.schema import Generation
+
+import response_cache
+from fake_llm import FakeEmbeddings
+from response_cache import KeyedCache, ResponseCache
+
+LLM = "openai-chat gpt-3.5-turbo temperature=0"
+
+
+def cache(tmp_path, **kwargs):
+    return ResponseCache(path=str(tmp_path / response_cache.DB_FILE), **kwargs)
+
+
+def test_exact_hit_returns_the_stored_response(tmp_path):
+    responses = cache(tmp_path)
+    assert responses.lookup("What was Q3 revenue?", LLM) is None
+    responses.update("What was Q3 revenue?", LLM, [Generation(text="$12M")])
+    assert [generation.text for generation in responses.lookup("What was Q3 revenue?", LLM)] == ["$12M"]
+    # Another model never shares the answer
+    assert responses.lookup("What was Q3 revenue?", LLM + " other") is None
+    assert responses.stats["exact_hits"] == 1
+    assert responses.stats["misses"] == 2
+
+
+def test_expired_responses_miss(tmp_path):
+    responses = cache(tmp_path, ttl=-1)
+    responses.update("What was Q3 revenue?", LLM, [Generation(text="$12M")])
+    assert responses.lookup("What was Q3 revenue?", LLM) is None
+
+
+def test_eviction_drops_least_recently_used_first(tmp_path, monkeypatch):
+    monkeypatch.setattr(response_cache, "EVICT_EVERY", 1)
+    answer = "x" * 200
+    responses = cache(tmp_path)
+    responses.update("first", LLM, [Generation(text=answer)])
+    # Room for three responses
+    responses.max_bytes = 3 * responses.conn.execute("SELECT LENGTH(response) FROM responses").fetchone()[0]
+    responses.update("second", LLM, [Generation(text=answer)])
+    assert responses.lookup("first", LLM)
+    for prompt in ("third", "fourth"):
+        responses.update(prompt, LLM, [Generation(text=answer)])
+    # The oldest entry was used since, so the second one goes
+    assert responses.lookup("second", LLM) is None
+    for prompt in ("first", "third", "fourth"):
+        assert responses.lookup(prompt, LLM)
+
+
+def test_semantic_hit_for_the_same_prompt_text(tmp_path):
+    responses = cache(tmp_path, semantic_threshold=0.99, embeddings_factory=FakeEmbeddings)
+    assert responses.lookup("What was Q3 revenue?", LLM) is None
+    responses.update("What was Q3 revenue?", LLM, [Generation(text="$12M")])
+    # A different serialization of the same text misses the exact key but matches its embedding
+    prompt = '[{"content": "What was Q3 revenue?"}]'
+    assert [generation.text for generation in responses.lookup(prompt, LLM)] == ["$12M"]
+    assert responses.stats["semantic_hits"] == 1
+
+
+def test_responses_are_kept_per_api_key(tmp_path):
+    responses = cache(tmp_path, semantic_threshold=0.99, embeddings_factory=FakeEmbeddings)
+    alice = KeyedCache(responses, "alice")
+    bob = KeyedCache(responses, "bob")
+    alice.lookup("What was Q3 revenue?", LLM)
+    alice.update("What was Q3 revenue?", LLM, [Generation(text="$12M, per the uploaded filing")])
+    assert alice.lookup("What was Q3 revenue?", LLM)
+    # Neither the exact nor the semantic lookup crosses keys
+    assert bob.lookup("What was Q3 revenue?", LLM) is None
+    assert bob.lookup('[{"content": "What was Q3 revenue?"}]', LLM) is None
+
+
+def test_models_get_their_keys_cache_with_a_stable_llm_string(monkeypatch):
+    import llm_pool
+
+    # The fake models skip the cache; these are never called
+    monkeypatch.setattr(llm_pool, "BACKEND", "openai")
+    first = llm_pool.get_chat_model("gpt-3.5-turbo", api_key="sk-first", temperature=0)
+    second = llm_pool.get_chat_model("gpt-3.5-turbo", api_key="sk-second", temperature=0)
+    assert first.cache.namespace != second.cache.namespace
+    assert first.cache.cache is second.cache.cache
+    assert first._get_llm_string() == second._get_llm_string()
+    assert " at 0x" not in first._get_llm_string()
+
+
+def test_responses_cached_before_namespaces_are_dropped(tmp_path):
+    import sqlite3
+
+    conn = sqlite3.connect(str(tmp_path / response_cache.DB_FILE))
+    conn.execute("CREATE TABLE responses (key TEXT PRIMARY KEY, llm TEXT, response TEXT, embedding BLOB, latency REAL, created REAL, last_hit REAL, hits INTEGER DEFAULT 0)")
+    conn.execute("INSERT INTO responses (key, llm, response) VALUES ('k', ?, '[]')", (LLM,))
+    conn.commit()
+    conn.close()
+    responses = cache(tmp_path)
+    assert responses.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] == 0
+    responses.update("What was Q3 revenue?", LLM, [Generation(text="$12M")], namespace="alice")
+    assert responses.lookup("What was Q3 revenue?", LLM, namespace="alice")
@@ -0,0 +1,66 @@
+import pytest
+from langchain.vectorstores import FAISS
+
+from fake_llm import FakeEmbeddings
+from retrieval import RRF_K, HybridRetriever, LexicalIndex, exact_terms, reciprocal_rank_fusion, tokenize
+
+CHUNKS = [
+    "Revenue grew strongly in the third quarter across all segments.",
+    "Q3 revenue was $1,234.5 million, up 12% year over year.",
+    "The board approved a new share buyback program.",
+    "Operating margin in Q2 was 18%, and revenue was $1,100.0 million.",
+    "Management discussed revenue guidance for the coming year.",
+]
+
+
+def retriever(**kwargs):
+    db = FAISS.from_texts(CHUNKS, FakeEmbeddings())
+    return HybridRetriever(vectorstore=db, lexical=LexicalIndex.build(CHUNKS), **kwargs)
+
+
+def test_tokenize_keeps_numbers_and_tickers_whole():
+    assert tokenize("What was BRK.B's Q3 revenue of $1,234.5?") == ["brk.b", "q3", "revenue", "1234.5"]
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    fused = reciprocal_rank_fusion([[3, 1, 2], [1, 4]])
+    assert fused[1] == pytest.approx(1 / (RRF_K + 2) + 1 / (RRF_K + 1))
+    assert fused[3] == pytest.approx(1 / (RRF_K + 1))
+    # Second in one ranking and first in the other beats first in only one
+    assert max(fused, key=fused.get) == 1
+    assert set(fused) == {1, 2, 3, 4}
+
+
+def test_bm25_search_and_allowed_positions():
+    lexical = LexicalIndex.build(CHUNKS)
+    assert [position for position, _ in lexical.search("share buyback", k=3)] == [2]
+    assert {position for position, _ in lexical.search("revenue", k=10)} == {0, 1, 3, 4}
+    assert {position for position, _ in lexical.search("revenue", k=10, allowed=[3, 4])} == {3, 4}
+
+
+def test_lexical_index_round_trips(tmp_path):
+    lexical = LexicalIndex.build(CHUNKS)
+    lexical.save(str(tmp_path))
+    loaded = LexicalIndex.load(str(tmp_path))
+    assert loaded.search("Q3 revenue", k=3) == lexical.search("Q3 revenue", k=3)
+    assert LexicalIndex.load(str(tmp_path / "missing")) is None
+
+
+def test_exact_figure_wins_the_rerank():
+    hybrid = retriever(k=2)
+    ranked = hybrid.rank("What was Q3 revenue in 1,234.5?")
+    assert ranked[0][0] == 1
+    assert len(ranked) == 2
+    assert [doc.page_content for doc in hybrid.get_relevant_documents("Q3 revenue")][0] == CHUNKS[1]
+
+
+def test_fuse_ranks_chunks_both_searches_found_first():
+    hybrid = retriever(k=5)
+    ranked = [position for position, _ in hybrid.fuse("buyback", [4, 2, 0], [2])]
+    assert ranked[0] == 2
+    assert set(ranked) == {0, 2, 4}
+
+
+def test_tickers_count_as_exact_terms():
+    assert exact_terms("Did AAPL or BRK.B beat Q3 revenue of $1,234.5?") == {"aapl", "brk.b", "q3", "1234.5"}
+    assert exact_terms("What was the revenue?") == set()
@@ -0,0 +1,139 @@
+import threading
+import time
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+import scheduler
+from fake_llm import FakeChatModel
+
+
+def run_together(*calls):
+    """Run the calls on threads that start at the same time; return their results in order."""
+    results = [None] * len(calls)
+    barrier = threading.Barrier(len(calls))
+
+    def target(i):
+        barrier.wait()
+        results[i] = calls[i]()
+
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(len(calls))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def counting_call(calls, result, seconds=0.2):
+    def call():
+        calls.append(1)
+        time.sleep(seconds)
+        return result
+    return call
+
+
+def test_identical_requests_in_flight_are_coalesced():
+    sched = scheduler.Scheduler({})
+    calls = []
+    key = scheduler._request_key("sk-a", "model", "prompt")
+    results = run_together(
+        lambda: sched.run(key, "model", 10, scheduler.INTERACTIVE, counting_call(calls, "answer")),
+        lambda: sched.run(key, "model", 10, scheduler.INTERACTIVE, counting_call(calls, "answer")),
+    )
+    assert results == ["answer", "answer"]
+    assert len(calls) == 1
+    assert sched.stats()["coalesced"] == 1
+
+
+def test_requests_without_a_key_are_not_coalesced():
+    sched = scheduler.Scheduler({})
+    calls = []
+    run_together(
+        lambda: sched.run(None, "model", 10, scheduler.INTERACTIVE, counting_call(calls, "answer")),
+        lambda: sched.run(None, "model", 10, scheduler.INTERACTIVE, counting_call(calls, "answer")),
+    )
+    assert len(calls) == 2
+
+
+def test_request_key_depends_on_the_api_key():
+    assert scheduler._request_key("sk-a", "model", "prompt") != scheduler._request_key("sk-b", "model", "prompt")
+    assert scheduler._request_key("sk-a", "model", "prompt") == scheduler._request_key("sk-a", "model", "prompt")
+
+
+def chat(api_key, streaming=False):
+    chat_class = scheduler.scheduled_chat_class(FakeChatModel, scheduler.INTERACTIVE)
+    return chat_class(openai_api_key=api_key, streaming=streaming, latency=0.2, tokens_per_second=0, completion_tokens=5)
+
+
+def test_same_prompt_on_different_keys_is_not_shared(monkeypatch):
+    replies = []
+    original = FakeChatModel.reply
+    monkeypatch.setattr(FakeChatModel, "reply", lambda self, messages: replies.append(1) or original(self, messages))
+    run_together(lambda: chat("sk-a").invoke("What was revenue?"), lambda: chat("sk-b").invoke("What was revenue?"))
+    assert len(replies) == 2
+
+
+def test_same_prompt_on_one_key_is_shared(monkeypatch):
+    replies = []
+    original = FakeChatModel.reply
+    monkeypatch.setattr(FakeChatModel, "reply", lambda self, messages: replies.append(1) or original(self, messages))
+    llm = chat("sk-a")
+    run_together(lambda: llm.invoke("What was revenue?"), lambda: llm.invoke("What was revenue?"))
+    assert len(replies) == 1
+
+
+class TokenCounter(BaseCallbackHandler):
+
+    def __init__(self):
+        self.tokens = 0
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.tokens += 1
+
+
+class EndCounter(BaseCallbackHandler):
+
+    def __init__(self):
+        self.ends = 0
+
+    def on_llm_end(self, response, **kwargs):
+        self.ends += 1
+
+
+def test_requests_with_callbacks_are_shared_and_each_caller_hears_the_end(monkeypatch):
+    replies = []
+    original = FakeChatModel.reply
+    monkeypatch.setattr(FakeChatModel, "reply", lambda self, messages: replies.append(1) or original(self, messages))
+    llm = chat("sk-a")
+    handlers = [EndCounter(), EndCounter()]
+    run_together(*[
+        lambda handler=handler: llm.invoke("What was revenue?", config={"callbacks": [handler]})
+        for handler in handlers
+    ])
+    assert len(replies) == 1
+    assert [handler.ends for handler in handlers] == [1, 1]
+
+
+def test_limits_are_off_unless_configured():
+    assert scheduler.parse_limits("") is None
+    assert scheduler.parse_limits("gpt-4=500:40000") == {"gpt-4": (500, 40000)}
+    assert scheduler.parse_limits("tier,gpt-4=500:40000") == dict(scheduler.MODEL_LIMITS, **{"gpt-4": (500, 40000)})
+
+
+def test_oversized_requests_leave_the_reserve_and_debt_is_capped():
+    sched = scheduler.Scheduler({"model": (1000, 1000)})
+    sched.acquire("model", 50_000, scheduler.BULK)
+    # A chat turn right behind a request far over the limit doesn't wait for it to be paid off
+    assert sched.acquire("model", 50, scheduler.INTERACTIVE) < 0.5
+    sched.settle("model", 50_000, 10 ** 9)
+    assert sched._lanes["model"].tokens.level == -1000
+
+
+def test_streamed_requests_each_get_their_tokens():
+    llm = chat("sk-a", streaming=True)
+    handlers = [TokenCounter(), TokenCounter()]
+    run_together(*[
+        lambda handler=handler: llm.invoke("What was revenue?", config={"callbacks": [handler]})
+        for handler in handlers
+    ])
+    assert [handler.tokens for handler in handlers] == [5, 5]
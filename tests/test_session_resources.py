@@ -0,0 +1,98 @@
+import time
+
+import numpy as np
+import pytest
+
+import session_resources
+from session_resources import _Session, _Slot
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    registry = {}
+    monkeypatch.setattr(session_resources, "_sessions", registry)
+    return registry
+
+
+def session(registry, sid, idle, **objects):
+    record = registry[sid] = _Session(sid)
+    record.last_seen = time.monotonic() - idle
+    for name, (value, spill) in objects.items():
+        slot = record.slots[name] = _Slot(value, spill)
+        slot.size = session_resources.estimate_size(value)
+    return record
+
+
+def test_estimate_size_counts_buffers_but_not_shared_or_mapped_ones(tmp_path):
+    array = np.zeros(100_000, dtype=np.float32)
+    assert session_resources.estimate_size({"vectors": array}) >= array.nbytes
+    assert session_resources.estimate_size({"vectors": array}, exclude={id(array)}) < array.nbytes
+    mapped = np.memmap(str(tmp_path / "vectors.f32"), dtype=np.float32, mode="w+", shape=(100_000,))
+    assert session_resources.estimate_size([mapped]) < mapped.nbytes
+
+
+def test_least_recently_seen_sessions_are_evicted_first(sessions):
+    state = np.zeros(250_000, dtype=np.uint8)
+    oldest = session(sessions, "oldest", idle=30, chains=(state.copy(), None))
+    older = session(sessions, "older", idle=20, chains=(state.copy(), None))
+    recent = session(sessions, "recent", idle=10, chains=(state.copy(), None))
+    running = session(sessions, "running", idle=40, chains=(state.copy(), None))
+    running.running = 1
+    session_resources.enforce(cap=2 * state.nbytes + 10_000)
+    assert oldest.slots["chains"].evicted and older.slots["chains"].evicted
+    assert recent.slots["chains"].value is not None
+    assert running.slots["chains"].value is not None
+
+
+def test_idle_sessions_spill_and_restore_once(sessions, monkeypatch):
+    session(sessions, "idle", idle=session_resources.IDLE_SECONDS + 1, chains=({"history": ["hi"]}, lambda value: value["history"]))
+    session_resources.enforce(cap=10 ** 12)
+    assert sessions["idle"].slots["chains"].evicted
+    monkeypatch.setattr(session_resources, "session_id", lambda: "idle")
+    assert session_resources.restore("chains") == ["hi"]
+    assert session_resources.restore("chains") is None
+
+
+def test_checkpoint_reuses_recent_estimates(sessions, monkeypatch):
+    history = ["hi"]
+    record = session(sessions, "chatting", idle=0, chains=(history, None))
+    monkeypatch.setattr(session_resources, "_current", lambda: record)
+    slot = record.slots["chains"]
+    history.extend(f"{i:>1000}" for i in range(100))
+    session_resources.checkpoint()
+    assert slot.size < 100_000
+    slot.estimated -= session_resources.ESTIMATE_SECONDS
+    session_resources.checkpoint()
+    assert slot.size > 100_000
+
+
+def test_embedding_stores_and_response_cache_are_shared(monkeypatch):
+    import embedding_store
+    import response_cache
+    from fake_llm import FakeEmbeddings
+
+    monkeypatch.setattr(embedding_store, "_stores", {})
+    embeddings = embedding_store.CachedEmbeddings(FakeEmbeddings(dim=16), store=embedding_store.get_store("shared-test"))
+    embeddings.store.rows.update({f"{i:064x}": i for i in range(10_000)})
+    cache = response_cache.for_key("sk-test")
+    shared = session_resources._shared_ids()
+    assert session_resources.estimate_size([embeddings, cache], shared) < 10_000
+    assert session_resources.estimate_size([embeddings, cache]) > 1_000_000
+
+
+def test_usage_panel_shows_only_this_session(sessions, monkeypatch):
+    from streamlit.testing.v1 import AppTest
+
+    session(sessions, "someoneelse", idle=5, chains=(["their question"], None))
+
+    def app():
+        import session_resources
+        session_resources.put("chains", ["my question"])
+        session_resources.show_usage()
+
+    at = AppTest.from_function(app).run()
+    panel = at.sidebar.expander[0].markdown[0].value
+    assert "(you)" in panel and "someonee" not in panel and "All sessions" not in panel
+    monkeypatch.setenv("FUNDBRIDGE_MEMORY_PANEL", "all")
+    panel = at.run().sidebar.expander[0].markdown[0].value
+    assert "someonee" in panel and "All sessions" in panel
@@ -0,0 +1,36 @@
+import pytest
+from langchain.docstore.document import Document
+from langchain.prompts import PromptTemplate
+
+from fake_llm import FakeChatModel
+from summarize import MapReduceSummarizer, SummaryTooLongError
+
+PROMPT = PromptTemplate(input_variables=["text"], template="Summarize:\n{text}")
+
+
+def document(pages=20):
+    return [
+        Document(page_content=" ".join(f"revenue{page} grew {i} percent in segment{i}" for i in range(40)))
+        for page in range(pages)
+    ]
+
+
+def summarizer(completion_tokens, max_tokens=400):
+    llm = FakeChatModel(latency=0, tokens_per_second=0, completion_tokens=completion_tokens)
+    return MapReduceSummarizer(llm, PROMPT, max_tokens, max_workers=4)
+
+
+def test_map_reduce_fits_the_final_call():
+    mapper = summarizer(completion_tokens=10)
+    progress = []
+    summary = mapper.summarize(document(), on_progress=lambda done, total: progress.append((done, total)))
+    assert summary
+    assert mapper.calls_total > 2
+    assert progress[-1] == (mapper.calls_total, mapper.calls_total)
+
+
+def test_summaries_that_stop_shrinking_raise_instead_of_truncating():
+    # Every call answers with about as many tokens as one call may take
+    mapper = summarizer(completion_tokens=300)
+    with pytest.raises(SummaryTooLongError):
+        mapper.summarize(document())
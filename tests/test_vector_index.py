@@ -0,0 +1,40 @@
+import faiss
+import numpy as np
+import pytest
+
+import vector_index
+
+
+def vectors(count, dimension=32, seed=0):
+    return np.random.default_rng(seed).random((count, dimension), dtype=np.float32)
+
+
+def test_small_corpora_stay_flat():
+    assert vector_index.resolve_type("hnsw", vector_index.TRAIN_THRESHOLD - 1) == "flat"
+    assert vector_index.resolve_type("auto", vector_index.TRAIN_THRESHOLD) == vector_index.AUTO_TYPE
+    with pytest.raises(ValueError):
+        vector_index.resolve_type("annoy", 10)
+
+
+@pytest.mark.parametrize("index_type, name", [("ivf", "IVF"), ("ivfpq", "IVF-PQ"), ("hnsw", "HNSW")])
+def test_trained_types_find_the_stored_vector(monkeypatch, index_type, name):
+    monkeypatch.setattr(vector_index, "TRAIN_THRESHOLD", 100)
+    data = vectors(2000)
+    index = vector_index.build(data, index_type)
+    assert vector_index.describe(index).startswith(name + " ")
+    assert index.ntotal == len(data)
+    _, positions = index.search(data[:20], 1)
+    # IVF-PQ is lossy, so allow a few misses there
+    assert np.mean(positions[:, 0] == np.arange(20)) >= (0.8 if index_type == "ivfpq" else 0.95)
+
+
+def test_mmap_read_and_restricted_search(monkeypatch, tmp_path):
+    monkeypatch.setattr(vector_index, "TRAIN_THRESHOLD", 100)
+    data = vectors(2000)
+    path = str(tmp_path / "index.faiss")
+    faiss.write_index(vector_index.build(data, "ivf"), path)
+    index = vector_index.read_mmap(path)
+    allowed = np.array([5, 700, 1500], dtype=np.int64)
+    _, positions = index.search(data[700:701], 3, params=vector_index.search_params(index, allowed))
+    assert positions[0][0] == 700
+    assert set(positions[0]) <= set(allowed)
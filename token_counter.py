@@ -0,0 +1,111 @@
+"""
+Token accounting shared by the pages: cached tiktoken encoders, batch counting and the
+per-model context limits. tiktoken is imported with the first encoder, so reading the
+limits costs nothing at page load.
+"""
+
+import functools
+from collections import namedtuple
+
+DEFAULT_ENCODING = 'cl100k_base'
+TOKEN_COUNT_KEY = 'token_count'
+
+ModelLimits = namedtuple('ModelLimits', ['context_window', 'max_prompt_tokens'])
+
+# max_prompt_tokens leaves room in the context window for the response
+MODEL_LIMITS = {
+    'gpt-4-turbo-preview': ModelLimits(128000, 100000),
+    'gpt-4': ModelLimits(8192, 6000),
+    'gpt-3.5-turbo-1106': ModelLimits(16385, 12000),
+    'gpt-3.5-turbo': ModelLimits(4096, 2500),
+    'gpt-3.5-turbo-16k': ModelLimits(16385, 12000),
+}
+DEFAULT_LIMITS = MODEL_LIMITS['gpt-3.5-turbo']
+
+
+def model_limits(model):
+    """
+    :param model: The OpenAI model name.
+
+    :return: The ModelLimits of the model, or the most conservative limits for unknown models.
+    """
+    return MODEL_LIMITS.get(model, DEFAULT_LIMITS)
+
+
+def max_prompt_tokens(model):
+    return model_limits(model).max_prompt_tokens
+
+
+def context_window(model):
+    return model_limits(model).context_window
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(encoding_name=DEFAULT_ENCODING):
+    """Load a tiktoken encoding once per process."""
+    import tiktoken
+    return tiktoken.get_encoding(encoding_name)
+
+
+@functools.lru_cache(maxsize=None)
+def encoding_for_model(model):
+    """Return the encoding of an OpenAI model, falling back to cl100k_base for unknown names."""
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return get_encoding(DEFAULT_ENCODING)
+
+
+def count_tokens(text, encoding_name=DEFAULT_ENCODING):
+    """Returns the number of tokens in a text string."""
+    return len(get_encoding(encoding_name).encode_ordinary(text))
+
+
+def count_batch(texts, encoding_name=DEFAULT_ENCODING, num_threads=8):
+    """
+    Count the tokens of many strings in one call, encoding them on tiktoken's thread pool.
+
+    :param texts: The strings to count.
+
+    :return: A list with the token count of each string.
+    """
+    if not texts:
+        return []
+    encoded = get_encoding(encoding_name).encode_ordinary_batch(list(texts), num_threads=num_threads)
+    return [len(tokens) for tokens in encoded]
+
+
+def count_documents(documents, encoding_name=DEFAULT_ENCODING, num_threads=8):
+    """
+    Count the tokens of a list of Documents and store each count in the Document's metadata.
+
+    Documents that were already counted with the same encoding are not tokenized again.
+
+    :param documents: LangChain Documents, e.g. the pages returned by a loader.
+
+    :return: The total number of tokens.
+    """
+    import tracing  # pulls in langchain, which pages importing this module at startup don't need yet
+
+    key = _metadata_key(encoding_name)
+    todo = [doc for doc in documents if key not in doc.metadata]
+    with tracing.span("tokenize", documents=len(todo)) as span:
+        for doc, count in zip(todo, count_batch([doc.page_content for doc in todo], encoding_name, num_threads)):
+            doc.metadata[key] = count
+        total = sum(doc.metadata[key] for doc in documents)
+        span.set(tokens=total)
+    return total
+
+
+def document_tokens(document, encoding_name=DEFAULT_ENCODING):
+    """Return the token count of a Document, counting (and storing) it if needed."""
+    key = _metadata_key(encoding_name)
+    if key not in document.metadata:
+        document.metadata[key] = count_tokens(document.page_content, encoding_name)
+    return document.metadata[key]
+
+
+def _metadata_key(encoding_name):
+    # Counts for the default encoding use the plain key, which is what other stages read
+    return TOKEN_COUNT_KEY if encoding_name == DEFAULT_ENCODING else f'{TOKEN_COUNT_KEY}_{encoding_name}'
@@ -0,0 +1,287 @@
+"""
+Request tracing: where the seconds of a summary or a chat turn go.
+
+A trace covers one user request. Inside it the hot paths record spans with span() (a
+context manager) or record(), and LLM calls are traced by TraceCallback. Spans with the
+same name are aggregated, because most stages run many times per request (a split per
+page, an embedding call per batch): the span keeps its first start and last end, the
+busy seconds summed over its runs, the number of runs, and numeric attributes such as
+tokens and bytes summed.
+
+    with tracing.trace("chat_turn", page="Chat with Doc") as current:
+        with tracing.span("split") as s:
+            chunks = splitter.split_documents(docs)
+            s.set(chunks=len(chunks))
+    utils.show_trace(current)
+
+Outside a trace, span() only times the block. Finished traces are appended to
+TRACE_FILE, one JSON line per span, with OpenTelemetry span field names (traceId,
+spanId, parentSpanId, name, startTimeUnixNano, endTimeUnixNano, attributes).
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from langchain.callbacks.base import BaseCallbackHandler
+from streamlit.logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+# Where finished traces go; set FUNDBRIDGE_TRACE_FILE=off to keep them in memory only
+TRACE_FILE = os.environ.get("FUNDBRIDGE_TRACE_FILE", "")
+MAX_FILE_BYTES = 50 * 2 ** 20
+
+_current = contextvars.ContextVar("fundbridge_trace", default=None)
+_export_lock = threading.Lock()
+
+
+class Span:
+
+    def __init__(self, name, start, **attributes):
+        self.name = name
+        self.start = start
+        self.end = start
+        self.seconds = 0.0
+        self.count = 0
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        """Add attributes, e.g. tokens=... or bytes=..., to the span."""
+        self.attributes.update(attributes)
+
+    def merge(self, other):
+        """Fold another run of the same stage into this span."""
+        self.start = min(self.start, other.start)
+        self.end = max(self.end, other.end)
+        self.seconds += other.seconds
+        self.count += other.count
+        for key, value in other.attributes.items():
+            current = self.attributes.get(key)
+            if _is_number(value) and _is_number(current):
+                self.attributes[key] = current + value
+            elif key not in self.attributes:
+                self.attributes[key] = value
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class Trace:
+
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.attributes = attributes
+        self.start = time.perf_counter()
+        self.start_ns = time.time_ns()
+        self.end = None
+        self.spans = {}
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            aggregate = self.spans.get(span.name)
+            if aggregate is None:
+                self.spans[span.name] = span
+            else:
+                aggregate.merge(span)
+
+    @property
+    def seconds(self):
+        return (self.end or time.perf_counter()) - self.start
+
+    def ordered_spans(self):
+        """Return the spans in the order their stages started."""
+        with self._lock:
+            return sorted(self.spans.values(), key=lambda span: span.start)
+
+    def records(self):
+        """Return the trace as OpenTelemetry-style span dicts, the root span first."""
+        root_id = uuid.uuid4().hex[:16]
+
+        def unix_ns(perf):
+            return self.start_ns + int((perf - self.start) * 1e9)
+
+        records = [{
+            "traceId": self.trace_id,
+            "spanId": root_id,
+            "parentSpanId": None,
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": unix_ns(self.end or time.perf_counter()),
+            "attributes": dict(self.attributes),
+        }]
+        for span in self.ordered_spans():
+            records.append({
+                "traceId": self.trace_id,
+                "spanId": uuid.uuid4().hex[:16],
+                "parentSpanId": root_id,
+                "name": span.name,
+                "startTimeUnixNano": unix_ns(span.start),
+                "endTimeUnixNano": unix_ns(span.end),
+                "attributes": dict(span.attributes, busy_seconds=round(span.seconds, 6), runs=span.count),
+            })
+        return records
+
+
+def trace_file():
+    """Return the JSONL file traces are exported to, or None when export is off."""
+    if TRACE_FILE.lower() in ("off", "0", "false"):
+        return None
+    if TRACE_FILE:
+        return TRACE_FILE
+    import utils
+    return os.path.join(utils.get_cache_dir("traces"), "spans.jsonl")
+
+
+def export(finished, path=None):
+    """
+    Append a trace to the JSONL file, rotating the file to .1 once it is over MAX_FILE_BYTES.
+
+    :param finished: The Trace.
+
+    :param path: The file, defaults to trace_file().
+    """
+    path = path or trace_file()
+    if path is None:
+        return
+    lines = "".join(json.dumps(record, default=str) + "\n" for record in finished.records())
+    with _export_lock:
+        if os.path.exists(path) and os.path.getsize(path) > MAX_FILE_BYTES:
+            os.replace(path, path + ".1")
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+
+def current():
+    """Return the trace of the running request, or None."""
+    return _current.get()
+
+
+@contextmanager
+def trace(name, **attributes):
+    """
+    Trace a user request; spans recorded inside the block, on this thread, belong to it.
+
+    :param name: The kind of request, e.g. 'chat_turn'.
+
+    :param attributes: Attributes of the whole request, e.g. the page and model.
+
+    :return: A context manager yielding the Trace, which is exported when the block exits.
+    """
+    started = Trace(name, **attributes)
+    token = _current.set(started)
+    try:
+        yield started
+    finally:
+        _current.reset(token)
+        started.end = time.perf_counter()
+        try:
+            export(started)
+        except OSError as e:
+            LOGGER.warning("Could not export trace %s: %s", started.trace_id, e)
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Time a stage of the current trace.
+
+    :param name: The stage, e.g. 'parse', 'tokenize', 'split', 'embed', 'index', 'retrieve'.
+
+    :param attributes: Initial attributes; more can be added with Span.set().
+
+    :return: A context manager yielding the Span. Its seconds are set when the block exits.
+    """
+    started = Span(name, time.perf_counter(), **attributes)
+    try:
+        yield started
+    finally:
+        started.end = time.perf_counter()
+        started.seconds = started.end - started.start
+        started.count = 1
+        active = current()
+        if active is not None:
+            active.add(started)
+
+
+def record(name, start, end=None, trace=None, **attributes):
+    """
+    Add a span timed elsewhere, e.g. across the yields of a generator.
+
+    :param name: The stage.
+
+    :param start: Its time.perf_counter() start.
+
+    :param end: Its end, defaults to now.
+
+    :param trace: The trace to add it to, defaults to the current one.
+    """
+    trace = trace or current()
+    if trace is None:
+        return
+    finished = Span(name, start, **attributes)
+    finished.end = time.perf_counter() if end is None else end
+    finished.seconds = finished.end - start
+    finished.count = 1
+    trace.add(finished)
+
+
+class TraceCallback(BaseCallbackHandler):
+    """
+    Records LLM calls into a trace: a 'first_token' span from the start of each call to
+    its first streamed token, and a 'completion' span for the whole call with its prompt
+    and completion tokens. Safe to share between concurrent calls.
+    """
+
+    # Only records timings, so async chains may call it on their event loop thread
+    run_inline = True
+
+    def __init__(self, trace=None):
+        """
+        :param trace: The trace to record into, defaults to the current one.
+        """
+        self.trace = trace or current()
+        self.first_token_at = None
+        self._runs = {}
+
+    def on_llm_start(self, serialized, prompts, *, run_id=None, **kwargs):
+        import token_counter
+        prompt_tokens = sum(token_counter.count_tokens(prompt) for prompt in prompts)
+        self._runs[run_id] = {"start": time.perf_counter(), "prompt_tokens": prompt_tokens, "tokens": 0}
+
+    def on_llm_new_token(self, token, *, run_id=None, **kwargs):
+        run = self._runs.get(run_id)
+        if run is None:
+            return
+        if not run["tokens"]:
+            now = time.perf_counter()
+            if self.first_token_at is None:
+                self.first_token_at = now
+            record("first_token", run["start"], now, trace=self.trace)
+        run["tokens"] += 1
+
+    def on_llm_end(self, response, *, run_id=None, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        completion_tokens = usage.get("completion_tokens") or run["tokens"]
+        if not completion_tokens and response.generations and response.generations[0]:
+            import token_counter
+            completion_tokens = token_counter.count_tokens(response.generations[0][0].text)
+        record(
+            "completion", run["start"], trace=self.trace,
+            prompt_tokens=run["prompt_tokens"], completion_tokens=completion_tokens
+        )
+
+    def on_llm_error(self, error, *, run_id=None, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            record("completion", run["start"], trace=self.trace, prompt_tokens=run["prompt_tokens"], errors=1)
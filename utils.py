@@ -12,53 +12,65 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import importlib
 import os
-import tempfile
-import shutil
+import threading
+import time
 import streamlit as st
-import tiktoken
+from streamlit.logger import get_logger
 
-from langchain.chat_models import ChatOpenAI
+import key_validation
 
-from prompts import PROMPT_earnings, PROMPT_short, PROMPT_investment
+# Heavy modules are imported where they are used (see warm_up), so Hello.py and the
+# first paint of every page only pay for streamlit
+LOGGER = get_logger(__name__)
+WARM_UP_MODULES = [
+    "prompts",
+    "llm_pool",
+    "response_cache",
+    "scheduler",
+    "session_resources",
+    "streaming",
+    "conversation_memory",
+    "token_counter",
+    "ingest",
+    "compression",
+    "chunking",
+    "embedding_store",
+    "index_cache",
+    "knowledge_base",
+    "query_pipeline",
+    "tracing",
+    "summarize",
+    "langchain.chains",
+    "langchain.memory",
+]
+# Chat messages rendered per page of history
+CHAT_WINDOW = 20
+_warm_up_lock = threading.Lock()
+_warm_up_thread = None
 
-def open_file(filepath):
-    with open(filepath, 'r', encoding='utf-8') as infile:
-        return infile.read()
-
-def save_file(content, filepath):
-    with open(filepath, 'w', encoding='utf-8') as outfile:
-        outfile.write(content)
+CACHE_ROOT = os.environ.get("FUNDBRIDGE_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
 
-def create_temp_file(uploaded_file):
+def get_cache_dir(name):
     """
-    Create a temporary file from an uploaded file.
+    Return (and create) a named directory under the local cache root.
 
-    :param uploaded_file: The uploaded file to create a temporary file from.
+    :param name: The name of the cache, e.g. 'faiss'.
 
-    :return: The path to the temporary file.
+    :return: The path to the cache directory.
     """
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{uploaded_file.type.split('/')[1]}") as temp_file:
-        # Write the contents of the uploaded file to the temporary file
-        shutil.copyfileobj(uploaded_file, temp_file)
-    return temp_file.name
+    path = os.path.join(CACHE_ROOT, name)
+    os.makedirs(path, exist_ok=True)
+    return path
 
-def check_key_validity(api_key):
-    """
-    Check if an OpenAI API key is valid.
-
-    :param api_key: The OpenAI API key to check.
+def open_file(filepath):
+    with open(filepath, 'r', encoding='utf-8') as infile:
+        return infile.read()
 
-    :return: True if the API key is valid, False otherwise.
-    """
-    try:
-        ChatOpenAI(openai_api_key=api_key).call_as_llm('Hi')
-        print('API Key is valid')
-        return True
-    except Exception as e:
-        print('API key is invalid or OpenAI is having issues.')
-        print(e)
-        return False
+def save_file(content, filepath):
+    with open(filepath, 'w', encoding='utf-8') as outfile:
+        outfile.write(content)
 
 def validate_input(file, api_key):
     """
@@ -74,44 +86,110 @@ def validate_input(file, api_key):
         st.warning("Please upload a file.")
         return False
 
-    if not check_key_validity(api_key):
-        st.warning('Key not valid or API is down.')
+    result = key_validation.validate(api_key)
+    if result.status not in (key_validation.VALID, key_validation.RATE_LIMITED):
+        st.warning(result.message)
         return False
 
     return True
 
+def show_key_status(api_key):
+    """
+    Show the key's validation status in the sidebar without waiting for the check.
+
+    :param api_key: The OpenAI API key entered by the user.
+    """
+    result = key_validation.start(api_key)
+    if result.status == key_validation.INVALID:
+        st.sidebar.error(result.message)
+    elif result.status in (key_validation.RATE_LIMITED, key_validation.OUTAGE):
+        st.sidebar.warning(result.message)
+    elif result.status == key_validation.PENDING:
+        st.sidebar.caption(result.message)
+
 def num_tokens_from_string(string: str, encoding_name: str) -> int:
     """Returns the number of tokens in a text string."""
-    encoding = tiktoken.get_encoding(encoding_name)
-    num_tokens = len(encoding.encode(string))
-    return num_tokens
+    import token_counter
+    return token_counter.count_tokens(string, encoding_name)
+
+def _import_modules(modules):
+    for name in modules:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            LOGGER.warning("Warm-up import of %s failed: %s", name, e)
+            continue
+        LOGGER.debug("Warmed up %s in %.2fs", name, time.perf_counter() - start)
+
+def warm_up(modules=WARM_UP_MODULES):
+    """
+    Import the heavy modules on a background thread, once per process.
+
+    Call it after the page has rendered, so the imports overlap with the user reading the
+    page instead of delaying it.
+
+    :param modules: The module names to import.
+    """
+    global _warm_up_thread
+    with _warm_up_lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(target=_import_modules, args=(list(modules),), name="warm-up", daemon=True)
+            _warm_up_thread.start()
+
+def _show_earlier():
+    st.session_state["chat_visible"] += CHAT_WINDOW
 
 #decorator
 def enable_chat_history(func):
     if os.environ.get("OPENAI_API_KEY"):
+        import chat_history
+        history = chat_history.get_history()
 
         # to clear chat history after switching chatbot
         current_page = func.__qualname__
         if "current_page" not in st.session_state:
             st.session_state["current_page"] = current_page
         if st.session_state["current_page"] != current_page:
-            try:
-                st.cache_resource.clear()
-                del st.session_state["current_page"]
-                del st.session_state["messages"]
-            except:
-                pass
-
-        # to show chat history on ui
-        if "messages" not in st.session_state:
-            st.session_state["messages"] = [{"role": "assistant", "content": "How can I help you?"}]
-        for msg in st.session_state["messages"]:
+            # Only this session's chains and transcript; other users keep theirs
+            import llm_pool
+            llm_pool.clear_session()
+            history.clear()
+            st.session_state["current_page"] = current_page
+            st.session_state.pop("chat_visible", None)
+
+        # to show chat history on ui: the latest messages, with earlier ones paged in on request
+        if not len(history):
+            history.append("assistant", "How can I help you?")
+        visible = st.session_state.setdefault("chat_visible", CHAT_WINDOW)
+        if len(history) > visible:
+            st.button(f"Load earlier messages ({len(history) - visible} more)", on_click=_show_earlier)
+        for msg in history.messages(len(history) - visible):
             st.chat_message(msg["role"]).write(msg["content"])
 
     def execute(*args, **kwargs):
-        func(*args, **kwargs)
+        import session_resources
+        # A session answering a question is never evicted under it
+        with session_resources.active():
+            func(*args, **kwargs)
+        import response_cache
+        import scheduler
+        response_cache.show_stats()
+        scheduler.show_stats()
+        session_resources.checkpoint()
+        session_resources.show_usage()
     return execute
 
+def record_msg(msg, author):
+    """Add a message that is already on screen (e.g. a streamed answer) to the chat history.
+
+    Args:
+        msg (str): message to save
+        author (str): author of the message -user/assistant
+    """
+    import chat_history
+    chat_history.get_history().append(author, msg)
+
 def display_msg(msg, author):
     """Method to display message on the UI
 
@@ -119,9 +197,44 @@ def display_msg(msg, author):
         msg (str): message to display
         author (str): author of the message -user/assistant
     """
-    st.session_state.messages.append({"role": author, "content": msg})
+    record_msg(msg, author)
     st.chat_message(author).write(msg)
 
+def show_prompt_tokens(stream_handler, memory=None):
+    """
+    Show the prompt tokens of the last turn in the sidebar.
+
+    :param stream_handler: The StreamHandler that received the turn's LLM calls.
+
+    :param memory: The chain's BudgetedMemory, to compare the history sent with the full transcript.
+    """
+    caption = f"Last turn: {stream_handler.prompt_tokens} prompt tokens"
+    turn = memory.last_turn() if hasattr(memory, 'last_turn') else None
+    if turn:
+        caption += f", {turn['history_tokens']} of them history (full transcript: {turn['transcript_tokens']})"
+    st.sidebar.caption(caption)
+
+def show_trace(trace):
+    """
+    Show the latency breakdown of a request in a collapsed sidebar expander.
+
+    Set FUNDBRIDGE_TRACE_PANEL=0 to hide it; the trace is still exported.
+
+    :param trace: The tracing.Trace of the request.
+    """
+    if trace is None or not trace.spans or os.environ.get("FUNDBRIDGE_TRACE_PANEL", "1") == "0":
+        return
+    rows = ["| Stage | Starts at | Seconds | Runs | Tokens | Bytes |", "|---|---:|---:|---:|---:|---:|"]
+    for span in trace.ordered_spans():
+        tokens = span.attributes.get("tokens", span.attributes.get("prompt_tokens", 0) + span.attributes.get("completion_tokens", 0))
+        size = span.attributes.get("bytes")
+        rows.append(
+            f"| {span.name} | {span.start - trace.start:.2f}s | {span.seconds:.2f} | {span.count} "
+            f"| {tokens or ''} | {f'{size / 1e6:.1f} MB' if size else ''} |"
+        )
+    with st.sidebar.expander(f"Latency breakdown: {trace.seconds:.2f}s"):
+        st.markdown("\n".join(rows))
+
 def configure_openai_api_key():
     openai_api_key = st.sidebar.text_input(
         label="OpenAI API Key",
@@ -132,6 +245,8 @@ def configure_openai_api_key():
     if openai_api_key:
         st.session_state['OPENAI_API_KEY'] = openai_api_key
         os.environ['OPENAI_API_KEY'] = openai_api_key
+        show_key_status(openai_api_key)
+        warm_up()
     else:
         st.error("Please add your OpenAI API key to continue.")
         st.info("Obtain your key from this link: https://platform.openai.com/account/api-keys")
@@ -155,21 +270,26 @@ def select_openai_model():
     st.sidebar.markdown(model_description[selected_model])
     return selected_model
 
-def select_prompt():    
-    prompt_description = {
-        'short_default': 'Generic summary prompt. 100-150 word summary.',
-        'earnings': 'Prompt for Earnings Call Transcripts. Focused on financial metrics.',
-        'investment': 'Prompt to summarize an investment write-up.'
-        }
-        
+def select_prompt_name():
+    import prompts
+    available = prompts.get_prompts()
+
     # Drop-down menu
-    selected_prompt = st.selectbox(":blue[Select a prompt:]", list(prompt_description.keys()))
-    # Display the description of the selected model
-    st.markdown(prompt_description[selected_prompt])
+    selected_prompt = st.selectbox(":blue[Select a prompt:]", list(available))
+    # Display the description of the selected prompt
+    st.markdown(prompts.describe(selected_prompt))
+    return selected_prompt
+
+def select_prompt_names():
+    """Let the user pick several prompts, all of them by default; returns their names."""
+    import prompts
+    available = prompts.get_prompts()
+    selected = st.multiselect(":blue[Select the prompts:]", list(available), default=list(available))
+    for name in selected:
+        st.caption(f"**{name}**: {prompts.describe(name)}")
+    return selected
+
+def select_prompt():
     # Prompts pointing to prompt object
-    prompts = {
-        'short_default': PROMPT_short,
-        'earnings': PROMPT_earnings,
-        'investment': PROMPT_investment
-        }   
-    return prompts[selected_prompt]
\ No newline at end of file
+    import prompts
+    return prompts.get_prompts()[select_prompt_name()]
@@ -0,0 +1,161 @@
+"""
+FAISS index types for large document collections.
+
+The pages build a flat (exact) index while embedding, because it needs no training and
+can grow batch by batch. Once the corpus is complete it can be converted to:
+
+    flat   exact search, 4 bytes per dimension per vector
+    ivf    inverted lists over k-means cells; searches nprobe cells instead of everything
+    ivfpq  ivf with product-quantized vectors, dimension / 8 bytes per vector, lossy
+    hnsw   graph search; fast and accurate, but larger than flat
+
+The trained types need enough vectors to learn their cells, so below TRAIN_THRESHOLD
+vectors every type stays flat. Saved indexes are read back memory-mapped and read-only
+(see index_cache.load), so sessions share them instead of each holding a copy.
+"""
+
+import math
+import os
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ["auto", "flat", "ivf", "ivfpq", "hnsw"]
+TRAIN_THRESHOLD = int(os.environ.get("FUNDBRIDGE_INDEX_TRAIN_THRESHOLD", "20000"))
+# 'auto' picks this type once the corpus is past TRAIN_THRESHOLD
+AUTO_TYPE = "ivf"
+NPROBE = 16
+HNSW_NEIGHBORS = 32
+HNSW_EF_SEARCH = 64
+PQ_BITS = 8
+
+
+def resolve_type(index_type, count):
+    """
+    Return the index type actually built for a corpus.
+
+    :param index_type: One of INDEX_TYPES.
+
+    :param count: The number of vectors.
+
+    :return: 'flat' below TRAIN_THRESHOLD, otherwise the requested type ('auto' becomes AUTO_TYPE).
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r}, expected one of {INDEX_TYPES}")
+    if count < TRAIN_THRESHOLD or index_type == "flat":
+        return "flat"
+    return AUTO_TYPE if index_type == "auto" else index_type
+
+
+def _pq_subquantizers(dimension):
+    """The largest number of sub-quantizers up to dimension / 8 that divides the dimension."""
+    for m in range(max(1, dimension // 8), 0, -1):
+        if dimension % m == 0:
+            return m
+    return 1
+
+
+def build(vectors, index_type, nlist=None):
+    """
+    Build and fill a FAISS index of the given type.
+
+    :param vectors: A float32 array of shape (n, dimension).
+
+    :param index_type: One of INDEX_TYPES; resolved with resolve_type().
+
+    :param nlist: The number of IVF cells, defaults to about 4 * sqrt(n).
+
+    :return: The FAISS index, with the vectors added in order (position i is vector i).
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    count, dimension = vectors.shape
+    index_type = resolve_type(index_type, count)
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dimension)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, HNSW_NEIGHBORS)
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    else:
+        # Keep at least 39 training points per cell, as faiss recommends
+        nlist = nlist or max(1, min(int(4 * math.sqrt(count)), count // 39))
+        quantizer = faiss.IndexFlatL2(dimension)
+        if index_type == "ivf":
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist, _pq_subquantizers(dimension), PQ_BITS)
+        index.train(vectors)
+        index.nprobe = min(NPROBE, nlist)
+    index.add(vectors)
+    return index
+
+
+def convert(db, index_type):
+    """
+    Replace the flat index of a LangChain FAISS store with one of another type, in place.
+
+    Positions are kept, so db.index_to_docstore_id stays valid.
+
+    :param db: The FAISS vector store, built with a flat index.
+
+    :param index_type: One of INDEX_TYPES.
+
+    :return: describe() of the resulting index. An index that is not flat is left as is.
+    """
+    if isinstance(faiss.downcast_index(db.index), faiss.IndexFlat):
+        resolved = resolve_type(index_type, db.index.ntotal)
+        if resolved != "flat":
+            db.index = build(db.index.reconstruct_n(0, db.index.ntotal), resolved)
+    return describe(db.index)
+
+
+def describe(index):
+    """Return a short name for an index, e.g. 'IVF-PQ (1,024 cells, nprobe 16)'."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVFPQ):
+        return f"IVF-PQ ({index.nlist:,} cells, nprobe {index.nprobe})"
+    if isinstance(index, faiss.IndexIVFFlat):
+        return f"IVF ({index.nlist:,} cells, nprobe {index.nprobe})"
+    if isinstance(index, faiss.IndexHNSWFlat):
+        return f"HNSW (efSearch {index.hnsw.efSearch})"
+    return "flat"
+
+
+def read_mmap(path):
+    """
+    Read an index file memory-mapped and read-only.
+
+    The operating system shares the mapped pages between everything that reads the same
+    file, so the vectors are not copied into each session.
+
+    :param path: The index.faiss file.
+
+    :return: The FAISS index. Do not add to it; use faiss.clone_index() for a writable copy.
+    """
+    index = faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    tuned = faiss.downcast_index(index)
+    if isinstance(tuned, faiss.IndexIVF):
+        tuned.nprobe = min(NPROBE, tuned.nlist)
+    elif isinstance(tuned, faiss.IndexHNSW):
+        tuned.hnsw.efSearch = HNSW_EF_SEARCH
+    return index
+
+
+def search_params(index, allowed):
+    """
+    Return faiss search parameters that restrict a search to some positions.
+
+    :param index: The FAISS index to search.
+
+    :param allowed: A sorted int64 array of the positions that may be returned.
+
+    :return: SearchParameters for index.search(..., params=...). IVF indexes probe every
+        cell when the allowed set is small, since its vectors may sit in any of them.
+    """
+    selector = faiss.IDSelectorBatch(allowed)
+    tuned = faiss.downcast_index(index)
+    if isinstance(tuned, faiss.IndexIVF):
+        nprobe = tuned.nlist if len(allowed) < 0.05 * tuned.ntotal else tuned.nprobe
+        return faiss.SearchParametersIVF(sel=selector, nprobe=nprobe)
+    if isinstance(tuned, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=max(tuned.hnsw.efSearch, 4 * HNSW_EF_SEARCH))
+    return faiss.SearchParameters(sel=selector)